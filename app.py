@@ -1,29 +1,56 @@
+import time
+
+_T0 = time.perf_counter()  # início do processo, antes dos imports pesados
+
 import os
-import io
 import json
-import base64
 import logging
 import asyncio
-from datetime import datetime, timezone, timedelta
+from contextlib import contextmanager
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
 
-from dotenv import load_dotenv
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputFile, Update
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
+    CallbackContext,
     CallbackQueryHandler,
     ContextTypes,
     JobQueue,
     MessageHandler,
     filters,
     ChatJoinRequestHandler,
+    TypeHandler,
+)
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+import db
+from broadcast import Broadcaster, format_progress, progress
+from config import get_settings
+from experiments import load_experiment, variant_for
+from http_pool import SharedHTTPXRequest, get_http_pool
+import runtime_config
+from runtime_config import (
+    CB_ACESSAR_VIP,
+    CB_CONFIRM_SIM,
+    CB_VIP_DEPOSITAR,
+    CB_VIP_EXPLICAR,
+    CB_VIP_GARANTIR,
+    CB_VIP_PRINT,
+    DEFAULT_CRIAR_CONTA,
 )
-from telegram.request import HTTPXRequest
-import telegram
-from telegram.error import RetryAfter, TimedOut
-from openai import OpenAI
-from PIL import Image
-import aiohttp  # <-- para enviar pro Google Forms
+from exporter import GOOGLE_FORM_URL, EventExporter
+from image_pool import ImagePool, ImagePoolBusy
+from join_queue import JoinPipeline, JoinRequest
+from lifecycle import Lifecycle
+import tracing
+from media import ADMIN_SLOTS, MEDIA_SYNC_INTERVAL, MediaRegistry
+from shared_set import SHARED_SET_FLUSH_INTERVAL, SharedSet
+from traffic import RecordingQueue, UpdateRecorder
+from breaker import CircuitBreaker, CircuitOpen
+from utils import RateLimiter
+from validation import current_context
 
 # ========= LOGGING =========
 logging.basicConfig(
@@ -32,85 +59,46 @@ logging.basicConfig(
 )
 log = logging.getLogger("presente-vip-unificado")
 
-# ========= CONFIG =========
-load_dotenv()
-
-TOKEN = os.getenv("TELEGRAM_TOKEN") or os.getenv("TELEGRAM_BOT_TOKEN") or ""
-if not TOKEN:
-    raise RuntimeError("❌ Defina TELEGRAM_TOKEN (ou TELEGRAM_BOT_TOKEN) nas variáveis.")
-
-# username do bot, sem @ (ex: presentedamarlucebot)
-BOT_USERNAME = (os.getenv("BOT_USERNAME") or "").lstrip("@")
-if not BOT_USERNAME:
-    raise RuntimeError("❌ Defina BOT_USERNAME nas variáveis de ambiente (sem @).")
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-if not OPENAI_API_KEY:
-    log.warning("⚠️ OPENAI_API_KEY ausente — validação não funcionará.")
-client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# ========= STARTUP =========
+@contextmanager
+def startup_phase(name: str):
+    t = time.perf_counter()
+    yield
+    log.info("[STARTUP] %s: %.1f ms", name, (time.perf_counter() - t) * 1000)
 
-# Validação
-MIN_VALUE = float(os.getenv("MIN_DEPOSIT_VALUE", "35"))
-TZ_OFFSET = int(os.getenv("TZ_OFFSET_HOURS", "-3"))  # America/Sao_Paulo
 
+# ========= OPENAI (carregado só quando chega um print) =========
+_openai_client = None
 
-def today_str() -> str:
-    tz = timezone(timedelta(hours=TZ_OFFSET))
-    return datetime.now(tz).strftime("%d.%m.%y")
 
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None and get_settings().openai_api_key:
+        from openai import AsyncOpenAI
 
-# ========= TRACKING GOOGLE FORMS / SHEETS =========
-# Dados extraídos do link pré-preenchido que você mandou
-GOOGLE_FORM_URL = (
-    "https://docs.google.com/forms/d/e/"
-    "1FAIpQLScf3cwOS_PoUy1NMF5IrbNFF3QeXjjIuJMQ6PVbQyA0V8FM3g/formResponse"
-)
-
-FIELD_TIMESTAMP = "entry.1409657662"
-FIELD_CHAT_ID = "entry.1850402601"
-FIELD_STEP = "entry.1368055621"
-FIELD_EXTRA = "entry.772961359"
+        _openai_client = AsyncOpenAI(
+            api_key=get_settings().openai_api_key,
+            http_client=get_http_pool().client("openai"),
+            max_retries=2,
+        )
+    return _openai_client
 
 
+# ========= TRACKING (log local; exporter.py envia em lotes) =========
 async def track_event(chat_id: int, step: str, extra: dict | None = None):
-    timestamp = datetime.utcnow().isoformat()
-
-    payload = {
-        FIELD_TIMESTAMP: timestamp,
-        FIELD_CHAT_ID: str(chat_id),
-        FIELD_STEP: step,
-        FIELD_EXTRA: json.dumps(extra or {}, ensure_ascii=False),
-    }
-
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                GOOGLE_FORM_URL,
-                data=payload,
-                headers={
-                    "Content-Type": "application/x-www-form-urlencoded",
-                    "User-Agent": "Mozilla/5.0",
-                },
-                timeout=10,
-            ) as resp:
-                text = await resp.text()
-                log.info(f"[TRACK_EVENT] status={resp.status}")
-                if resp.status != 200:
-                    log.warning(f"[TRACK_EVENT] body (primeiros 300 chars): {text[:300]}")
-    except Exception as e:
-        log.warning(f"Erro ao enviar evento para o Google Sheets: {e}")
-
-
+    with tracing.span("track_event", event=step):
+        await asyncio.to_thread(
+            db.log_event,
+            chat_id,
+            step,
+            json.dumps(extra or {}, ensure_ascii=False),
+            datetime.utcnow().isoformat(),
+            variant_for(chat_id).name,
+        )
 
-# Links / mídias
-LINK_CADASTRO = (
-    "https://click.betboom.com/BdnxJncs?landing=2833&sub_id1=Telegram"
-)
-LINK_COMUNIDADE_FINAL = "https://wa.me/5511959589591?text=Oi%2C%20tudo%20bem%3F%20Quero%20meu%20presente%20do%20Jota"
-IMG1_URL = "https://i.postimg.cc/wxkkz20M/presente-do-jota.jpg"
-IMG2_URL = "https://i.postimg.cc/8kbbG4tT/presente-do-jota-2.png"
-WHATSAPP_VIP_LINK = "https://chat.whatsapp.com/ENHzDrexZW57aF3xJ6jyv"
 
+# Links, mídias, valor mínimo e teclados: runtime_config.py (recarregável sem restart)
 # Cache JSON para file_ids
 CACHE_PATH = os.path.join(os.path.dirname(__file__), "file_ids.json")
 
@@ -123,78 +111,38 @@ def load_cache() -> dict:
         return {}
 
 
-def save_cache(d: dict) -> None:
-    try:
-        with open(CACHE_PATH, "w", encoding="utf-8") as f:
-            json.dump(d, f)
-    except Exception as e:
-        log.warning("Não consegui salvar cache: %s", e)
-
-
-FILE_IDS = load_cache()
+# file_ids por slot: lidos da memória, gravados em lote no SQLite (media.py);
+# o file_ids.json antigo é importado no startup via load_cache()
+MEDIA = MediaRegistry()
 
 # ======== CONSTS / estados ========
-CB_CONFIRM_SIM = "confirm_sim"
-CB_ACESSAR_VIP = "vip_go"
-CB_VIP_GARANTIR = "vip_garantir"
-CB_VIP_EXPLICAR = "vip_explicar"
-CB_VIP_PRINT = "vip_print"
-CB_VIP_DEPOSITAR = "vip_depositar"
-
 WAIT_SECONDS = 5 * 60
 VIP_WAIT_SECONDS = 7 * 60
 
-VIP_PENDING_PRINT: set[int] = set()  # chats aguardando print
+VIP_PENDING_PRINT = SharedSet("vip_pending")  # chats aguardando print (carregado no post_init)
 
 AUDIO_FILE_LOCAL = "Audio.mp3"
 
 
-# ====== Botões ======
-def btn_criar_conta() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("🟢 Criar conta agora", url=LINK_CADASTRO)]]
-    )
+# ====== Botões (montados no snapshot da config, não a cada envio) ======
+def btn_criar_conta(text: str = DEFAULT_CRIAR_CONTA) -> InlineKeyboardMarkup:
+    return runtime_config.current().kb_criar_conta(text)
 
 
 def btn_comunidade_e_vip() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("🚀 Receber Benefícios", url=LINK_COMUNIDADE_FINAL)],
-            [InlineKeyboardButton("🟣 Acessar VIP", callback_data=CB_ACESSAR_VIP)],
-        ]
-    )
+    return runtime_config.current().kb_comunidade_e_vip
 
 
 def btn_vip_primeira_escolha() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("✅ Quero Garantir", callback_data=CB_VIP_GARANTIR)],
-            [InlineKeyboardButton("ℹ️ Me explica antes", callback_data=CB_VIP_EXPLICAR)],
-        ]
-    )
+    return runtime_config.current().kb_vip_primeira_escolha
 
 
 def btn_vip_print_deposito() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        [
-            [
-                InlineKeyboardButton(
-                    "🖼️ PRINT = LIBERAR VIP", callback_data=CB_VIP_PRINT
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    "💳 FAZER DEPÓSITO", callback_data=CB_VIP_DEPOSITAR
-                )
-            ],
-        ]
-    )
+    return runtime_config.current().kb_vip_print_deposito
 
 
 def btn_whatsapp_vip() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("🎉 Entrar na Comunidade VIP", url=WHATSAPP_VIP_LINK)]]
-    )
+    return runtime_config.current().kb_whatsapp_vip
 
 
 def btn_liberar_presente() -> InlineKeyboardMarkup:
@@ -202,35 +150,31 @@ def btn_liberar_presente() -> InlineKeyboardMarkup:
     Botão que dispara o /start via deep-link.
     Quando o usuário clica, o Telegram envia /start presente para o bot.
     """
-    return InlineKeyboardMarkup(
-        [
-            [
-                InlineKeyboardButton(
-                    "🎁 Liberar presente",
-                    url=f"https://t.me/{BOT_USERNAME}?start=presente",
-                )
-            ]
-        ]
-    )
+    return runtime_config.current().kb_liberar_presente
 
 
 # ====== Retry ======
-async def _retry_send(coro_factory, max_attempts: int = 2):
-    last = None
-    for _ in range(max_attempts):
+async def _retry_send(coro_factory, max_attempts: int = 3):
+    """
+    RetryAfter: espera o que o Telegram mandou. TimedOut (inclusive pool
+    cheio): backoff curto. Qualquer outro erro sobe direto.
+    """
+    for attempt in range(1, max_attempts + 1):
         try:
             return await coro_factory()
-        except (RetryAfter, TimedOut) as e:
-            last = e
-            await asyncio.sleep(1)
-        except telegram.error.RetryAfter as e:
-            last = e
+        except RetryAfter as e:
+            if attempt == max_attempts:
+                raise
             await asyncio.sleep(e.retry_after)
-        except Exception as e:
-            last = e
-            break
-    if last:
-        raise last
+        except TimedOut:
+            if attempt == max_attempts:
+                raise
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+
+
+def invalid_file_id(e: Exception) -> bool:
+    """O Telegram recusou o file_id em si (apagado/de outro bot), e não uma falha de rede."""
+    return isinstance(e, BadRequest) and "file identifier" in e.message.lower()
 
 
 # ====== envio de foto via URL + cache de file_id ======
@@ -242,7 +186,7 @@ async def send_photo_from_url(
     caption: str | None = None,
     reply_markup: InlineKeyboardMarkup | None = None,
 ):
-    fid = FILE_IDS.get(file_id_key)
+    fid = MEDIA.get(file_id_key)
     try:
         if fid:
             return await _retry_send(
@@ -266,9 +210,10 @@ async def send_photo_from_url(
         )
 
         if msg and msg.photo:
-            FILE_IDS[file_id_key] = msg.photo[-1].file_id
-            save_cache(FILE_IDS)
+            MEDIA.set(file_id_key, msg.photo[-1].file_id)
         return msg
+    except Forbidden:
+        raise  # bloqueou o bot: a mensagem não vai chegar por nenhum caminho
     except Exception as e:
         log.warning("Falha ao enviar foto: %s", e)
 
@@ -278,23 +223,28 @@ async def send_audio_fast(
     context,
     chat_id: int,
     caption: str | None = None,
-    var_name: str = "FILE_ID_AUDIO",
+    media_key: str = "audio",
 ):
-    fid_env = os.getenv(var_name) or ""
-    if fid_env:
+    fid_config = runtime_config.current().media.get(media_key)
+    if fid_config:
         try:
             return await _retry_send(
                 lambda: context.bot.send_audio(
                     chat_id=chat_id,
-                    audio=fid_env,
+                    audio=fid_config,
                     caption=caption,
                 )
             )
+        except Forbidden:
+            raise
         except Exception as e:
-            log.warning("%s falhou: %s", var_name, e)
+            log.warning("file_id configurado de %s falhou: %s", media_key, e)
 
-    fid_cache = FILE_IDS.get("audio")
-    if fid_cache:
+    # slot pedido e, na falta dele, o áudio padrão (como o upload do Audio.mp3 abaixo)
+    for key in dict.fromkeys((media_key, "audio")):
+        fid_cache = MEDIA.get(key)
+        if not fid_cache:
+            continue
         try:
             return await _retry_send(
                 lambda: context.bot.send_audio(
@@ -304,8 +254,11 @@ async def send_audio_fast(
                 )
             )
         except Exception as e:
-            FILE_IDS.pop("audio", None)
-            save_cache(FILE_IDS)
+            # só um file_id inválido limpa o slot; rede fora não apaga a mídia de todo mundo
+            if not invalid_file_id(e):
+                raise
+            log.warning("file_id de %s v%s inválido: %s", key, MEDIA.version(key), e)
+            MEDIA.discard(key)
 
     full = os.path.join(os.path.dirname(__file__), AUDIO_FILE_LOCAL)
     if os.path.exists(full) and os.path.getsize(full) > 0:
@@ -318,93 +271,117 @@ async def send_audio_fast(
                 )
             )
         if msg and msg.audio:
-            FILE_IDS["audio"] = msg.audio.file_id
-            save_cache(FILE_IDS)
+            MEDIA.set("audio", msg.audio.file_id)
         return msg
 
 
 # ====== Vídeos ======
 async def send_video_by_slot(context, chat_id: int, slot: str):
-    idx = slot.replace("video", "")
-    for name in [f"FILE_ID_VIDEO{idx}", f"FILE_ID_VIDEO0{idx}"]:
-        fid = os.getenv(name) or ""
-        if fid:
-            try:
-                return await _retry_send(
-                    lambda: context.bot.send_video(chat_id=chat_id, video=fid)
-                )
-            except Exception as e:
-                log.warning("%s falhou: %s", name, e)
+    fid = runtime_config.current().media.get(slot)
+    if fid:
+        try:
+            return await _retry_send(
+                lambda: context.bot.send_video(chat_id=chat_id, video=fid)
+            )
+        except Forbidden:
+            raise
+        except Exception as e:
+            log.warning("file_id configurado de %s falhou: %s", slot, e)
 
-    fid_cache = FILE_IDS.get(slot)
+    fid_cache = MEDIA.get(slot)
     if fid_cache:
         try:
             return await _retry_send(
                 lambda: context.bot.send_video(chat_id=chat_id, video=fid_cache)
             )
+        except Forbidden:
+            raise
         except Exception as e:
-            FILE_IDS.pop(slot, None)
-            save_cache(FILE_IDS)
+            log.warning("file_id de %s v%s falhou: %s", slot, MEDIA.version(slot), e)
+            if invalid_file_id(e):
+                MEDIA.discard(slot)  # rede fora não apaga o vídeo de todo mundo
+            return None
+
+    log.warning("Nenhum file_id para %s; vídeo não enviado", slot)
+    return False  # nada a enviar (não é falha de envio)
+
+
+# ====== Mídias (só admins) ======
+def media_of(msg) -> tuple[str, str] | tuple[None, None]:
+    """(tipo, file_id) de uma mensagem com áudio/voz ou vídeo."""
+    if msg.audio or msg.voice:
+        return "audio", (msg.audio or msg.voice).file_id
+    doc_video = msg.document if msg.document and (msg.document.mime_type or "").startswith("video/") else None
+    vid = msg.video or doc_video or msg.video_note
+    if vid:
+        return "video", vid.file_id
+    return None, None
 
 
-# ====== Captura ======
-async def capture_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def capture_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin mandou áudio/vídeo: mostra o file_id e como atribuir a um slot."""
     msg = update.effective_message
-    fid = (
-        msg.audio.file_id
-        if msg.audio
-        else (msg.voice.file_id if msg.voice else None)
-    )
+    kind, fid = media_of(msg)
     if not fid:
         return
-
-    FILE_IDS["audio"] = fid
-    save_cache(FILE_IDS)
-    await _retry_send(
-        lambda: context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=f"🎧 Áudio salvo!\nFILE_ID_AUDIO=\n{fid}",
-        )
+    slots = " | ".join(f"{s} (v{MEDIA.version(s)})" for s, k in ADMIN_SLOTS.items() if k == kind)
+    await msg.reply_text(
+        f"{'🎧 Áudio' if kind == 'audio' else '🎬 Vídeo'} recebido.\nFILE_ID=\n{fid}\n\n"
+        f"Responda a esta mensagem com /setmedia <slot> para usar no funil: {slots}"
     )
 
 
-async def capture_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def setmedia_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/setmedia <slot> respondendo a um áudio/vídeo."""
     msg = update.effective_message
-
-    vid = (
-        msg.video
-        or (
-            msg.document
-            if msg.document
-            and (msg.document.mime_type or "").startswith("video/")
-            else None
-        )
-        or msg.video_note
-    )
-
-    if not vid:
+    slot = (context.args or [""])[0]
+    kind, fid = media_of(msg.reply_to_message) if msg.reply_to_message else (None, None)
+    if slot not in ADMIN_SLOTS or not fid:
+        await msg.reply_text(f"Uso: responda a um áudio/vídeo com /setmedia <slot>\nSlots: {', '.join(ADMIN_SLOTS)}")
+        return
+    if kind != ADMIN_SLOTS[slot]:
+        await msg.reply_text(f"O slot {slot} aceita {ADMIN_SLOTS[slot]}, não {kind}.")
         return
 
-    fid = vid.file_id
+    version = MEDIA.set(slot, fid, by=update.effective_user.id)
+    log.info("[MÍDIA] %s v%s definido por %s", slot, version, update.effective_user.id)
+    text = f"✅ {slot} agora está na v{version}."
+    if runtime_config.current().media.get(slot):
+        text += "\n⚠️ Há um file_id para esse slot no ambiente/CONFIG_FILE, e ele tem prioridade."
+    await msg.reply_text(text)
+
+
+async def media_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/media: slots, versão e de onde vem o file_id usado."""
+    cfg = runtime_config.current().media
+    lines = []
+    for slot in ADMIN_SLOTS:
+        if cfg.get(slot):
+            source = "config"
+        elif MEDIA.get(slot):
+            source = f"v{MEDIA.version(slot)}"
+        else:
+            source = "vazio"
+        lines.append(f"{slot}: {source}")
+    await update.effective_message.reply_text("🎛️ Mídias do funil\n" + "\n".join(lines))
+
+
+async def rollback_media_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/rollbackmedia <slot>: volta o file_id da versão anterior (como uma versão nova)."""
+    msg = update.effective_message
+    slot = (context.args or [""])[0]
+    if slot not in ADMIN_SLOTS:
+        await msg.reply_text(f"Uso: /rollbackmedia <slot>\nSlots: {', '.join(ADMIN_SLOTS)}")
+        return
 
-    for key in ("video1", "video2", "video3"):
-        if not FILE_IDS.get(key):
-            FILE_IDS[key] = fid
-            save_cache(FILE_IDS)
-            await _retry_send(
-                lambda: context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text=f"🎬 Vídeo salvo em {key}!\nFILE_ID=\n{fid}",
-                )
-            )
-            break
-    else:
-        await _retry_send(
-            lambda: context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=f"🎬 Recebi um vídeo.\nFILE_ID=\n{fid}",
-            )
-        )
+    history = await MEDIA.history(slot, limit=2)
+    if len(history) < 2:
+        await msg.reply_text(f"{slot} não tem versão anterior.")
+        return
+    previous = history[1]
+    version = MEDIA.set(slot, previous["file_id"], by=update.effective_user.id)
+    log.info("[MÍDIA] %s v%s = v%s (rollback por %s)", slot, version, previous["version"], update.effective_user.id)
+    await msg.reply_text(f"↩️ {slot} voltou ao conteúdo da v{previous['version']} (agora v{version}).")
 
 
 # ====== VIP follow-up ======
@@ -414,20 +391,22 @@ def schedule_vip_followup(context, chat_id: int):
 
     context.application.job_queue.run_once(
         vip_followup_job,
-        when=VIP_WAIT_SECONDS,
+        when=variant_for(chat_id).get("vip_wait_seconds", VIP_WAIT_SECONDS),
         data={"chat_id": chat_id},
         name=f"vip:{chat_id}",
     )
 
 
+@tracing.traced_job
 async def vip_followup_job(context: ContextTypes.DEFAULT_TYPE):
     chat_id = context.job.data["chat_id"]
     if chat_id not in VIP_PENDING_PRINT:
         return
 
-    txt = (
+    txt = variant_for(chat_id).get(
+        "vip_followup_text",
         "Eii, tá por aí? Não sei se você esqueceu, mas são pelo menos R$500 sorteados "
-        "para 10 pessoas + 1 chance na roleta que pode te dar até um IPHONE 17 PRO HOJE!"
+        "para 10 pessoas + 1 chance na roleta que pode te dar até um IPHONE 17 PRO HOJE!",
     )
 
     await _retry_send(
@@ -446,14 +425,9 @@ async def ask_vip_print(context, chat_id: int):
 
     await track_event(chat_id, "vip_pediu_print")
 
-    txt = (
-        "Todas essas pessoas fizeram parte e ganharam um prêmio muito bom, "
-        "escolheram jogar comigo em um grupo com mais acesso!\n\n"
-        "Vou estar aguardando um print da sua conta Betboom (Mostrando detalhes do Depósito) "
-        "com pelo menos R$35 depositados hoje e já libero seu acesso à roleta, ok?"
-    )
+    txt = variant_for(chat_id).get("vip_ask_print_text", runtime_config.current().ask_print_text)
 
-    await _retry_send(
+    msg = await _retry_send(
         lambda: context.bot.send_message(
             chat_id=chat_id,
             text=txt,
@@ -463,46 +437,146 @@ async def ask_vip_print(context, chat_id: int):
     )
 
     schedule_vip_followup(context, chat_id)
+    return msg
 
 
-async def _vip_send_media_and_request(context, chat_id: int):
-    await track_event(chat_id, "vip_media_iniciada")
+# ====== Estado do funil (users.stage) ======
+async def funnel_step(chat_id: int, flow: str, step: str, send, data: dict | None = None) -> bool:
+    """
+    Roda um passo do funil gravando o estado do chat antes ("running") e
+    depois ("done"/"failed"). `send` devolve None quando o envio falhou.
+    Um passo parado ou com falha é retomado pelo reconcile_funnels().
+    """
+    stage = f"{flow}:{step}"
+    with tracing.span(f"funnel.{stage}") as attrs:
+        await asyncio.to_thread(db.set_stage, chat_id, stage, "running", data)
+        try:
+            ok = await send() is not None
+            status = "done" if ok else "failed"
+        except Forbidden:
+            # bloqueou o bot: o funil para aqui e o reconciliador não insiste
+            await asyncio.to_thread(db.mark_users_blocked, [chat_id], time.time())
+            ok, status = False, "blocked"
+        except Exception as e:
+            log.warning("Passo %s de %s falhou: %s", stage, chat_id, e)
+            ok, status = False, "failed"
+        await asyncio.to_thread(db.set_stage, chat_id, stage, status)
+        if status != "done":
+            attrs["error"] = status
+    return ok
 
-    await send_audio_fast(
-        context,
-        chat_id,
-        caption="🔊 Explicação rápida (1 min)",
-        var_name="FILE_ID_AUDIO_VIP",
-    )
-    await send_video_by_slot(context, chat_id, "video1")
 
-    await track_event(chat_id, "vip_media_enviada")
+def remaining_steps(steps: tuple[str, ...], resume_from: str | None) -> tuple[str, ...]:
+    if resume_from in steps:
+        return steps[steps.index(resume_from):]
+    return steps
+
+
+VIP_STEPS = ("audio", "video", "ask_print")
+
 
-    await ask_vip_print(context, chat_id)
+async def _vip_send_media_and_request(context, chat_id: int, resume_from: str | None = None):
+    """Áudio + vídeo + pedido do print; cada passo com estado em users.stage."""
+    todo = remaining_steps(VIP_STEPS, resume_from)
+    variant = variant_for(chat_id)
+
+    if "audio" in todo:
+        await track_event(chat_id, "vip_media_iniciada")
+        sent = await funnel_step(
+            chat_id, "vip", "audio",
+            lambda: send_audio_fast(
+                context,
+                chat_id,
+                caption=variant.get("vip_audio_caption", "🔊 Explicação rápida (1 min)"),
+                media_key="audio_vip",
+            ),
+        )
+        if not sent:
+            return
+
+    if "video" in todo:
+        sent = await funnel_step(
+            chat_id, "vip", "video",
+            lambda: send_video_by_slot(context, chat_id, variant.get("vip_video_slot", "video1")),
+        )
+        if not sent:
+            return
+        await track_event(chat_id, "vip_media_enviada")
+
+    await funnel_step(chat_id, "vip", "ask_print", lambda: ask_vip_print(context, chat_id))
 
 
 # ====== Validação OpenAI ======
-def _to_data_url(raw: bytes) -> str:
-    img = Image.open(io.BytesIO(raw))
-    if img.mode in ("P", "RGBA"):
-        img = img.convert("RGB")
+# OpenAI lenta ou fora: o circuito abre, prints vão para a fila (print_queue) com
+# um "já te confirmo" e o drain_print_queue valida depois, em ritmo controlado
+def openai_unavailable(e: BaseException) -> bool:
+    """OpenAI fora (vale esperar e tentar de novo) x pedido recusado (4xx: tentar de novo não muda nada)."""
+    import openai
+
+    if isinstance(e, (CircuitOpen, asyncio.TimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+
+OPENAI_BREAKER = CircuitBreaker("openai", is_failure=openai_unavailable)  # limites vêm do Settings no post_init
+PRINT_DRAIN_INTERVAL = 10
+PRINT_DRAIN_BATCH = 20
+
+
+async def ask_openai(client, ctx, data_url: str, digest: str) -> str:
+    text_resp = ctx.results.get(digest)
+    if text_resp is None:
+        with tracing.span("openai.responses", model="gpt-4o"):
+            r = await OPENAI_BREAKER.call(
+                lambda: client.responses.create(
+                    model="gpt-4o",
+                    input=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "input_text", "text": ctx.prompt},
+                                {"type": "input_image", "image_url": data_url},
+                            ],
+                        }
+                    ],
+                    temperature=0,
+                )
+            )
+
+        text_resp = r.output_text.strip()
+        ctx.remember(digest, text_resp)
+    return text_resp
+
+
+def validation_context():
+    # prompt/datas/valor mínimo do dia: recalculados só na virada da meia-noite
+    settings = get_settings()
+    return current_context(settings.tz_offset_hours, runtime_config.current().min_deposit_value)
+
 
-    buf = io.BytesIO()
-    img.save(buf, format="PNG", optimize=True)
-    buf.seek(0)
-    b64 = base64.b64encode(buf.read()).decode("utf-8")
-    return f"data:image/png;base64,{b64}"
+async def queue_print(context, chat_id: int, file_id: str):
+    await asyncio.to_thread(db.queue_print, chat_id, file_id, time.time())
+    VIP_PENDING_PRINT.discard(chat_id)  # sem lembrete de "cadê o print?" enquanto está na fila
+    await track_event(chat_id, "vip_print_enfileirado")
+    await _retry_send(
+        lambda: context.bot.send_message(
+            chat_id=chat_id,
+            text="📸 Print recebido! A conferência está um pouco lenta agora, te confirmo aqui em instantes. ⏳",
+        )
+    )
 
 
 async def validate_print_and_reply(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
     raw: bytes,
+    file_id: str,
 ):
     chat_id = update.effective_chat.id
     if chat_id not in VIP_PENDING_PRINT:
         return
 
+    client = get_openai_client()
     if not client:
         await _retry_send(
             lambda: context.bot.send_message(
@@ -513,36 +587,51 @@ async def validate_print_and_reply(
         VIP_PENDING_PRINT.discard(chat_id)
         return
 
-    data_url = _to_data_url(raw)
+    if not OPENAI_BREAKER.ready():
+        await queue_print(context, chat_id, file_id)
+        return
 
-    rules = (
-        "Considere APROVADO se status='Concluído', valor >= "
-        f"{MIN_VALUE:.2f} e a data do depósito é IGUAL a {today_str()}."
-    )
+    pool: ImagePool = context.application.bot_data["image_pool"]
+    try:
+        with tracing.span("pillow.to_data_url", bytes=len(raw)):
+            data_url, digest = await pool.to_data_url(raw)
+    except (ImagePoolBusy, asyncio.TimeoutError, BrokenProcessPool) as e:
+        log.warning("Print de %s não processado: %s", chat_id, e)
+        await _retry_send(
+            lambda: context.bot.send_message(
+                chat_id=chat_id,
+                text="⏳ Recebi muitos prints agora. Me envia de novo em 1 minutinho, por favor! 📸",
+            )
+        )
+        return
+    except Exception as e:
+        # imagem corrompida/ilegível (ex.: UnidentifiedImageError): pede o print de novo
+        log.warning("Print de %s ilegível: %r", chat_id, e)
+        await ask_print_again(context, chat_id)
+        return
 
-    prompt = (
-        "Analise APENAS o item de Depósito que está expandido (seta para cima). "
-        "Extraia valor (número), data/hora (texto) e status. "
-        + rules
-        + " Responda curto em PT-BR:\n- Valor\n- Data/hora\n"
-          "- Resultado: Aprovado/Reprovado (explique motivo se reprovar)."
-    )
+    ctx = validation_context()
+    try:
+        text_resp = await ask_openai(client, ctx, data_url, digest)
+    except Exception as e:
+        if not openai_unavailable(e):
+            log.warning("OpenAI recusou o print de %s: %r", chat_id, e)
+            await ask_print_again(context, chat_id)
+            return
+        log.warning("Validação do print de %s falhou (%r); enfileirando", chat_id, e)
+        await queue_print(context, chat_id, file_id)
+        return
 
-    r = client.responses.create(
-        model="gpt-4o",
-        input=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "input_text", "text": prompt},
-                    {"type": "input_image", "image_url": data_url},
-                ],
-            }
-        ],
-        temperature=0,
-    )
+    await reply_print_result(context, chat_id, ctx, text_resp)
 
-    text_resp = r.output_text.strip()
+
+async def reply_print_result(context, chat_id: int, ctx, text_resp: str):
+    min_value = ctx.min_value
+    approved = "aprovado" in text_resp.lower()
+    # regra da data conferida aqui (lookup no conjunto de formatos aceitos de hoje)
+    if approved and ctx.date_is_today(text_resp) is False:
+        approved = False
+        text_resp += f"\n\n❌ Reprovado: a data do depósito não é de hoje ({ctx.day:%d/%m/%Y})."
 
     await _retry_send(
         lambda: context.bot.send_message(
@@ -553,7 +642,7 @@ async def validate_print_and_reply(
 
     VIP_PENDING_PRINT.discard(chat_id)
 
-    if "aprovado" in text_resp.lower():
+    if approved:
         await track_event(chat_id, "vip_print_aprovado")
 
         congrats = (
@@ -576,7 +665,7 @@ async def validate_print_and_reply(
         "⚠️ Reprovado.\n"
         "Por favor, envie *novamente* o print do depósito com o item *expandido* "
         "(seta para cima), "
-        f"mostrando status Concluído e valor ≥ R${MIN_VALUE:.0f} de hoje. "
+        f"mostrando status Concluído e valor ≥ R${min_value:.0f} de hoje. "
         "Assim que chegar, eu valido de novo. 📸"
     )
 
@@ -593,17 +682,100 @@ async def validate_print_and_reply(
     schedule_vip_followup(context, chat_id)
 
 
+async def ask_print_again(context, chat_id: int):
+    VIP_PENDING_PRINT.add(chat_id)
+    await _retry_send(
+        lambda: context.bot.send_message(
+            chat_id=chat_id,
+            text="⚠️ Não consegui abrir o print que você mandou. Me envia de novo, por favor? 📸",
+            reply_markup=btn_vip_print_deposito(),
+        )
+    )
+
+
+async def drop_queued_print(context, chat_id: int, file_id: str):
+    await asyncio.to_thread(db.dequeue_print, chat_id, file_id)
+    await ask_print_again(context, chat_id)
+
+
+async def drain_print_queue(context: ContextTypes.DEFAULT_TYPE):
+    """Valida os prints enfileirados com o circuito aberto, no ritmo do PRINT_DRAIN_RATE."""
+    client = get_openai_client()
+    if not client or not OPENAI_BREAKER.ready():
+        return
+    partition, partitions = context.application.bot_data.get("partition", (0, 1))
+    rows = await asyncio.to_thread(db.queued_prints, PRINT_DRAIN_BATCH, partition, partitions)
+    if not rows:
+        return
+
+    limiter: RateLimiter = context.application.bot_data["print_drain_limiter"]
+    pool: ImagePool = context.application.bot_data["image_pool"]
+    ctx = validation_context()
+    done = 0
+    for row in rows:
+        chat_id, file_id = row["chat_id"], row["file_id"]
+        await limiter.acquire()
+        with tracing.trace("job.drain_print_queue", chat=chat_id):
+            try:
+                f = await context.bot.get_file(file_id)
+                raw = bytes(await f.download_as_bytearray())
+                with tracing.span("pillow.to_data_url", bytes=len(raw)):
+                    data_url, digest = await pool.to_data_url(raw)
+            except BadRequest as e:
+                log.warning("Print enfileirado de %s descartado: %s", chat_id, e)
+                await drop_queued_print(context, chat_id, file_id)
+                continue
+            except (ImagePoolBusy, asyncio.TimeoutError, BrokenProcessPool, NetworkError) as e:
+                log.warning("[PRINTS] fila pausada após %s validados: %r", done, e)
+                return
+            except Exception as e:
+                # file_id expirado ou imagem ilegível: não adianta insistir, pede o print de novo
+                log.warning("Print enfileirado de %s descartado: %s", chat_id, e)
+                await drop_queued_print(context, chat_id, file_id)
+                continue
+
+            try:
+                text_resp = await ask_openai(client, ctx, data_url, digest)
+            except Exception as e:
+                if not openai_unavailable(e):
+                    # recusa do pedido (4xx): sai da fila para não travar os prints de trás
+                    log.warning("OpenAI recusou o print enfileirado de %s: %r", chat_id, e)
+                    await drop_queued_print(context, chat_id, file_id)
+                    continue
+                # continua na fila; o próximo ciclo (ou o próximo teste do circuito) retoma daqui
+                log.warning("[PRINTS] fila pausada após %s validados: %r", done, e)
+                return
+
+            await asyncio.to_thread(db.dequeue_print, chat_id, file_id)
+            await track_event(chat_id, "vip_print_desenfileirado", {"espera_s": round(time.time() - row["queued_at"])})
+            await reply_print_result(context, chat_id, ctx, text_resp)
+            done += 1
+
+    if done:
+        log.info("[PRINTS] %s prints da fila validados", done)
+
+
 # ====== FUNIL INICIAL ======
+START_STEPS = ("intro", "audio", "video", "image", "followup")
+
+
 async def run_start_flow(
     context: ContextTypes.DEFAULT_TYPE,
     chat_id: int,
     first_name: str | None = None,
     skip_intro_text: bool = False,
+    resume_from: str | None = None,
 ):
     """
     Se skip_intro_text=True, começa direto do áudio pra frente.
+    Cada passo grava o estado do chat (users.stage) e o funil para no primeiro
+    que falhar; resume_from retoma dali (startup e reconcile_funnels).
     """
-    if not skip_intro_text:
+    todo = remaining_steps(START_STEPS, resume_from)
+    data = {"first_name": first_name, "skip_intro_text": skip_intro_text}
+    variant = variant_for(chat_id)
+
+    if "intro" in todo and not skip_intro_text:
         saudacao = (
             f"Falaaa {first_name}, tá por aí? 👋"
             if first_name
@@ -618,53 +790,87 @@ async def run_start_flow(
             "seu presente de hoje 👇"
         )
 
-        await _retry_send(
-            lambda: context.bot.send_message(
-                chat_id=chat_id,
-                text=texto,
-                parse_mode="Markdown",
-            )
+        sent = await funnel_step(
+            chat_id, "start", "intro",
+            lambda: _retry_send(
+                lambda: context.bot.send_message(
+                    chat_id=chat_id,
+                    text=texto,
+                    parse_mode="Markdown",
+                )
+            ),
+            data,
         )
+        if not sent:
+            return
 
         await track_event(chat_id, "intro_text_enviado")
 
     # Daqui pra frente é "só áudio pra frente"
-    await send_audio_fast(
-        context,
-        chat_id,
-        caption="🔊 Mensagem rápida antes de continuar",
-        var_name="FILE_ID_AUDIO",
-    )
-
-    await track_event(chat_id, "audio_inicial_enviado")
-
-        # ⬇️ NOVO: vídeo logo depois da primeira imagem
-    await send_video_by_slot(context, chat_id, "video2")
-    await track_event(chat_id, "video_pos_primeira_imagem_enviado")
-
-    caption = (
-        "🎁 Presente do JOTA aguardando…\n\n"
-        "Essa caixa é valiosa e vai te render muitos outros prêmios que vai colocar muito dinheiro no seu bolso dentro das lives, é só você seguir os próximos passos clicando no botão abaixo!"
-    )
-
-    await send_photo_from_url(
-        context,
-        chat_id,
-        "img1",
-        IMG1_URL,
-        caption,
-        btn_criar_conta(),
-    )
+    if "audio" in todo:
+        sent = await funnel_step(
+            chat_id, "start", "audio",
+            lambda: send_audio_fast(
+                context,
+                chat_id,
+                caption=variant.get("start_audio_caption", "🔊 Mensagem rápida antes de continuar"),
+                media_key="audio",
+            ),
+            data,
+        )
+        if not sent:
+            return
 
-    await track_event(chat_id, "imagem_presente_enviada")
+        await track_event(chat_id, "audio_inicial_enviado")
 
-    context.application.job_queue.run_once(
-        send_followup_job,
-        when=WAIT_SECONDS,
-        data={"chat_id": chat_id},
-    )
+    # ⬇️ NOVO: vídeo logo depois da primeira imagem
+    if "video" in todo:
+        sent = await funnel_step(
+            chat_id, "start", "video",
+            lambda: send_video_by_slot(context, chat_id, variant.get("start_video_slot", "video2")),
+            data,
+        )
+        if not sent:
+            return
+        await track_event(chat_id, "video_pos_primeira_imagem_enviado")
+
+    if "image" in todo:
+        caption = variant.get(
+            "img1_caption",
+            "🎁 Presente do JOTA aguardando…\n\n"
+            "Essa caixa é valiosa e vai te render muitos outros prêmios que vai colocar muito dinheiro no seu bolso dentro das lives, é só você seguir os próximos passos clicando no botão abaixo!",
+        )
 
+        sent = await funnel_step(
+            chat_id, "start", "image",
+            lambda: send_photo_from_url(
+                context,
+                chat_id,
+                "img1",
+                runtime_config.current().img1_url,
+                caption,
+                btn_criar_conta(variant.get("btn_criar_conta", DEFAULT_CRIAR_CONTA)),
+            ),
+            data,
+        )
+        if not sent:
+            return
+
+        await track_event(chat_id, "imagem_presente_enviada")
+
+    async def schedule_followup():
+        # idempotente: retomar este passo não agenda o follow-up duas vezes
+        name = f"followup:{chat_id}"
+        if not context.application.job_queue.get_jobs_by_name(name):
+            context.application.job_queue.run_once(
+                send_followup_job,
+                when=variant.get("wait_seconds", WAIT_SECONDS),
+                data={"chat_id": chat_id},
+                name=name,
+            )
+        return name
 
+    await funnel_step(chat_id, "start", "followup", schedule_followup, data)
 
 
 # ====== Handlers ======
@@ -679,30 +885,47 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     from_presente = len(args) > 0 and args[0] == "presente"
 
     await track_event(chat_id, "start", {"from_presente": from_presente})
+    user = update.effective_user
+    if user:
+        await asyncio.to_thread(
+            db.upsert_user, chat_id, user.username, user.full_name, "presente" if from_presente else "start"
+        )
 
     # aqui você pode diferenciar o comportamento se quiser
     # por enquanto, sempre começa direto do áudio pra frente
     skip_intro = True
 
-    await run_start_flow(
-        context,
-        chat_id,
-        first,
-        skip_intro_text=skip_intro,
+    # roda em background: o update é liberado na hora e o drain() acompanha o funil
+    context.application.bot_data["lifecycle"].spawn(
+        run_start_flow(
+            context,
+            chat_id,
+            first,
+            skip_intro_text=skip_intro,
+        ),
+        name=f"start:{chat_id}",
+        on_reject=lambda: db.set_stage(
+            chat_id, "start:intro", "running", {"first_name": first, "skip_intro_text": skip_intro}
+        ),
     )
 
 
+@tracing.traced_job
 async def send_followup_job(context: ContextTypes.DEFAULT_TYPE):
     chat_id = context.job.data["chat_id"]
+    variant = variant_for(chat_id)
 
     await track_event(chat_id, "followup_conta_enviado")
 
     await _retry_send(
         lambda: context.bot.send_message(
             chat_id=chat_id,
-            text="E aí, você já conseguiu criar sua conta e resgatar os 10 giros que eu deixei pra você?",
+            text=variant.get(
+                "followup_text",
+                "E aí, você já conseguiu criar sua conta e resgatar os 10 giros que eu deixei pra você?",
+            ),
             reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("✅ SIM", callback_data=CB_CONFIRM_SIM)]]
+                [[InlineKeyboardButton(variant.get("btn_confirm_sim", "✅ SIM"), callback_data=CB_CONFIRM_SIM)]]
             ),
         )
     )
@@ -715,17 +938,18 @@ async def confirm_sim(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await track_event(chat_id, "confirmou_conta_sim")
 
-    texto_final = (
+    texto_final = variant_for(chat_id).get(
+        "img2_caption",
         "🎁 Presente Liberado!!!\n\n"
         "Basta você entrar na comunidade e buscar o sorteio que já vou te enviar,\n"
-        "e fica de olho que o resultado sai na live de HOJE."
+        "e fica de olho que o resultado sai na live de HOJE.",
     )
 
     await send_photo_from_url(
         context,
         chat_id,
         "img2",
-        IMG2_URL,
+        runtime_config.current().img2_url,
         texto_final,
         btn_comunidade_e_vip(),
     )
@@ -739,10 +963,12 @@ async def acessar_vip(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await track_event(chat_id, "clicou_acessar_vip")
 
     first = q.from_user.first_name or "amigo"
-    intro = (
-        f"Fala {first}!\n\n"
-        "já quer garantir um prêmio na minha roleta ou quer que eu te explique certinho como funciona?"
-    )
+    # replace e não format: o texto vem do EXPERIMENTS_FILE e pode ter outras chaves ({, })
+    intro = variant_for(chat_id).get(
+        "vip_intro_text",
+        "Fala {first}!\n\n"
+        "já quer garantir um prêmio na minha roleta ou quer que eu te explique certinho como funciona?",
+    ).replace("{first}", first)
 
     await _retry_send(
         lambda: context.bot.send_message(
@@ -761,7 +987,11 @@ async def vip_quero_garantir(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     await track_event(chat_id, "vip_quero_garantir")
 
-    await _vip_send_media_and_request(context, chat_id)
+    context.application.bot_data["lifecycle"].spawn(
+        _vip_send_media_and_request(context, chat_id),
+        name=f"vip:{chat_id}",
+        on_reject=lambda: db.set_stage(chat_id, "vip:audio", "running"),
+    )
 
 
 async def vip_me_explica(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -771,7 +1001,11 @@ async def vip_me_explica(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await track_event(chat_id, "vip_me_explica")
 
-    await _vip_send_media_and_request(context, chat_id)
+    context.application.bot_data["lifecycle"].spawn(
+        _vip_send_media_and_request(context, chat_id),
+        name=f"vip:{chat_id}",
+        on_reject=lambda: db.set_stage(chat_id, "vip:audio", "running"),
+    )
 
 
 async def vip_btn_print(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -814,7 +1048,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     photo = update.message.photo[-1]
     f = await context.bot.get_file(photo.file_id)
     ba = await f.download_as_bytearray()
-    await validate_print_and_reply(update, context, bytes(ba))
+    await validate_print_and_reply(update, context, bytes(ba), photo.file_id)
 
 
 async def handle_image_doc(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -827,14 +1061,36 @@ async def handle_image_doc(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     f = await context.bot.get_file(doc.file_id)
     ba = await f.download_as_bytearray()
-    await validate_print_and_reply(update, context, bytes(ba))
+    await validate_print_and_reply(update, context, bytes(ba), doc.file_id)
 
 
 # ====== QUANDO USA REQUEST TO JOIN NO CANAL ======
+async def send_join_dm(bot, req: JoinRequest):
+    """
+    DM de boas-vindas, em paralelo com a aprovação (ver join_queue.py):
+    mensagem + botão 'Liberar presente' no PV.
+    """
+    await track_event(req.user_chat_id, "join_request_aprovado", {"group_id": req.group_id})
+
+    texto = (
+        f"Tenho um presentinho para você {req.first_name}, tá por aí? 👋\n\n"
+        "Você está a um clique entrar no VIP do JOTA 🤩\n\n"
+        "Aqui você tem chance de ganhar desde BANCAS GRÁTIS até um iPhone 17 PRO nas minhas lives\n\n"
+        "Clique no botão abaixo que vou te enviar um aúdio para garantir seu prêmio em seguida 👇"
+    )
+
+    # Manda no PV do usuário essa mensagem + botão liberar presente (deep-link)
+    await bot.send_message(
+        chat_id=req.user_chat_id,
+        text=texto,
+        reply_markup=btn_liberar_presente(),
+    )
+
+
 async def on_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Quando o cliente entrar no grupo (join request aprovado),
-    manda mensagem + botão 'Liberar presente' no PV.
+    Só enfileira o pedido: a DM e depois a aprovação rodam no JoinPipeline,
+    cada uma com seu próprio ritmo, sem travar o processamento de updates.
     """
     req = update.chat_join_request
     if not req:
@@ -849,66 +1105,406 @@ async def on_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
         log.warning("Join request sem user_chat_id para %s", user.id)
         return
 
-    first = user.first_name or ""
+    pipeline: JoinPipeline = context.application.bot_data["join_pipeline"]
+    await pipeline.submit(
+        JoinRequest(
+            group_id=req.chat.id,
+            user_id=user.id,
+            user_chat_id=user_chat_id,
+            first_name=user.first_name or "",
+            requested_at=req.date.timestamp(),
+        )
+    )
 
-    await track_event(user_chat_id, "join_request_aprovado", {"group_id": req.chat.id})
 
-    texto = (
-        f"Tenho um presentinho para você {first}, tá por aí? 👋\n\n"
-        "Você está a um clique entrar no VIP do JOTA 🤩\n\n"
-        "Aqui você tem chance de ganhar desde BANCAS GRÁTIS até um iPhone 17 PRO nas minhas lives\n\n"
-        "Clique no botão abaixo que vou te enviar um aúdio para garantir seu prêmio em seguida 👇"
-    )
+# ====== Main ======
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    trace = tracing.current()
+    log.exception("Unhandled error: %s | trace=%s | update=%s", context.error, trace.id if trace else "-", update)
+
+
+# Jobs que sobrevivem a restart (persistidos no drain, reagendados no startup)
+JOB_CALLBACKS = {
+    "send_followup_job": send_followup_job,
+    "vip_followup_job": vip_followup_job,
+}
+
+
+def persist_jobs(app):
+    jobs = []
+    for job in app.job_queue.jobs():
+        callback = job.callback.__name__
+        if callback not in JOB_CALLBACKS or not isinstance(job.data, dict) or not job.next_t:
+            continue
+        jobs.append((job.name, callback, job.data["chat_id"], job.data, job.next_t.timestamp()))
+    db.save_scheduled_jobs(jobs)
+    log.info("%s jobs agendados salvos para o próximo startup", len(jobs))
+
+
+# ====== Reconciliação do funil ======
+FLOW_STEPS = {"start": START_STEPS, "vip": VIP_STEPS}
+STUCK_AFTER = 120  # segundos parado num passo (ou desde a última falha) até retomar
+MAX_STAGE_ATTEMPTS = 5  # falhas seguidas no mesmo passo antes de pular para o próximo
+RECONCILE_INTERVAL = 30
+RECONCILE_BATCH = 50
+
+
+def _funnel_coro(context, chat_id: int, flow: str, step: str, data: dict):
+    if flow == "start":
+        return run_start_flow(
+            context,
+            chat_id,
+            data.get("first_name"),
+            skip_intro_text=data.get("skip_intro_text", False),
+            resume_from=step,
+        )
+    return _vip_send_media_and_request(context, chat_id, resume_from=step)
+
+
+async def reconcile_funnels(app, older_than: float, limit: int) -> int:
+    """Retoma, em lote, chats parados num passo do funil. Devolve quantos foram retomados."""
+    lifecycle: Lifecycle = app.bot_data["lifecycle"]
+    partition, partitions = app.bot_data.get("partition", (0, 1))
+    context = CallbackContext(app)
+
+    rows = await asyncio.to_thread(db.stuck_stages, older_than, limit, partition, partitions)
+    resumed = 0
+    for row in rows:
+        chat_id = row["telegram_id"]
+        flow, _, step = row["stage"].partition(":")
+        steps = FLOW_STEPS.get(flow)
+        if not steps or lifecycle.is_running(f"{flow}:{chat_id}"):
+            continue
+
+        if row["stage_attempts"] >= MAX_STAGE_ATTEMPTS and step in steps:
+            log.warning("Passo %s de %s falhou %s vezes; pulando", row["stage"], chat_id, row["stage_attempts"])
+            nxt = steps.index(step) + 1
+            if nxt == len(steps):
+                await asyncio.to_thread(db.set_stage, chat_id, row["stage"], "done")
+                continue
+            step = steps[nxt]
+
+        data = json.loads(row["stage_data"] or "{}")
+        # o funil retomado herda este trace (create_task copia o contexto)
+        with tracing.trace("reconcile", chat=chat_id, stage=f"{flow}:{step}"):
+            lifecycle.spawn(_funnel_coro(context, chat_id, flow, step, data), name=f"{flow}:{chat_id}")
+        resumed += 1
+
+    if resumed:
+        log.info("[FUNIL] %s chats retomados de passos parados", resumed)
+    return resumed
+
+
+async def reconcile_job(context: ContextTypes.DEFAULT_TYPE):
+    # o que parou antes do startup é do processo anterior: entra mesmo sem STUCK_AFTER
+    started_at = context.application.bot_data.get("started_at", 0)
+    await reconcile_funnels(context.application, max(time.time() - STUCK_AFTER, started_at), RECONCILE_BATCH)
+
+
+async def resume_funnels(app):
+    # no startup tudo que ficou em andamento é do processo anterior: retoma sem esperar STUCK_AFTER,
+    # um lote agora e o resto pelo reconcile_job (um lote por RECONCILE_INTERVAL)
+    app.bot_data["started_at"] = time.time()
+    await reconcile_funnels(app, app.bot_data["started_at"], RECONCILE_BATCH)
+
+    partition, partitions = app.bot_data.get("partition", (0, 1))
+    jobs = db.pop_scheduled_jobs(partition, partitions)
+    now = time.time()
+    for row in jobs:
+        app.job_queue.run_once(
+            JOB_CALLBACKS[row["callback"]],
+            when=max(0, row["due_at"] - now),
+            data=json.loads(row["data"]),
+            name=row["name"],
+        )
 
-    # Manda no PV do usuário essa mensagem + botão liberar presente (deep-link)
-    await _retry_send(
-        lambda: context.bot.send_message(
-            chat_id=user_chat_id,
-            text=texto,
-            reply_markup=btn_liberar_presente(),
+    if jobs:
+        log.info("Retomados %s jobs agendados", len(jobs))
+
+
+# ====== Broadcast (admin) ======
+async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /broadcast <texto>, ou /broadcast respondendo a uma mensagem (copia a
+    mensagem com mídia/formatação para todos os usuários).
+    """
+    msg = update.effective_message
+    reply = msg.reply_to_message
+    text = " ".join(context.args or []).strip()
+    if not reply and not text:
+        await msg.reply_text("Uso: /broadcast <texto> ou responda a uma mensagem com /broadcast")
+        return
+
+    running = await asyncio.to_thread(db.running_broadcast)
+    if running:
+        await msg.reply_text(
+            "Já existe um broadcast em andamento:\n" + format_progress(progress(running))
         )
+        return
+
+    bid = await asyncio.to_thread(
+        db.create_broadcast,
+        None if reply else text,
+        reply.chat_id if reply else None,
+        reply.message_id if reply else None,
+        update.effective_user.id,
+        time.time(),
     )
+    row = await asyncio.to_thread(db.get_broadcast, bid)
+    log.info("[BROADCAST] #%s criado por %s para %s usuários", bid, update.effective_user.id, row["total"])
+    await msg.reply_text(f"📣 Broadcast #{bid} criado para {row['total']} usuários. Acompanhe com /broadcast_status")
 
-    # aprova a entrada no canal
-    try:
-        await req.approve()
-    except Exception as e:
-        log.warning("Erro ao aprovar join request: %s", e)
+
+async def broadcast_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    row = await asyncio.to_thread(db.get_broadcast)
+    if not row:
+        await update.effective_message.reply_text("Nenhum broadcast ainda.")
+        return
+    await update.effective_message.reply_text(format_progress(progress(row)))
 
 
-# ====== Main ======
-async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
-    log.exception("Unhandled error: %s | update=%s", context.error, update)
+async def broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    row = await asyncio.to_thread(db.running_broadcast)
+    if not row:
+        await update.effective_message.reply_text("Nenhum broadcast em andamento.")
+        return
+    await asyncio.to_thread(db.set_broadcast_status, row["id"], "cancelled")
+    await update.effective_message.reply_text(f"Broadcast #{row['id']} cancelado.")
+
+
+async def log_http_stats(context: ContextTypes.DEFAULT_TYPE):
+    get_http_pool().log_stats()
+
+
+async def post_init(app):
+    settings = get_settings()
+    # modo cluster: cada worker cuida de uma partição e divide o ritmo global
+    partition, partitions = app.bot_data.get("partition", (0, 1))
+
+    # no cluster.py, um arquivo por worker (o RotatingFileHandler não é multi-processo)
+    trace_file = settings.trace_file
+    if trace_file and partitions > 1:
+        root, ext = os.path.splitext(trace_file)
+        trace_file = f"{root}.w{partition}{ext}"
+    tracing.configure(trace_file, settings.trace_sample, int(settings.trace_max_mb * 1024 * 1024))
+
+    VIP_PENDING_PRINT.load(partition, partitions)
+    lifecycle = Lifecycle(deadline=settings.shutdown_deadline)
+    # ordem dos flushes: o que o próximo startup precisa para retomar vem primeiro
+    lifecycle.on_drain(lambda: asyncio.to_thread(persist_jobs, app), name="persist_jobs")
+    lifecycle.on_drain(MEDIA.flush, name="media")
+    lifecycle.on_drain(VIP_PENDING_PRINT.flush, name="vip_pending")
+    app.bot_data["lifecycle"] = lifecycle
+    if app.updater:
+        lifecycle.install(app)
+    with startup_phase("join pipeline"):
+        pipeline = JoinPipeline(
+            app.bot,
+            send_join_dm,
+            approve_rate=settings.join_approve_rate / partitions,
+            dm_rate=settings.join_dm_rate / partitions,
+            dm_grace=settings.join_dm_grace,
+            partition=partition,
+            partitions=partitions,
+        )
+        await pipeline.start()
+    app.bot_data["join_pipeline"] = pipeline
+
+    with startup_phase("image pool"):
+        image_pool = ImagePool(
+            workers=settings.image_workers,
+            max_pending=settings.image_max_pending,
+            timeout=settings.image_timeout,
+        )
+        image_pool.start()
+    app.bot_data["image_pool"] = image_pool
 
+    OPENAI_BREAKER.configure(settings.breaker_failures, settings.breaker_reset, settings.openai_timeout)
+    app.bot_data["print_drain_limiter"] = RateLimiter(settings.print_drain_rate / partitions, burst=1)
+    app.job_queue.run_repeating(
+        drain_print_queue, interval=PRINT_DRAIN_INTERVAL, first=PRINT_DRAIN_INTERVAL, name="drain_print_queue"
+    )
 
-def main():
-    request = HTTPXRequest(
-        read_timeout=20.0,
-        write_timeout=20.0,
-        connect_timeout=10.0,
-        pool_timeout=10.0,
+    # no cluster só um processo exporta (o high-water mark é global)
+    if partition == 0:
+        exporter = EventExporter(
+            mode=settings.export_mode,
+            form_url=settings.google_form_url or GOOGLE_FORM_URL,
+            batch_size=settings.export_batch,
+            parallelism=settings.export_parallelism,
+            out_dir=settings.export_dir,
+            client=get_http_pool().client("forms"),
+            breaker=CircuitBreaker("forms", settings.breaker_failures, settings.breaker_reset),
+            rate=settings.export_rate,
+        )
+        app.job_queue.run_repeating(
+            exporter.job,
+            interval=settings.export_interval,
+            first=settings.export_interval,
+            name="export_events",
+        )
+
+        # o broadcast também roda num processo só; o comando pode chegar em qualquer worker
+        broadcaster = Broadcaster(app.bot, rate=settings.broadcast_rate)
+        app.job_queue.run_repeating(broadcaster.job, interval=5, first=1, name="broadcast")
+        lifecycle.on_drain(broadcaster.stop, name="broadcast")
+        app.bot_data["broadcaster"] = broadcaster
+        # por último e só um pedaço (cabe em metade da reserva): o resto espera no SQLite
+        drain_rows = max(1, int(settings.export_rate * lifecycle.flush_reserve / 2))
+        lifecycle.on_drain(lambda: exporter.run_once(max_rows=drain_rows), name="export")
+
+    app.job_queue.run_repeating(log_http_stats, interval=300, first=300, name="http_stats")
+    app.job_queue.run_repeating(MEDIA.job, interval=MEDIA_SYNC_INTERVAL, first=MEDIA_SYNC_INTERVAL, name="media_sync")
+    app.job_queue.run_repeating(
+        VIP_PENDING_PRINT.job, interval=SHARED_SET_FLUSH_INTERVAL, first=SHARED_SET_FLUSH_INTERVAL, name="vip_pending_flush"
+    )
+    app.job_queue.run_repeating(
+        runtime_config.watch_job,
+        interval=settings.config_poll_interval,
+        first=settings.config_poll_interval,
+        name="config_watch",
     )
 
-    app = (
+    with startup_phase("retomada de funis"):
+        await resume_funnels(app)
+    app.job_queue.run_repeating(
+        reconcile_job, interval=RECONCILE_INTERVAL, first=RECONCILE_INTERVAL, name="reconcile_funnels"
+    )
+    log.info("[STARTUP] pronto para receber updates em %.1f ms", (time.perf_counter() - _T0) * 1000)
+
+
+def _update_label(update: Update) -> str:
+    if update.callback_query:
+        return f"callback:{update.callback_query.data}"
+    if update.chat_join_request:
+        return "join_request"
+    msg = update.effective_message
+    if msg and msg.text and msg.text.startswith("/"):
+        return msg.text.split()[0]
+    if msg and (msg.photo or msg.document):
+        return "print"
+    return "message" if msg else "other"
+
+
+async def begin_update_trace(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # roda antes de todos os handlers; funis disparados daqui herdam o trace
+    if update.chat_join_request:
+        chat_id = update.chat_join_request.user_chat_id
+    else:
+        chat_id = update.effective_chat.id if update.effective_chat else None
+    tracing.start_trace(chat=chat_id, update=_update_label(update))
+
+
+async def end_update_trace(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tracing.end_trace("update")
+
+
+async def log_first_update(update: object, context: ContextTypes.DEFAULT_TYPE):
+    if context.bot_data.get("first_update_logged"):
+        return
+    context.bot_data["first_update_logged"] = True
+    log.info("[STARTUP] primeiro update em %.1f ms", (time.perf_counter() - _T0) * 1000)
+
+
+async def post_shutdown(app):
+    pipeline = app.bot_data.get("join_pipeline")
+    if pipeline:
+        await pipeline.stop()
+
+    image_pool = app.bot_data.get("image_pool")
+    if image_pool:
+        image_pool.shutdown()
+
+    broadcaster = app.bot_data.get("broadcaster")
+    if broadcaster:
+        await broadcaster.stop()
+
+    await MEDIA.flush()
+    await VIP_PENDING_PRINT.flush()
+    tracing.shutdown()
+
+    http = get_http_pool()
+    http.log_stats()
+    await http.aclose()
+
+
+def setup():
+    """Config + banco; comum ao modo single-process e ao cluster.py."""
+    with startup_phase("config"):
+        settings = get_settings()
+        if not settings.openai_api_key:
+            log.warning("⚠️ OPENAI_API_KEY ausente — validação não funcionará.")
+
+    with startup_phase("experimento A/B"):
+        experiment = load_experiment(settings.experiments_file)
+        log.info("Experimento ativo: %s (%s)", experiment.name, ", ".join(v.name for v in experiment.variants))
+
+    with startup_phase("config recarregável"):
+        cfg = runtime_config.init(
+            settings.config_file,
+            runtime_config.env_values(settings.min_deposit_value),
+            settings.bot_username,
+            button_texts=[v.overrides["btn_criar_conta"] for v in experiment.variants if "btn_criar_conta" in v.overrides],
+        )
+        log.info("Config v%s (%s)", cfg.version, settings.config_file if os.path.exists(settings.config_file) else "só ambiente")
+
+    with startup_phase("db + mídias"):
+        db.init_db()
+        db.import_media(load_cache())
+        MEDIA.load()
+
+    return settings
+
+
+def build_application(settings, *, with_updater: bool = True, with_hooks: bool = True):
+    # um pool de conexões por destino, compartilhado com OpenAI e exporter (http_pool.py)
+    request = SharedHTTPXRequest(get_http_pool(), "telegram")
+    # long-polling em pool próprio: o getUpdates nunca disputa conexão com os envios
+    get_updates_request = SharedHTTPXRequest(get_http_pool(), "telegram_poll")
+
+    builder = (
         ApplicationBuilder()
-        .token(TOKEN)
+        .token(settings.token)
+        .base_url(f"{settings.telegram_api_url}/bot")
+        .base_file_url(f"{settings.telegram_api_url}/file/bot")
         .request(request)
+        .get_updates_request(get_updates_request)
         .job_queue(JobQueue())
-        .build()
     )
+    if with_hooks:
+        builder = builder.post_init(post_init).post_shutdown(post_shutdown)
+    if not with_updater:
+        # workers do cluster.py recebem updates da fila, não do Telegram
+        builder = builder.updater(None)
+    elif settings.record_updates:
+        # só quem faz o polling grava (single-process ou ingress do cluster.py)
+        builder = builder.update_queue(RecordingQueue(UpdateRecorder(settings.record_updates, settings.record_salt)))
+    return builder.build()
+
+
+def register_handlers(app):
+    app.add_handler(TypeHandler(Update, begin_update_trace), group=-1000)
+    app.add_handler(TypeHandler(Update, end_update_trace), group=1000)
+    app.add_handler(TypeHandler(Update, log_first_update), group=-100)
 
     # handler para Request to Join
     app.add_handler(ChatJoinRequestHandler(on_join_request))
 
     # comandos
     app.add_handler(CommandHandler("start", start))
-
-    # mídia utilitária (capturas de file_id)
-    app.add_handler(MessageHandler(filters.AUDIO | filters.VOICE, capture_audio))
+    admins = filters.User(user_id=get_settings().admin_ids, allow_empty=False)
+    app.add_handler(CommandHandler("broadcast", broadcast_cmd, filters=admins))
+    app.add_handler(CommandHandler("broadcast_status", broadcast_status, filters=admins))
+    app.add_handler(CommandHandler("broadcast_cancel", broadcast_cancel, filters=admins))
+
+    # mídias do funil: só admins mandam/atribuem (áudio de usuário comum é ignorado)
+    app.add_handler(CommandHandler("setmedia", setmedia_cmd, filters=admins))
+    app.add_handler(CommandHandler("media", media_cmd, filters=admins))
+    app.add_handler(CommandHandler("rollbackmedia", rollback_media_cmd, filters=admins))
     app.add_handler(
         MessageHandler(
-            filters.VIDEO | filters.Document.VIDEO | filters.VIDEO_NOTE,
-            capture_video,
+            admins & (filters.AUDIO | filters.VOICE | filters.VIDEO | filters.Document.VIDEO | filters.VIDEO_NOTE),
+            capture_media,
         )
     )
 
@@ -957,11 +1553,20 @@ def main():
     # error handler
     app.add_error_handler(on_error)
 
+
+def main():
+    settings = setup()
+
+    with startup_phase("application build"):
+        app = build_application(settings)
+        register_handlers(app)
+
     log.info(
         "🤖 Bot unificado rodando: RequestToJoin + VIP + validação do print (OpenAI) + deep-link do presente + tracking no Sheets."
     )
 
-    app.run_polling(drop_pending_updates=True)
+    # updates acumulados durante o deploy são processados; SIGTERM fica com o Lifecycle
+    app.run_polling(drop_pending_updates=False, stop_signals=None)
 
 
 if __name__ == "__main__":
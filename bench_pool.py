@@ -0,0 +1,123 @@
+"""
+Benchmark do pool de conexões com a Bot API, contra o fake_telegram.py.
+
+Para cada (tamanho do pool, concorrência) dispara `--requests` sendMessage
+com no máximo `concorrência` em voo, enquanto um loop de getUpdates faz
+long-poll. Mede a taxa de "pool timeout" (TimedOut sem o request ter saído),
+vazão, latência p50/p99 dos envios e o pior atraso para o long-poll conseguir
+conexão — com o getUpdates no mesmo pool dos envios e num pool separado.
+
+Uso:
+    python fake_telegram.py --users 0 --joins 0 &
+    python bench_pool.py
+    python bench_pool.py --pools 1,8,32,68 --concurrency 16,64,256 --pool-timeout 1
+"""
+import time
+import asyncio
+import argparse
+import logging
+
+from telegram import Bot
+from telegram.error import TimedOut
+
+from http_pool import HostPool, HttpPool, SharedHTTPXRequest
+from utils import percentiles
+
+
+async def run_case(url: str, pool_size: int, concurrency: int, requests: int, pool_timeout: float, shared: bool) -> dict:
+    http = HttpPool({
+        "telegram": HostPool(max_connections=pool_size, pool_timeout=pool_timeout),
+        "telegram_poll": HostPool(max_connections=2, pool_timeout=pool_timeout),
+    })
+    send_request = SharedHTTPXRequest(http, "telegram")
+    poll_request = send_request if shared else SharedHTTPXRequest(http, "telegram_poll")
+    bot = Bot("1:bench", base_url=f"{url}/bot", request=send_request, get_updates_request=poll_request)
+
+    latencies: list[float] = []
+    pool_timeouts = 0
+    other_errors = 0
+    poll_waits: list[float] = []
+    poll_timeouts = 0
+    done = asyncio.Event()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def send(i: int):
+        nonlocal pool_timeouts, other_errors
+        async with sem:
+            t = time.perf_counter()
+            try:
+                await bot.send_message(chat_id=i + 1, text="bench")
+                latencies.append(time.perf_counter() - t)
+            except TimedOut as e:
+                if "Pool timeout" in str(e):
+                    pool_timeouts += 1
+                else:
+                    other_errors += 1
+            except Exception:
+                other_errors += 1
+
+    async def poll():
+        # o fake responde na hora quando há updates; sem updates segura até `timeout`
+        nonlocal poll_timeouts
+        while not done.is_set():
+            t = time.perf_counter()
+            try:
+                await bot.get_updates(timeout=1)
+                poll_waits.append(time.perf_counter() - t - 1)
+            except TimedOut:
+                poll_timeouts += 1
+
+    async with bot:
+        poller = asyncio.create_task(poll())
+        t0 = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(requests)))
+        elapsed = time.perf_counter() - t0
+        done.set()
+        await poller
+    await http.aclose()
+
+    p = percentiles(latencies, (50, 99))
+    return {
+        "pool": pool_size,
+        "concurrency": concurrency,
+        "mode": "compartilhado" if shared else "separado",
+        "pool_timeout_rate": pool_timeouts / requests,
+        "errors": other_errors,
+        "rps": len(latencies) / elapsed if elapsed else 0,
+        "p50_ms": p["p50"] * 1000,
+        "p99_ms": p["p99"] * 1000,
+        "poll_worst_ms": max(poll_waits, default=0) * 1000,
+        "poll_timeouts": poll_timeouts,
+    }
+
+
+async def _main(args):
+    pools = [int(x) for x in args.pools.split(",")]
+    levels = [int(x) for x in args.concurrency.split(",")]
+    print(
+        f"{'pool':>5} {'conc':>5} {'getUpdates':>13} {'pool timeout':>13} {'req/s':>7} "
+        f"{'p50 ms':>7} {'p99 ms':>8} {'poll pior ms':>13} {'poll TO':>8}"
+    )
+    for pool_size in pools:
+        for conc in levels:
+            for shared in (True, False):
+                r = await run_case(args.url, pool_size, conc, args.requests, args.pool_timeout, shared)
+                print(
+                    f"{r['pool']:>5} {r['concurrency']:>5} {r['mode']:>13} {100 * r['pool_timeout_rate']:>12.1f}% "
+                    f"{r['rps']:>7.0f} {r['p50_ms']:>7.0f} {r['p99_ms']:>8.0f} {r['poll_worst_ms']:>13.0f} {r['poll_timeouts']:>8}"
+                )
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default="http://127.0.0.1:8081")
+    ap.add_argument("--pools", default="1,8,32,68", help="tamanhos do pool de envios")
+    ap.add_argument("--concurrency", default="16,64,256", help="envios simultâneos")
+    ap.add_argument("--requests", type=int, default=1000, help="envios por caso")
+    ap.add_argument("--pool-timeout", type=float, default=1.0, help="espera máxima por uma conexão livre")
+    asyncio.run(_main(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark de startup: mede o custo de `import app` com `python -X importtime`.
+
+Uso:
+    python bench_startup.py            # 5 rodadas, top 15 imports
+    python bench_startup.py -n 10 --top 30
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HEAVY = ("openai", "PIL", "aiohttp")
+
+# Valores fictícios: o import não deve depender de config real
+ENV = {
+    **os.environ,
+    "TELEGRAM_TOKEN": os.getenv("TELEGRAM_TOKEN", "123:bench"),
+    "BOT_USERNAME": os.getenv("BOT_USERNAME", "bench_bot"),
+}
+
+PROBE = (
+    "import sys, time; t = time.perf_counter(); import app; "
+    "print(round((time.perf_counter() - t) * 1000, 1)); "
+    f"print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+)
+
+
+def parse_importtime(stderr: str) -> list[tuple[int, int, str]]:
+    """Linhas `import time: self [us] | cumulative | imported package`."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, data = line.split(":", 1)
+        self_us, cum_us, name = (part.strip() for part in data.split("|", 2))
+        rows.append((int(self_us), int(cum_us), name))
+    return rows
+
+
+def run_once() -> tuple[float, str, list[tuple[int, int, str]]]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=HERE,
+        env=ENV,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    out = proc.stdout.strip().splitlines()
+    return float(out[0]), out[1] if len(out) > 1 else "", parse_importtime(proc.stderr)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", type=int, default=5, help="rodadas (a 1ª aquece o cache de .pyc)")
+    ap.add_argument("--top", type=int, default=15)
+    args = ap.parse_args()
+
+    wall = []
+    rows = []
+    heavy = ""
+    for i in range(args.n + 1):
+        ms, heavy, rows = run_once()
+        if i:  # descarta a rodada de aquecimento
+            wall.append(ms)
+
+    print(f"import app: mediana {statistics.median(wall):.1f} ms | min {min(wall):.1f} ms | max {max(wall):.1f} ms")
+    print(f"módulos pesados carregados no import: {heavy or 'nenhum'}")
+    print(f"\ntop {args.top} imports por tempo cumulativo (última rodada):")
+    for self_us, cum_us, name in sorted(rows, key=lambda r: r[1], reverse=True)[: args.top]:
+        print(f"  {cum_us / 1000:8.1f} ms  (self {self_us / 1000:6.1f} ms)  {name.strip()}")
+
+
+if __name__ == "__main__":
+    main()
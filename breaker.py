@@ -0,0 +1,110 @@
+"""
+Circuit breaker por dependência externa (OpenAI, Google Forms).
+
+Fechado: as chamadas passam; `failures` falhas seguidas abrem o circuito.
+Aberto: ninguém chama a dependência por `reset_after` segundos — quem usa
+guarda o trabalho para depois (prints na fila, eventos no SQLite).
+Meio-aberto: passa uma única chamada de teste; sucesso fecha o circuito,
+falha abre de novo.
+"""
+import time
+import asyncio
+import logging
+
+log = logging.getLogger("presente-vip-unificado.breaker")
+
+CLOSED, OPEN, HALF_OPEN = "fechado", "aberto", "meio-aberto"
+
+
+class CircuitOpen(RuntimeError):
+    """O circuito está aberto: a dependência não foi chamada."""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failures: int = 5,
+        reset_after: float = 30.0,
+        timeout: float | None = None,
+        is_failure=None,
+    ):
+        self.name = name
+        self.max_failures = failures
+        self.reset_after = reset_after
+        self.timeout = timeout  # chamada mais lenta que isso conta como falha
+        # exceção -> bool: só as que indicam dependência fora contam (ex.: não um 400 do pedido)
+        self.is_failure = is_failure or (lambda e: True)
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def configure(self, failures: int, reset_after: float, timeout: float | None = None) -> None:
+        """Ajusta os limites pelo Settings (o breaker é criado no import, antes do setup)."""
+        self.max_failures = failures
+        self.reset_after = reset_after
+        self.timeout = timeout
+
+    def ready(self) -> bool:
+        """Como allow(), mas sem consumir a chamada de teste: só para decidir se vale preparar o trabalho."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self._opened_at >= self.reset_after
+        return not self._probing
+
+    def allow(self) -> bool:
+        """True se a chamada pode sair agora (no meio-aberto, só a de teste)."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.reset_after:
+                return False
+            self.state = HALF_OPEN
+            self._probing = False
+            log.info("[BREAKER] %s meio-aberto: testando com uma chamada", self.name)
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def success(self) -> None:
+        if self.state != CLOSED:
+            log.info("[BREAKER] ✅ %s fechado: dependência respondeu", self.name)
+        self.state = CLOSED
+        self._failures = 0
+        self._probing = False
+
+    def failure(self) -> None:
+        self._failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self._failures >= self.max_failures:
+            if self.state != OPEN:
+                log.warning(
+                    "[BREAKER] ⚡ %s aberto após %s falhas; nova tentativa em %.0fs",
+                    self.name, self._failures, self.reset_after,
+                )
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+    async def call(self, coro_factory):
+        """Executa `coro_factory()` pelo circuito. Levanta CircuitOpen sem chamar se estiver aberto."""
+        if not self.allow():
+            raise CircuitOpen(self.name)
+        try:
+            if self.timeout:
+                result = await asyncio.wait_for(coro_factory(), self.timeout)
+            else:
+                result = await coro_factory()
+        except asyncio.CancelledError:
+            self._probing = False
+            raise
+        except Exception as e:
+            if self.is_failure(e):
+                self.failure()
+            else:
+                self.success()  # a dependência respondeu; o problema é o pedido
+            raise
+        self.success()
+        return result
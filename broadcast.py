@@ -0,0 +1,189 @@
+import time
+import asyncio
+import logging
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import db
+from utils import RateLimiter
+
+log = logging.getLogger("presente-vip-unificado.broadcast")
+
+SAVE_EVERY = 2.0  # segundos entre checkpoints durante o envio
+
+
+def progress(row, now: float | None = None) -> dict:
+    """Progresso e ETA de um broadcast a partir da linha salva no banco."""
+    now = now or time.time()
+    done = row["sent"] + row["failed"] + row["pruned"]
+    remaining = max(0, row["total"] - done)
+    end = row["finished_at"] or now
+    elapsed = (end - row["started_at"]) if row["started_at"] else 0
+    rate = done / elapsed if elapsed > 0 else 0.0
+    return {
+        "id": row["id"],
+        "status": row["status"],
+        "total": row["total"],
+        "done": done,
+        "sent": row["sent"],
+        "failed": row["failed"],
+        "pruned": row["pruned"],
+        "rate": rate,
+        "eta_s": remaining / rate if rate and row["status"] == "running" else None,
+    }
+
+
+def format_progress(p: dict) -> str:
+    pct = 100 * p["done"] / p["total"] if p["total"] else 100.0
+    eta = f"{p['eta_s'] / 60:.0f} min" if p["eta_s"] is not None else "-"
+    return (
+        f"📣 Broadcast #{p['id']} ({p['status']})\n"
+        f"{p['done']}/{p['total']} ({pct:.1f}%) — enviados {p['sent']}, "
+        f"falhas {p['failed']}, bloqueados {p['pruned']}\n"
+        f"ritmo {p['rate']:.1f}/s, ETA {eta}"
+    )
+
+
+class Broadcaster:
+    """
+    Envia um broadcast para todos os usuários de `users`, em páginas por chave
+    (users.id), nunca com a base inteira em memória.
+
+    O ritmo fica em `rate`/s (abaixo do limite global de ~30 msg/s do
+    Telegram). Quem bloqueou o bot (Forbidden) é marcado em `users.blocked_at`
+    e sai dos próximos envios. O progresso (último users.id entregue em
+    sequência + contadores) vai para `broadcasts` a cada poucos segundos,
+    então um crash retoma de onde parou reenviando no máximo os envios em voo.
+    """
+
+    def __init__(self, bot, rate: float = 25, page_size: int = 500, workers: int = 8):
+        self.bot = bot
+        self.page_size = page_size
+        self.n_workers = workers
+        self._limiter = RateLimiter(rate)
+        self._task: asyncio.Task | None = None
+
+    async def job(self, context) -> None:
+        """Callback para job_queue.run_repeating: pega broadcasts criados por qualquer worker."""
+        if self._task and not self._task.done():
+            return
+        row = await asyncio.to_thread(db.running_broadcast)
+        if row:
+            self._task = asyncio.create_task(self._run(row), name=f"broadcast:{row['id']}")
+
+    async def stop(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    # ====== Envio ======
+    async def _run(self, row) -> None:
+        bid = row["id"]
+        self._bid = bid
+        self._last_id = row["last_user_id"]
+        self._counts = {"sent": row["sent"], "failed": row["failed"], "pruned": row["pruned"]}
+        self._started_at = row["started_at"] or time.time()
+        self._saved_at = 0.0
+        log.info("[BROADCAST] #%s iniciado/retomado a partir de users.id > %s", bid, self._last_id)
+
+        try:
+            while True:
+                page = await asyncio.to_thread(db.broadcast_recipients, self._last_id, self.page_size)
+                if not page:
+                    break
+                await self._send_page(row, page)
+                await self._save()
+                current = await asyncio.to_thread(db.get_broadcast, bid)
+                if current["status"] != "running":
+                    log.info("[BROADCAST] #%s cancelado", bid)
+                    return
+                log.info("[BROADCAST] %s", format_progress(progress(current)))
+        except asyncio.CancelledError:
+            await self._save()
+            log.info("[BROADCAST] #%s interrompido em users.id=%s; retoma no próximo startup", bid, self._last_id)
+            raise
+        except Exception:
+            await self._save()
+            log.exception("[BROADCAST] #%s falhou; retoma no próximo ciclo", bid)
+            return
+
+        await self._save(finished_at=time.time())
+        log.info("[BROADCAST] %s", format_progress(progress(await asyncio.to_thread(db.get_broadcast, bid))))
+
+    async def _send_page(self, row, page) -> None:
+        outcomes: list[str | None] = [None] * len(page)
+        cursor = 0  # outcomes[:cursor] já entrou no checkpoint
+        blocked: list[int] = []
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for i in range(len(page)):
+            queue.put_nowait(i)
+
+        async def worker():
+            nonlocal cursor
+            while not queue.empty():
+                i = queue.get_nowait()
+                outcomes[i] = await self._send_one(row, page[i]["telegram_id"])
+                # contadores, bloqueios e cursor só avançam em sequência, junto com o checkpoint
+                while cursor < len(outcomes) and outcomes[cursor]:
+                    self._counts[outcomes[cursor]] += 1
+                    if outcomes[cursor] == "pruned":
+                        blocked.append(page[cursor]["telegram_id"])
+                    self._last_id = page[cursor]["id"]
+                    cursor += 1
+                if time.monotonic() - self._saved_at >= SAVE_EVERY:
+                    await self._flush_blocked(blocked)
+                    await self._save()
+
+        try:
+            # TaskGroup: se um worker quebra, os outros são cancelados antes do _run
+            # salvar e sair; nenhum envio continua depois do checkpoint (reenvio duplicado)
+            async with asyncio.TaskGroup() as tg:
+                for _ in range(self.n_workers):
+                    tg.create_task(worker())
+        finally:
+            await self._flush_blocked(blocked)
+
+    async def _send_one(self, row, chat_id: int) -> str:
+        for attempt in range(3):
+            await self._limiter.acquire()
+            try:
+                if row["message_id"]:
+                    await self.bot.copy_message(
+                        chat_id=chat_id, from_chat_id=row["from_chat_id"], message_id=row["message_id"]
+                    )
+                else:
+                    await self.bot.send_message(chat_id=chat_id, text=row["text"])
+                return "sent"
+            except RetryAfter as e:
+                # pausa o limiter compartilhado: todos os workers esperam, não só este
+                log.warning("[BROADCAST] flood control: aguardando %ss", e.retry_after)
+                self._limiter.pause(e.retry_after)
+            except Forbidden:
+                return "pruned"  # bloqueou o bot / conta apagada
+            except BadRequest as e:
+                if "chat not found" in str(e).lower():
+                    return "pruned"
+                log.warning("[BROADCAST] envio para %s falhou: %s", chat_id, e)
+                return "failed"
+            except NetworkError as e:  # inclui TimedOut
+                log.warning("[BROADCAST] erro de rede para %s (tentativa %s): %s", chat_id, attempt + 1, e)
+                await asyncio.sleep(1)
+        return "failed"
+
+    async def _flush_blocked(self, blocked: list[int]) -> None:
+        if blocked:
+            ids, blocked[:] = list(blocked), []
+            await asyncio.to_thread(db.mark_users_blocked, ids, time.time())
+
+    async def _save(self, finished_at: float | None = None) -> None:
+        self._saved_at = time.monotonic()
+        await asyncio.to_thread(
+            db.save_broadcast_progress,
+            self._bid,
+            self._last_id,
+            self._counts["sent"],
+            self._counts["failed"],
+            self._counts["pruned"],
+            self._started_at,
+            finished_at,
+        )
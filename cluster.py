@@ -0,0 +1,205 @@
+"""
+Modo distribuído: 1 processo ingress + N workers numa mesma máquina.
+
+O ingress faz o polling no Telegram e grava cada update na tabela
+`update_queue` (SQLite em WAL), particionado por chat. Cada worker consome só
+a sua partição, então os updates de um mesmo chat são processados em ordem,
+enquanto chats diferentes rodam em paralelo em vários cores. Join requests
+ficam no SQLite; VIP_PENDING_PRINT fica em memória no worker dono da
+partição e é gravado em lote (shared_set.py); as mídias ficam em memória em
+cada processo e sincronizam pelo SQLite (media.py).
+
+Uso:
+    python cluster.py                # ingress + WORKER_COUNT workers
+    python cluster.py ingress
+    python cluster.py worker 2
+"""
+import sys
+import signal
+import asyncio
+import logging
+import subprocess
+from collections import deque
+
+from telegram import Update
+from telegram.ext import ContextTypes, TypeHandler
+
+import db
+from app import build_application, register_handlers, setup
+
+log = logging.getLogger("presente-vip-unificado.cluster")
+
+BATCH_SIZE = 100
+MAX_IN_FLIGHT = 1000  # updates buscados e ainda sem ack, por worker
+IDLE_SLEEP = 0.05  # segundos entre consultas quando a fila está vazia
+
+
+def partition_key(update: Update) -> int:
+    """Chat privado do usuário: join requests caem na partição de quem pediu, não do grupo."""
+    if update.chat_join_request:
+        return update.chat_join_request.user_chat_id or update.chat_join_request.from_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return 0
+
+
+# ====== Ingress ======
+def run_ingress(settings):
+    partitions = settings.worker_count
+
+    async def enqueue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await asyncio.to_thread(
+            db.enqueue_update,
+            db.partition_for(partition_key(update), partitions),
+            update.to_dict(),
+        )
+
+    app = build_application(settings, with_hooks=False)
+    app.add_handler(TypeHandler(Update, enqueue))
+
+    log.info("🛰️ Ingress rodando: %s partições", partitions)
+    app.run_polling(drop_pending_updates=False)
+
+
+# ====== Worker ======
+class ChatLanes:
+    """
+    Uma fila por chat, cada uma com sua task: dentro do chat os updates
+    rodam em ordem de chegada; um chat lento (ex.: print esperando a OpenAI)
+    não segura os outros da partição. Cada update entra em `done` quando
+    termina, para o ack sair assim que possível.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.in_flight = 0  # buscados e ainda não processados
+        self.done: list[int] = []
+        self._lanes: dict[int, deque] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def push(self, key: int, row_id: int, update: Update) -> None:
+        self.in_flight += 1
+        lane = self._lanes.get(key)
+        if lane is not None:
+            lane.append((row_id, update))
+            return
+        self._lanes[key] = deque([(row_id, update)])
+        task = asyncio.create_task(self._run(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: int) -> None:
+        lane = self._lanes[key]
+        while lane:
+            row_id, update = lane.popleft()
+            try:
+                await self.app.process_update(update)
+            finally:
+                self.done.append(row_id)
+                self.in_flight -= 1
+        del self._lanes[key]  # sem await entre o teste e o del: push() nunca cai numa fila morta
+
+    def take_done(self) -> list[int]:
+        done, self.done = self.done, []
+        return done
+
+    async def stop(self) -> None:
+        """Termina os updates em andamento; os que nem começaram ficam na update_queue (sem ack)."""
+        for lane in self._lanes.values():
+            self.in_flight -= len(lane)
+            lane.clear()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def _consume(app, partition: int, stop: asyncio.Event):
+    lanes = ChatLanes(app)
+    last_id = 0
+    try:
+        while not stop.is_set():
+            done = lanes.take_done()
+            if done:
+                await asyncio.to_thread(db.ack_updates, done)
+
+            room = MAX_IN_FLIGHT - lanes.in_flight
+            rows = await asyncio.to_thread(db.fetch_updates, partition, min(BATCH_SIZE, room), last_id) if room > 0 else []
+            if not rows:
+                try:
+                    await asyncio.wait_for(stop.wait(), IDLE_SLEEP)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for update_id, payload in rows:
+                update = Update.de_json(payload, app.bot)
+                lanes.push(partition_key(update), update_id, update)
+            last_id = rows[-1][0]
+    finally:
+        await lanes.stop()
+        await asyncio.to_thread(db.ack_updates, lanes.take_done())
+
+
+async def _run_worker(settings, index: int):
+    app = build_application(settings, with_updater=False)
+    app.bot_data["partition"] = (index, settings.worker_count)
+    register_handlers(app)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    log.info("⚙️ Worker %s/%s rodando", index, settings.worker_count)
+    try:
+        await _consume(app, index, stop)
+    finally:
+        await app.bot_data["lifecycle"].drain(app)
+        await app.stop()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+        await app.shutdown()
+
+
+def run_worker(settings, index: int):
+    asyncio.run(_run_worker(settings, index))
+
+
+# ====== Launcher ======
+def run_all(settings):
+    procs = [subprocess.Popen([sys.executable, __file__, "ingress"])]
+    procs += [
+        subprocess.Popen([sys.executable, __file__, "worker", str(i)])
+        for i in range(settings.worker_count)
+    ]
+
+    def forward(signum, _frame):
+        for p in procs:
+            p.send_signal(signum)
+
+    # Ctrl+C já chega em todos os filhos (mesmo grupo de processos); SIGTERM do container não
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for p in procs:
+        p.wait()
+
+
+def main():
+    settings = setup()
+    args = sys.argv[1:]
+    if not args:
+        run_all(settings)
+    elif args[0] == "ingress":
+        run_ingress(settings)
+    elif args[0] == "worker":
+        run_worker(settings, int(args[1]))
+    else:
+        sys.exit(__doc__)
+
+
+if __name__ == "__main__":
+    main()
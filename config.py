@@ -0,0 +1,108 @@
+import os
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+
+@dataclass(frozen=True)
+class Settings:
+    token: str
+    bot_username: str  # sem @ (ex: presentedamarlucebot)
+    openai_api_key: str
+    min_deposit_value: float  # padrão; o CONFIG_FILE pode trocar sem restart
+    tz_offset_hours: int  # -3 = America/Sao_Paulo
+    join_approve_rate: float  # aprovações de join request por segundo
+    join_dm_rate: float  # DMs de boas-vindas por segundo
+    join_dm_grace: float  # segundos que a aprovação espera pela DM de quem nunca iniciou o bot
+    telegram_api_url: str  # troque pelo fake_telegram.py em testes locais
+    google_form_url: str  # vazio = formulário padrão do exporter.py
+    worker_count: int  # processos worker do cluster.py
+    image_workers: int  # processos do pool de imagem (Pillow)
+    image_max_pending: int  # prints na fila do pool antes de recusar
+    image_timeout: float  # segundos por imagem
+    shutdown_deadline: float  # segundos para o desligamento todo no SIGTERM (funis + flushes)
+    export_mode: str  # forms | csv | ndjson
+    export_interval: float  # segundos entre lotes
+    export_batch: int  # linhas por lote
+    export_parallelism: int  # POSTs simultâneos no modo forms
+    export_dir: str  # destino dos arquivos nos modos csv/ndjson
+    experiments_file: str  # JSON do teste A/B (vazio = só controle)
+    admin_ids: frozenset[int]  # telegram_ids que podem usar os comandos de admin
+    broadcast_rate: float  # mensagens por segundo no broadcast
+    telegram_pool_size: int  # conexões para envios na Bot API (0 = calcula pelos ritmos)
+    openai_pool_size: int  # conexões simultâneas com a OpenAI
+    config_file: str  # JSON recarregado sem restart (links, mídias, valor mínimo)
+    config_poll_interval: float  # segundos entre checagens do config_file
+    record_updates: str  # .ndjson.gz para gravar os updates recebidos (vazio = não grava)
+    record_salt: str  # sal do HMAC que anonimiza ids/nomes na gravação
+    trace_file: str  # NDJSON dos spans de tracing (vazio = desligado)
+    trace_sample: float  # fração dos traces gravados (erros sempre entram)
+    trace_max_mb: float  # tamanho de cada arquivo antes de rotacionar
+    breaker_failures: int  # falhas seguidas que abrem o circuito (OpenAI, Forms)
+    breaker_reset: float  # segundos com o circuito aberto antes de testar de novo
+    openai_timeout: float  # segundos por validação; mais que isso conta como falha
+    print_drain_rate: float  # prints da fila validados por segundo quando a OpenAI volta
+    export_rate: float  # POSTs por segundo no Google Forms (escoa o acumulado sem rajada)
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        load_dotenv()
+
+        token = os.getenv("TELEGRAM_TOKEN") or os.getenv("TELEGRAM_BOT_TOKEN") or ""
+        if not token:
+            raise RuntimeError("❌ Defina TELEGRAM_TOKEN (ou TELEGRAM_BOT_TOKEN) nas variáveis.")
+
+        bot_username = (os.getenv("BOT_USERNAME") or "").lstrip("@")
+        if not bot_username:
+            raise RuntimeError("❌ Defina BOT_USERNAME nas variáveis de ambiente (sem @).")
+
+        return cls(
+            token=token,
+            bot_username=bot_username,
+            openai_api_key=os.getenv("OPENAI_API_KEY", ""),
+            min_deposit_value=float(os.getenv("MIN_DEPOSIT_VALUE", "35")),
+            tz_offset_hours=int(os.getenv("TZ_OFFSET_HOURS", "-3")),
+            join_approve_rate=float(os.getenv("JOIN_APPROVE_RATE", "20")),
+            join_dm_rate=float(os.getenv("JOIN_DM_RATE", "15")),
+            join_dm_grace=float(os.getenv("JOIN_DM_GRACE", "3")),
+            telegram_api_url=os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/"),
+            google_form_url=os.getenv("GOOGLE_FORM_URL", ""),
+            worker_count=int(os.getenv("WORKER_COUNT", "4")),
+            image_workers=int(os.getenv("IMAGE_WORKERS", "2")),
+            image_max_pending=int(os.getenv("IMAGE_MAX_PENDING", "32")),
+            image_timeout=float(os.getenv("IMAGE_TIMEOUT", "20")),
+            shutdown_deadline=float(os.getenv("SHUTDOWN_DEADLINE", "20")),
+            export_mode=os.getenv("EXPORT_MODE", "forms"),
+            export_interval=float(os.getenv("EXPORT_INTERVAL", "30")),
+            export_batch=int(os.getenv("EXPORT_BATCH", "500")),
+            export_parallelism=int(os.getenv("EXPORT_PARALLELISM", "4")),
+            export_dir=os.getenv("EXPORT_DIR", "exports"),
+            experiments_file=os.getenv("EXPERIMENTS_FILE", ""),
+            admin_ids=frozenset(int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x),
+            broadcast_rate=float(os.getenv("BROADCAST_RATE", "25")),
+            telegram_pool_size=int(os.getenv("TELEGRAM_POOL_SIZE", "0")),
+            openai_pool_size=int(os.getenv("OPENAI_POOL_SIZE", "8")),
+            config_file=os.getenv("CONFIG_FILE", "runtime_config.json"),
+            config_poll_interval=float(os.getenv("CONFIG_POLL_INTERVAL", "5")),
+            record_updates=os.getenv("RECORD_UPDATES", ""),
+            record_salt=os.getenv("RECORD_SALT", ""),
+            trace_file=os.getenv("TRACE_FILE", ""),
+            trace_sample=float(os.getenv("TRACE_SAMPLE", "0.1")),
+            trace_max_mb=float(os.getenv("TRACE_MAX_MB", "20")),
+            breaker_failures=int(os.getenv("BREAKER_FAILURES", "5")),
+            breaker_reset=float(os.getenv("BREAKER_RESET", "30")),
+            openai_timeout=float(os.getenv("OPENAI_TIMEOUT", "30")),
+            print_drain_rate=float(os.getenv("PRINT_DRAIN_RATE", "1")),
+            export_rate=float(os.getenv("EXPORT_RATE", "10")),
+        )
+
+
+_settings: Settings | None = None
+
+
+def get_settings() -> Settings:
+    """Lê as variáveis uma única vez; as chamadas seguintes reaproveitam o mesmo objeto."""
+    global _settings
+    if _settings is None:
+        _settings = Settings.from_env()
+    return _settings
@@ -1,3 +1,5 @@
+import json
+import time
 import sqlite3
 from contextlib import contextmanager
 
@@ -5,7 +7,8 @@ DB_PATH = "bot_data.sqlite"
 
 @contextmanager
 def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+    # timeout alto: ingress e workers (cluster.py) escrevem no mesmo arquivo
+    conn = sqlite3.connect(DB_PATH, timeout=30)
     conn.row_factory = sqlite3.Row
     try:
         yield conn
@@ -15,6 +18,7 @@ def get_conn():
 def init_db():
     with get_conn() as conn:
         cur = conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
         cur.execute(
             """
             CREATE TABLE IF NOT EXISTS users (
@@ -40,6 +44,138 @@ def init_db():
             )
             """
         )
+        # migração: quem bloqueou o bot sai dos broadcasts (ver broadcast.py)
+        cols = {row["name"] for row in cur.execute("PRAGMA table_info(users)")}
+        if "blocked_at" not in cols:
+            cur.execute("ALTER TABLE users ADD COLUMN blocked_at REAL")
+        # migração: máquina de estados do funil (users.stage = "<fluxo>:<passo>")
+        for col, ddl in (
+            ("stage_status", "TEXT"),  # running | done | failed
+            ("stage_updated_at", "REAL"),
+            ("stage_attempts", "INTEGER DEFAULT 0"),
+            ("stage_data", "TEXT"),
+        ):
+            if col not in cols:
+                cur.execute(f"ALTER TABLE users ADD COLUMN {col} {ddl}")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_users_stage ON users (stage_status, stage_updated_at)")
+        # migração: variante A/B gravada em cada evento (ver experiments.py)
+        cols = {row["name"] for row in cur.execute("PRAGMA table_info(events)")}
+        if "variant" not in cols:
+            cur.execute("ALTER TABLE events ADD COLUMN variant TEXT")
+        # rollup de conversão por variante (experiment_report.py) só lê o índice
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_events_variant_event ON events (variant, event, telegram_id)")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS join_requests (
+              group_id INTEGER,
+              user_id INTEGER,
+              user_chat_id INTEGER,
+              first_name TEXT,
+              status TEXT DEFAULT 'pending',
+              requested_at REAL,
+              approved_at REAL,
+              dm_sent_at REAL,
+              PRIMARY KEY (group_id, user_id)
+            )
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_join_requests_status ON join_requests (status)")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS update_queue (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              partition INTEGER,
+              payload TEXT
+            )
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_update_queue_partition ON update_queue (partition, id)")
+        cur.execute("CREATE TABLE IF NOT EXISTS vip_pending (key INTEGER PRIMARY KEY)")
+        # uma linha por versão de cada slot de mídia; file_id NULL = slot limpo
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media_versions (
+              seq INTEGER PRIMARY KEY AUTOINCREMENT,
+              slot TEXT NOT NULL,
+              version INTEGER NOT NULL,
+              file_id TEXT,
+              set_by INTEGER,
+              set_at REAL,
+              UNIQUE (slot, version)
+            )
+            """
+        )
+        # migração: file_ids antigos viram a versão 1 de cada slot e a tabela sai
+        if cur.execute("SELECT 1 FROM sqlite_master WHERE name='file_ids'").fetchone():
+            cur.execute(
+                """
+                INSERT INTO media_versions (slot, version, file_id, set_by, set_at)
+                SELECT key, 1, value, NULL, 0 FROM file_ids WHERE true
+                ON CONFLICT(slot, version) DO NOTHING
+                """
+            )
+            cur.execute("DROP TABLE file_ids")
+        # migração: checkpoints antigos viram estado em users e a tabela sai
+        if cur.execute("SELECT 1 FROM sqlite_master WHERE name='funnel_checkpoints'").fetchone():
+            cur.execute(
+                """
+                INSERT INTO users (telegram_id, stage, stage_status, stage_updated_at, stage_data)
+                SELECT chat_id, flow || ':' || step, 'running', 0, data FROM funnel_checkpoints WHERE true
+                ON CONFLICT(telegram_id) DO UPDATE SET
+                  stage=excluded.stage, stage_status='running',
+                  stage_updated_at=0, stage_data=excluded.stage_data
+                """
+            )
+            cur.execute("DROP TABLE funnel_checkpoints")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS export_state (
+              name TEXT PRIMARY KEY,
+              last_id INTEGER DEFAULT 0,
+              sent_above TEXT DEFAULT '[]'
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS print_queue (
+              chat_id INTEGER PRIMARY KEY,
+              file_id TEXT,
+              queued_at REAL
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scheduled_jobs (
+              name TEXT PRIMARY KEY,
+              callback TEXT,
+              chat_id INTEGER,
+              data TEXT,
+              due_at REAL
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS broadcasts (
+              id INTEGER PRIMARY KEY,
+              text TEXT,
+              from_chat_id INTEGER,
+              message_id INTEGER,
+              status TEXT DEFAULT 'running',
+              last_user_id INTEGER DEFAULT 0,
+              total INTEGER DEFAULT 0,
+              sent INTEGER DEFAULT 0,
+              failed INTEGER DEFAULT 0,
+              pruned INTEGER DEFAULT 0,
+              created_by INTEGER,
+              created_at REAL,
+              started_at REAL,
+              finished_at REAL
+            )
+            """
+        )
         conn.commit()
 
 def upsert_user(telegram_id: int, username: str | None, full_name: str | None, source: str | None = None):
@@ -52,7 +188,8 @@ def upsert_user(telegram_id: int, username: str | None, full_name: str | None, s
             ON CONFLICT(telegram_id) DO UPDATE SET
               username=excluded.username,
               full_name=excluded.full_name,
-              source=COALESCE(users.source, excluded.source)
+              source=COALESCE(users.source, excluded.source),
+              blocked_at=NULL
             """ ,
             (telegram_id, username or "", full_name or "", source),
         )
@@ -64,14 +201,402 @@ def set_consent(telegram_id: int, consent: bool):
         cur.execute("UPDATE users SET consent=? WHERE telegram_id=?", (1 if consent else 0, telegram_id))
         conn.commit()
 
-def set_stage(telegram_id: int, stage: str):
+def set_stage(telegram_id: int, stage: str, status: str = "done", data: dict | None = None):
+    """
+    Estado do funil do chat. `stage_attempts` conta falhas seguidas no mesmo
+    passo (zera quando o passo muda); `stage_data` só é trocado se vier `data`.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO users (telegram_id, stage, stage_status, stage_updated_at, stage_attempts, stage_data)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(telegram_id) DO UPDATE SET
+              stage_attempts=CASE
+                WHEN users.stage IS NOT excluded.stage THEN excluded.stage_attempts
+                WHEN excluded.stage_status='failed' THEN users.stage_attempts + 1
+                ELSE users.stage_attempts
+              END,
+              stage=excluded.stage,
+              stage_status=excluded.stage_status,
+              stage_updated_at=excluded.stage_updated_at,
+              stage_data=COALESCE(excluded.stage_data, users.stage_data)
+            """,
+            (
+                telegram_id,
+                stage,
+                status,
+                time.time(),
+                1 if status == "failed" else 0,
+                json.dumps(data, ensure_ascii=False) if data is not None else None,
+            ),
+        )
+        conn.commit()
+
+def stuck_stages(older_than: float, limit: int, partition: int = 0, partitions: int = 1) -> list[sqlite3.Row]:
+    """Chats parados num passo (em andamento ou com falha) desde antes de `older_than`."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT telegram_id, stage, stage_status, stage_attempts, stage_data FROM users
+            WHERE stage_status IN ('running', 'failed') AND stage_updated_at < ?
+              AND abs(telegram_id) % ? = ?
+            ORDER BY stage_updated_at
+            LIMIT ?
+            """,
+            (older_than, partitions, partition, limit),
+        )
+        return cur.fetchall()
+
+def log_event(
+    telegram_id: int,
+    event: str,
+    meta: str | None = None,
+    created_at: str | None = None,
+    variant: str | None = None,
+):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO events (telegram_id, event, meta, created_at, variant)
+            VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+            """,
+            (telegram_id, event, meta, created_at, variant),
+        )
+        conn.commit()
+
+def events_after(last_id: int, limit: int) -> list[sqlite3.Row]:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM events WHERE id > ? ORDER BY id LIMIT ?", (last_id, limit))
+        return cur.fetchall()
+
+def get_export_state(name: str) -> tuple[int, set[int]]:
+    with get_conn() as conn:
+        row = conn.execute("SELECT last_id, sent_above FROM export_state WHERE name=?", (name,)).fetchone()
+        if not row:
+            return 0, set()
+        return row["last_id"], set(json.loads(row["sent_above"]))
+
+def set_export_state(name: str, last_id: int, sent_above: set[int]):
+    with get_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO export_state (name, last_id, sent_above) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET last_id=excluded.last_id, sent_above=excluded.sent_above
+            """,
+            (name, last_id, json.dumps(sorted(sent_above))),
+        )
+        conn.commit()
+
+# ====== Join requests (fila persistente) ======
+def enqueue_join_request(group_id: int, user_id: int, user_chat_id: int, first_name: str | None, requested_at: float) -> bool:
+    """
+    Retorna False se o pedido já está pendente na fila (pedido duplicado do mesmo usuário).
+    Um pedido mais novo que a última aprovação (saiu e pediu de novo) volta para 'pending'.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO join_requests (group_id, user_id, user_chat_id, first_name, requested_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(group_id, user_id) DO UPDATE SET
+              user_chat_id=excluded.user_chat_id,
+              first_name=excluded.first_name,
+              status='pending',
+              requested_at=excluded.requested_at,
+              approved_at=NULL,
+              dm_sent_at=NULL
+            WHERE join_requests.status != 'pending'
+              AND excluded.requested_at > COALESCE(join_requests.approved_at, 0)
+            """,
+            (group_id, user_id, user_chat_id, first_name or "", requested_at),
+        )
+        conn.commit()
+        return cur.rowcount > 0
+
+def set_join_status(group_id: int, user_id: int, status: str, approved_at: float | None = None):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE join_requests SET status=?, approved_at=COALESCE(?, approved_at) WHERE group_id=? AND user_id=?",
+            (status, approved_at, group_id, user_id),
+        )
+        conn.commit()
+
+def set_join_dm_sent(group_id: int, user_id: int, dm_sent_at: float):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE join_requests SET dm_sent_at=? WHERE group_id=? AND user_id=?",
+            (dm_sent_at, group_id, user_id),
+        )
+        conn.commit()
+
+def pending_join_requests(partition: int = 0, partitions: int = 1) -> list[sqlite3.Row]:
+    """Pedidos ainda não aprovados (com ou sem DM) ou aprovados sem DM (backlog após restart)."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT j.*, EXISTS(
+                SELECT 1 FROM users u WHERE u.telegram_id=j.user_id AND u.blocked_at IS NULL
+            ) AS known
+            FROM join_requests j
+            WHERE (j.status='pending' OR (j.status='approved' AND j.dm_sent_at IS NULL))
+              AND abs(j.user_chat_id) % ? = ?
+            ORDER BY j.requested_at
+            """,
+            (partitions, partition),
+        )
+        return cur.fetchall()
+
+def is_known_user(telegram_id: int) -> bool:
+    """Já iniciou o bot (e não bloqueou): dá para mandar DM pelo chat id a qualquer hora."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT 1 FROM users WHERE telegram_id=? AND blocked_at IS NULL", (telegram_id,)
+        )
+        return cur.fetchone() is not None
+
+# ====== Fila de updates (modo cluster: ingress -> workers) ======
+def partition_for(key: int, partitions: int) -> int:
+    return abs(key) % partitions
+
+def enqueue_update(partition: int, payload: dict):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO update_queue (partition, payload) VALUES (?, ?)",
+            (partition, json.dumps(payload, ensure_ascii=False)),
+        )
+        conn.commit()
+
+def fetch_updates(partition: int, limit: int = 100, after_id: int = 0) -> list[tuple[int, dict]]:
+    """Updates da partição em ordem de chegada, depois de `after_id`. Só saem da fila com ack_updates()."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, payload FROM update_queue WHERE partition=? AND id>? ORDER BY id LIMIT ?",
+            (partition, after_id, limit),
+        )
+        return [(row["id"], json.loads(row["payload"])) for row in cur.fetchall()]
+
+def ack_updates(ids: list[int]):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany("DELETE FROM update_queue WHERE id=?", [(i,) for i in ids])
+        conn.commit()
+
+
+# ====== Estado compartilhado entre processos ======
+def shared_keys(table: str, partition: int = 0, partitions: int = 1) -> list[int]:
+    """Chaves de uma tabela `(key INTEGER PRIMARY KEY)` (ver shared_set.py) de uma partição."""
+    with get_conn() as conn:
+        rows = conn.execute(f"SELECT key FROM {table} WHERE abs(key) % ? = ?", (partitions, partition)).fetchall()
+        return [r["key"] for r in rows]
+
+def save_shared_keys(table: str, changes: list[tuple[int, bool]]):
+    """changes: (key, presente?)"""
+    with get_conn() as conn:
+        conn.executemany(f"INSERT OR IGNORE INTO {table} (key) VALUES (?)", [(k,) for k, p in changes if p])
+        conn.executemany(f"DELETE FROM {table} WHERE key=?", [(k,) for k, p in changes if not p])
+        conn.commit()
+
+
+# ====== Mídias (file_ids por slot, com versão) ======
+def save_media_versions(changes: list[tuple[str, str | None, int | None, float]]):
+    """changes: (slot, file_id, set_by, set_at), em ordem; cada um vira a próxima versão do slot."""
+    with get_conn() as conn:
+        conn.executemany(
+            """
+            INSERT INTO media_versions (slot, version, file_id, set_by, set_at)
+            VALUES (?, (SELECT COALESCE(MAX(version), 0) + 1 FROM media_versions WHERE slot=?), ?, ?, ?)
+            """,
+            [(slot, slot, fid, by, at) for slot, fid, by, at in changes],
+        )
+        conn.commit()
+
+def import_media(items: dict[str, str]):
+    """Versão 1 só para slots que ainda não existem (migração do file_ids.json)."""
+    with get_conn() as conn:
+        conn.executemany(
+            """
+            INSERT INTO media_versions (slot, version, file_id, set_by, set_at)
+            SELECT ?, 1, ?, NULL, 0 WHERE NOT EXISTS (SELECT 1 FROM media_versions WHERE slot=?)
+            """,
+            [(slot, fid, slot) for slot, fid in items.items() if fid],
+        )
+        conn.commit()
+
+def media_seq() -> int:
+    with get_conn() as conn:
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM media_versions").fetchone()[0]
+
+def current_media() -> list[sqlite3.Row]:
+    """Versão mais recente de cada slot."""
+    with get_conn() as conn:
+        return conn.execute(
+            """
+            SELECT slot, version, file_id, seq FROM media_versions m
+            WHERE version = (SELECT MAX(version) FROM media_versions WHERE slot = m.slot)
+            """
+        ).fetchall()
+
+def media_history(slot: str, limit: int = 10) -> list[sqlite3.Row]:
+    with get_conn() as conn:
+        return conn.execute(
+            "SELECT version, file_id, set_by, set_at FROM media_versions WHERE slot=? ORDER BY version DESC LIMIT ?",
+            (slot, limit),
+        ).fetchall()
+
+
+# ====== Jobs agendados (sobrevivem a restart) ======
+def save_scheduled_jobs(jobs: list[tuple[str, str, int, dict, float]]):
+    """jobs: (name, callback, chat_id, data, due_at)"""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT OR REPLACE INTO scheduled_jobs (name, callback, chat_id, data, due_at) VALUES (?, ?, ?, ?, ?)",
+            [(n, cb, cid, json.dumps(d, ensure_ascii=False), due) for n, cb, cid, d, due in jobs],
+        )
+        conn.commit()
+
+def pop_scheduled_jobs(partition: int = 0, partitions: int = 1) -> list[sqlite3.Row]:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT * FROM scheduled_jobs WHERE abs(chat_id) % ? = ?",
+            (partitions, partition),
+        )
+        rows = cur.fetchall()
+        cur.executemany("DELETE FROM scheduled_jobs WHERE name=?", [(r["name"],) for r in rows])
+        conn.commit()
+        return rows
+
+def conversion_by_variant(events: list[str]) -> list[sqlite3.Row]:
+    """Usuários distintos por (variante, evento); coberto por idx_events_variant_event."""
+    marks = ",".join("?" for _ in events)
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT variant, event, COUNT(DISTINCT telegram_id) AS users
+            FROM events
+            WHERE event IN ({marks})
+            GROUP BY variant, event
+            """,
+            events,
+        )
+        return cur.fetchall()
+
+
+# ====== Prints aguardando a OpenAI (circuito aberto) ======
+def queue_print(chat_id: int, file_id: str, queued_at: float):
+    """Um print por chat: se mandar outro enquanto espera, vale o último."""
+    with get_conn() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO print_queue (chat_id, file_id, queued_at) VALUES (?, ?, ?)",
+            (chat_id, file_id, queued_at),
+        )
+        conn.commit()
+
+def queued_prints(limit: int, partition: int = 0, partitions: int = 1) -> list[sqlite3.Row]:
+    with get_conn() as conn:
+        return conn.execute(
+            "SELECT chat_id, file_id, queued_at FROM print_queue WHERE abs(chat_id) % ? = ? ORDER BY queued_at LIMIT ?",
+            (partitions, partition, limit),
+        ).fetchall()
+
+def dequeue_print(chat_id: int, file_id: str):
+    # só remove se ainda for o mesmo print (o usuário pode ter mandado outro nesse meio-tempo)
+    with get_conn() as conn:
+        conn.execute("DELETE FROM print_queue WHERE chat_id=? AND file_id=?", (chat_id, file_id))
+        conn.commit()
+
+
+# ====== Broadcast (ver broadcast.py) ======
+def create_broadcast(
+    text: str | None,
+    from_chat_id: int | None,
+    message_id: int | None,
+    created_by: int,
+    created_at: float,
+) -> int:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        total = cur.execute("SELECT COUNT(*) FROM users WHERE blocked_at IS NULL").fetchone()[0]
+        cur.execute(
+            """
+            INSERT INTO broadcasts (text, from_chat_id, message_id, total, created_by, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (text, from_chat_id, message_id, total, created_by, created_at),
+        )
+        conn.commit()
+        return cur.lastrowid
+
+def get_broadcast(broadcast_id: int | None = None) -> sqlite3.Row | None:
+    """O broadcast pedido, ou o mais recente."""
+    with get_conn() as conn:
+        if broadcast_id is None:
+            return conn.execute("SELECT * FROM broadcasts ORDER BY id DESC LIMIT 1").fetchone()
+        return conn.execute("SELECT * FROM broadcasts WHERE id=?", (broadcast_id,)).fetchone()
+
+def running_broadcast() -> sqlite3.Row | None:
+    with get_conn() as conn:
+        return conn.execute(
+            "SELECT * FROM broadcasts WHERE status='running' ORDER BY id LIMIT 1"
+        ).fetchone()
+
+def broadcast_recipients(after_id: int, limit: int) -> list[sqlite3.Row]:
+    """Paginação por chave (users.id): cada página é uma busca no índice, sem OFFSET."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, telegram_id FROM users WHERE id > ? AND blocked_at IS NULL ORDER BY id LIMIT ?",
+            (after_id, limit),
+        )
+        return cur.fetchall()
+
+def save_broadcast_progress(
+    broadcast_id: int,
+    last_user_id: int,
+    sent: int,
+    failed: int,
+    pruned: int,
+    started_at: float,
+    finished_at: float | None = None,
+):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE broadcasts SET
+              last_user_id=?, sent=?, failed=?, pruned=?, started_at=?, finished_at=?,
+              status=CASE WHEN ? IS NOT NULL AND status='running' THEN 'done' ELSE status END
+            WHERE id=?
+            """,
+            (last_user_id, sent, failed, pruned, started_at, finished_at, finished_at, broadcast_id),
+        )
+        conn.commit()
+
+def set_broadcast_status(broadcast_id: int, status: str):
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("UPDATE users SET stage=? WHERE telegram_id=?", (stage, telegram_id))
+        cur.execute("UPDATE broadcasts SET status=? WHERE id=?", (status, broadcast_id))
         conn.commit()
 
-def log_event(telegram_id: int, event: str, meta: str | None = None):
+def mark_users_blocked(telegram_ids: list[int], blocked_at: float):
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("INSERT INTO events (telegram_id, event, meta) VALUES (?, ?, ?)", (telegram_id, event, meta))
+        cur.executemany(
+            "UPDATE users SET blocked_at=? WHERE telegram_id=?",
+            [(blocked_at, tid) for tid in telegram_ids],
+        )
         conn.commit()
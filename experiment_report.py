@@ -0,0 +1,47 @@
+"""
+Conversão por variante do teste A/B (ver experiments.py).
+
+Conta usuários distintos por variante em cada etapa do funil e mostra a taxa
+em relação ao /start. A consulta só lê idx_events_variant_event.
+
+    python experiment_report.py
+    python experiment_report.py --steps start confirmou_conta_sim vip_print_aprovado
+"""
+import argparse
+from collections import defaultdict
+
+import db
+
+DEFAULT_STEPS = ("start", "confirmou_conta_sim", "vip_print_aprovado")
+
+
+def funnel_by_variant(steps) -> dict[str, dict[str, int]]:
+    out: dict[str, dict[str, int]] = defaultdict(dict)
+    for row in db.conversion_by_variant(list(steps)):
+        out[row["variant"] or "(sem variante)"][row["event"]] = row["users"]
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--steps", nargs="+", default=list(DEFAULT_STEPS), help="etapas do funil, a primeira é a base")
+    args = ap.parse_args()
+
+    funnel = funnel_by_variant(args.steps)
+    if not funnel:
+        print("Nenhum evento registrado para essas etapas.")
+        return
+
+    width = max(len(s) for s in args.steps)
+    for variant in sorted(funnel):
+        counts = funnel[variant]
+        base = counts.get(args.steps[0], 0)
+        print(f"== {variant} ==")
+        for step in args.steps:
+            n = counts.get(step, 0)
+            rate = f"{100 * n / base:5.1f}%" if base else "    -"
+            print(f"  {step:<{width}}  {n:>7}  {rate}")
+
+
+if __name__ == "__main__":
+    main()
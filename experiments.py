@@ -0,0 +1,103 @@
+"""
+Testes A/B de copy e timing do funil.
+
+Cada chat cai numa variante por hash estável (crc32 de "<experimento>:<chat_id>"),
+sem consulta ao banco no caminho quente. A variante pode sobrescrever as
+chaves de OVERRIDABLE; o que não for sobrescrito usa o padrão do app.py.
+
+Experimento definido em JSON (EXPERIMENTS_FILE), por exemplo:
+    {
+      "name": "espera_followup_out",
+      "variants": [
+        {"name": "controle", "weight": 1},
+        {"name": "rapido", "weight": 1, "overrides": {"wait_seconds": 120}}
+      ]
+    }
+Sem arquivo, todo mundo fica na variante "controle".
+"""
+import json
+import zlib
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from itertools import accumulate
+
+OVERRIDABLE = frozenset({
+    # tempos (segundos)
+    "wait_seconds",
+    "vip_wait_seconds",
+    # funil inicial
+    "start_audio_caption",
+    "start_video_slot",
+    "img1_caption",
+    "btn_criar_conta",
+    "followup_text",
+    "btn_confirm_sim",
+    "img2_caption",
+    # VIP
+    "vip_intro_text",
+    "vip_audio_caption",
+    "vip_video_slot",
+    "vip_ask_print_text",
+    "vip_followup_text",
+})
+
+
+@dataclass(frozen=True)
+class Variant:
+    name: str
+    weight: int = 1
+    overrides: dict = field(default_factory=dict)
+
+    def get(self, key: str, default):
+        return self.overrides.get(key, default)
+
+
+@dataclass(frozen=True)
+class Experiment:
+    name: str
+    variants: tuple[Variant, ...]
+    _cumulative: tuple[int, ...] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        if not self.variants:
+            raise ValueError(f"Experimento {self.name} sem variantes")
+        for v in self.variants:
+            if v.weight <= 0:
+                raise ValueError(f"Variante {v.name}: peso deve ser positivo (recebido {v.weight})")
+            unknown = set(v.overrides) - OVERRIDABLE
+            if unknown:
+                raise ValueError(f"Variante {v.name}: chaves desconhecidas {sorted(unknown)}")
+        object.__setattr__(self, "_cumulative", tuple(accumulate(v.weight for v in self.variants)))
+
+    def assign(self, chat_id: int) -> Variant:
+        bucket = zlib.crc32(f"{self.name}:{chat_id}".encode()) % self._cumulative[-1]
+        return self.variants[bisect_right(self._cumulative, bucket)]
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Experiment":
+        return cls(
+            name=d["name"],
+            variants=tuple(
+                Variant(v["name"], int(v.get("weight", 1)), dict(v.get("overrides") or {}))
+                for v in d["variants"]
+            ),
+        )
+
+
+CONTROL = Experiment("controle", (Variant("controle"),))
+
+_active: Experiment = CONTROL
+
+
+def load_experiment(path: str | None) -> Experiment:
+    global _active
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            _active = Experiment.from_dict(json.load(f))
+    else:
+        _active = CONTROL
+    return _active
+
+
+def variant_for(chat_id: int) -> Variant:
+    return _active.assign(chat_id)
@@ -0,0 +1,220 @@
+"""
+Exportação dos eventos do funil (tabela `events`) em lotes.
+
+`track_event` só grava no SQLite; este exportador roda a cada intervalo e
+envia o que ainda não foi enviado, em ordem de id:
+  - forms:  um POST por linha no Google Forms, com paralelismo limitado;
+  - csv / ndjson: um arquivo por lote em `out_dir`, para importar offline.
+
+O progresso fica em `export_state` (high-water mark + ids já enviados acima
+dele), gravado a cada CHECKPOINT_EVERY segundos durante o lote e no fim
+dele (inclusive se o lote for interrompido), então um restart não reenvia
+nem pula nada.
+
+Forms fora do ar (5xx, timeout, conexão recusada) abre o circuito: os
+eventos continuam só no SQLite e nenhum POST sai até o teste do meio-aberto
+passar. Na volta, o acumulado escoa a `rate` POSTs por segundo.
+"""
+import os
+import csv
+import json
+import time
+import asyncio
+import logging
+
+import httpx
+
+import db
+import tracing
+from breaker import CLOSED, CircuitBreaker
+from utils import RateLimiter
+
+log = logging.getLogger("presente-vip-unificado.export")
+
+# Dados extraídos do link pré-preenchido que você mandou
+GOOGLE_FORM_URL = (
+    "https://docs.google.com/forms/d/e/"
+    "1FAIpQLScf3cwOS_PoUy1NMF5IrbNFF3QeXjjIuJMQ6PVbQyA0V8FM3g/formResponse"
+)
+
+FIELD_TIMESTAMP = "entry.1409657662"
+FIELD_CHAT_ID = "entry.1850402601"
+FIELD_STEP = "entry.1368055621"
+FIELD_EXTRA = "entry.772961359"
+
+MODES = ("forms", "csv", "ndjson")
+CHECKPOINT_EVERY = 1.0  # segundos entre gravações do progresso durante um lote de POSTs
+CSV_COLUMNS = ("id", "created_at", "telegram_id", "event", "meta", "variant")
+
+
+def advance(rows, last_id: int, sent: set[int]) -> tuple[int, set[int]]:
+    """O high-water mark só avança sobre ids contíguos já entregues (ou recusados de vez)."""
+    sent = set(sent)
+    for row in rows:
+        if row["id"] <= last_id:
+            continue
+        if row["id"] not in sent:
+            break
+        last_id = row["id"]
+        sent.discard(row["id"])
+    return last_id, sent
+
+
+def form_payload(row) -> dict:
+    extra = json.loads(row["meta"] or "{}")
+    extra["event_id"] = row["id"]  # permite reordenar/deduplicar na planilha
+    extra["variant"] = row["variant"]
+    return {
+        FIELD_TIMESTAMP: row["created_at"],
+        FIELD_CHAT_ID: str(row["telegram_id"]),
+        FIELD_STEP: row["event"],
+        FIELD_EXTRA: json.dumps(extra, ensure_ascii=False),
+    }
+
+
+class EventExporter:
+    def __init__(
+        self,
+        mode: str = "forms",
+        form_url: str = GOOGLE_FORM_URL,
+        batch_size: int = 500,
+        parallelism: int = 4,
+        out_dir: str = "exports",
+        client: httpx.AsyncClient | None = None,
+        breaker: CircuitBreaker | None = None,
+        rate: float = 10.0,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"EXPORT_MODE inválido: {mode} (use {', '.join(MODES)})")
+        self.mode = mode
+        self.form_url = form_url
+        self.batch_size = batch_size
+        self.parallelism = parallelism
+        self.out_dir = out_dir
+        self.client = client  # cliente "forms" do http_pool.py
+        self.breaker = breaker or CircuitBreaker("forms")
+        self._limiter = RateLimiter(rate)
+        self._lock = asyncio.Lock()
+
+    async def job(self, context) -> None:
+        """Callback para job_queue.run_repeating."""
+        with tracing.trace("export", mode=self.mode):
+            await self.run_once()
+
+    async def run_once(self, max_rows: int | None = None) -> int:
+        """Envia um lote (de até `max_rows` linhas, no drain). Retorna quantas linhas foram entregues."""
+        async with self._lock:
+            base_id, base_sent = await asyncio.to_thread(db.get_export_state, self.mode)
+            limit = min(self.batch_size, max_rows) if max_rows else self.batch_size
+            rows = await asyncio.to_thread(db.events_after, base_id, limit)
+            todo = [r for r in rows if r["id"] not in base_sent]
+            if not todo:
+                return 0
+            if self.mode == "forms" and not self.breaker.ready():
+                return 0  # circuito aberto: os eventos esperam no SQLite
+
+            ok_ids: set[int] = set()
+            rejected: set[int] = set()
+            last_id = base_id
+
+            async def checkpoint():
+                nonlocal last_id
+                last_id, sent = advance(rows, base_id, base_sent | ok_ids | rejected)
+                await asyncio.to_thread(db.set_export_state, self.mode, last_id, sent)
+
+            try:
+                if self.mode == "forms":
+                    await self._send_forms(todo, ok_ids, rejected, checkpoint)
+                else:
+                    ok_ids |= await asyncio.to_thread(self._write_file, todo)
+            finally:
+                # também quando o drain corta o lote no meio: o que já foi não é reenviado
+                await checkpoint()
+
+            log.info(
+                "[EXPORT] %s: %s/%s linhas entregues, %s recusadas (hwm=%s)",
+                self.mode, len(ok_ids), len(todo), len(rejected), last_id,
+            )
+            return len(ok_ids)
+
+    # ====== Google Forms ======
+    async def _send_forms(self, rows, ok: set[int], rejected: set[int], checkpoint) -> None:
+        """Preenche `ok` (entregues) e `rejected` (recusados de vez com 4xx), chamando `checkpoint` pelo caminho."""
+        client = self.client or httpx.AsyncClient(timeout=10)
+        sem = asyncio.Semaphore(self.parallelism)
+        throttled = False
+        saved_at = time.monotonic()
+
+        async def send(row):
+            nonlocal throttled, saved_at
+            async with sem:
+                # meio-aberto: só o POST de teste sai; o resto espera o resultado dele
+                if throttled or not self.breaker.allow():
+                    return
+                await self._limiter.acquire()
+                try:
+                    with tracing.span("forms.post", chat=row["telegram_id"], event=row["event"]) as attrs:
+                        resp = await client.post(
+                            self.form_url,
+                            data=form_payload(row),
+                            headers={"User-Agent": "Mozilla/5.0"},
+                        )
+                        attrs["status"] = resp.status_code
+                        if resp.status_code != 200:
+                            attrs["error"] = f"http_{resp.status_code}"
+                    if resp.status_code == 200:
+                        ok.add(row["id"])
+                        self.breaker.success()
+                    elif resp.status_code == 429:
+                        throttled = True  # resto do lote fica para o próximo ciclo
+                        self.breaker.success()  # o Forms está de pé, só pediu calma
+                    elif resp.status_code >= 500:
+                        log.warning("[EXPORT] status=%s body (primeiros 300 chars): %s", resp.status_code, resp.text[:300])
+                        self.breaker.failure()
+                    else:
+                        # 4xx: reenviar não muda nada; descarta para o high-water mark seguir
+                        log.warning(
+                            "[EXPORT] evento %s descartado: status=%s body (primeiros 300 chars): %s",
+                            row["id"], resp.status_code, resp.text[:300],
+                        )
+                        rejected.add(row["id"])
+                        self.breaker.success()
+                except httpx.HTTPError as e:
+                    log.warning("Erro ao enviar evento para o Google Sheets: %r", e)
+                    self.breaker.failure()
+
+                if time.monotonic() - saved_at >= CHECKPOINT_EVERY:
+                    saved_at = time.monotonic()
+                    await checkpoint()
+
+        try:
+            await asyncio.gather(*(send(row) for row in rows))
+        finally:
+            if client is not self.client:
+                await client.aclose()
+        if throttled:
+            log.warning("[EXPORT] Google Forms limitou (429); retomando no próximo ciclo")
+        waiting = len(rows) - len(ok) - len(rejected)
+        if waiting and self.breaker.state != CLOSED:
+            log.warning("[EXPORT] circuito %s: %s eventos aguardam no SQLite", self.breaker.state, waiting)
+
+    # ====== Arquivos ======
+    def _write_file(self, rows) -> set[int]:
+        """Um arquivo por lote, nomeado pelo intervalo de ids: regravar o mesmo lote é idempotente."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        name = f"events-{rows[0]['id']:010d}-{rows[-1]['id']:010d}.{self.mode}"
+        path = os.path.join(self.out_dir, name)
+        tmp = path + ".tmp"
+
+        with open(tmp, "w", encoding="utf-8", newline="") as f:
+            if self.mode == "csv":
+                w = csv.writer(f)
+                w.writerow(CSV_COLUMNS)
+                w.writerows([row[c] for c in CSV_COLUMNS] for row in rows)
+            else:
+                for row in rows:
+                    f.write(json.dumps({c: row[c] for c in CSV_COLUMNS}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return {row["id"] for row in rows}
@@ -0,0 +1,299 @@
+"""
+Fake Bot API do Telegram para testes de carga locais (nada sai para a internet).
+
+Gera uma rajada de updates (/start, clique em "SIM" e join requests),
+responde aos métodos que o bot usa e mede a vazão dos envios.
+
+    python fake_telegram.py --users 500 --joins 500
+    TELEGRAM_API_URL=http://127.0.0.1:8081 GOOGLE_FORM_URL=http://127.0.0.1:8081/formResponse \\
+        python cluster.py            # ou: python app.py
+
+GET /stats devolve os contadores em JSON. POST /formResponse imita o Google
+Forms (para o exporter.py): conta linhas, duplicadas e fora de ordem, e com
+--forms-429 responde 429 numa fração dos POSTs. --fail-rate e --blocked-every
+simulam falhas transitórias (502) e usuários que bloquearam o bot (403).
+POST /v1/responses imita a OpenAI (OPENAI_BASE_URL=http://127.0.0.1:8081/v1)
+aprovando o print com a data de hoje; é o que o replay.py usa.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Callable
+
+from aiohttp import web
+
+log = logging.getLogger("fake-telegram")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GROUP_ID = -1001234567890
+
+
+class FakeTelegram:
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        forms_429: float = 0,
+        blocked_every: int = 0,
+        fail_rate: float = 0,
+        openai_latency_ms: float = 0,
+    ):
+        self.latency = latency_ms / 1000
+        self.openai_latency = openai_latency_ms / 1000
+        self.forms_429 = forms_429
+        self.blocked_every = blocked_every
+        self.fail_rate = fail_rate
+        self.updates: list[dict] = []
+        self.next_update_id = 1
+        self.new_updates = asyncio.Event()
+        self.message_id = 0
+        self.calls = Counter()
+        self.per_chat: dict[int, list[str]] = defaultdict(list)
+        self.forms = 0
+        self.forms_throttled = 0
+        self.form_event_ids: set[int] = set()
+        self.form_duplicates = 0
+        self.form_out_of_order = 0
+        self._max_event_id = 0
+        self.started_at: float | None = None
+        self.last_call_at: float | None = None
+        self.openai_calls = 0
+        # chamado a cada método da Bot API (depois da latência simulada): on_call(method, params)
+        self.on_call: Callable[[str, dict], None] | None = None
+
+    # ====== geração de updates ======
+    def push(self, **update):
+        update["update_id"] = self.next_update_id
+        self.next_update_id += 1
+        self.updates.append(update)
+        self.new_updates.set()
+
+    @staticmethod
+    def _user(uid: int) -> dict:
+        return {"id": uid, "is_bot": False, "first_name": f"User{uid}"}
+
+    def load(self, users: int, joins: int):
+        now = int(time.time())
+        for uid in range(1, users + 1):
+            private = {"id": uid, "type": "private", "first_name": f"User{uid}"}
+            self.push(message={
+                "message_id": 1, "date": now, "chat": private, "from": self._user(uid),
+                "text": "/start presente",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            })
+            self.push(callback_query={
+                "id": f"cb{uid}", "from": self._user(uid), "chat_instance": str(uid),
+                "data": "confirm_sim",
+                "message": {"message_id": 2, "date": now, "chat": private},
+            })
+        for uid in range(100_001, 100_001 + joins):
+            self.push(chat_join_request={
+                "chat": {"id": GROUP_ID, "type": "supergroup", "title": "VIP"},
+                "from": self._user(uid), "user_chat_id": uid, "date": now,
+            })
+
+    # ====== respostas ======
+    def _message(self, chat_id, **extra) -> dict:
+        self.message_id += 1
+        return {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            **extra,
+        }
+
+    def result_for(self, method: str, params: dict):
+        n = self.message_id + 1
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        if method == "sendMessage":
+            return self._message(params["chat_id"], text=params.get("text", ""))
+        if method == "sendPhoto":
+            photo = {"file_id": f"photo-{n}", "file_unique_id": f"uphoto-{n}", "width": 1, "height": 1}
+            return self._message(params["chat_id"], photo=[photo], caption=params.get("caption"))
+        if method == "sendAudio":
+            audio = {"file_id": f"audio-{n}", "file_unique_id": f"uaudio-{n}", "duration": 1}
+            return self._message(params["chat_id"], audio=audio)
+        if method == "sendVideo":
+            video = {"file_id": f"video-{n}", "file_unique_id": f"uvideo-{n}", "width": 1, "height": 1, "duration": 1}
+            return self._message(params["chat_id"], video=video)
+        if method == "copyMessage":
+            return {"message_id": n}
+        if method == "getFile":
+            return {
+                "file_id": params["file_id"], "file_unique_id": "u" + params["file_id"],
+                "file_size": 1, "file_path": "photos/print.jpg",
+            }
+        return True  # approveChatJoinRequest, answerCallbackQuery, deleteWebhook, ...
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        if request.content_type == "application/json":
+            params = await request.json()
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        self.started_at = self.started_at or now
+        self.last_call_at = now
+        self.calls[method] += 1
+        if self.on_call:
+            self.on_call(method, params)
+        chat_id = params.get("chat_id")
+        if self.blocked_every and chat_id is not None and int(chat_id) % self.blocked_every == 0:
+            self.calls["blocked"] += 1
+            return web.json_response(
+                {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"},
+                status=403,
+            )
+        if self.fail_rate and method.startswith("send") and random.random() < self.fail_rate:
+            self.calls["failed"] += 1
+            return web.json_response({"ok": False, "error_code": 502, "description": "Bad Gateway"}, status=502)
+        if chat_id is not None and method.startswith("send"):
+            self.per_chat[int(chat_id)].append(method)
+        return web.json_response({"ok": True, "result": self.result_for(method, params)})
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        with open(os.path.join(HERE, "presente_do_jota.jpg"), "rb") as f:
+            return web.Response(body=f.read(), content_type="image/jpeg")
+
+    async def handle_form(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        if self.forms_429 and random.random() < self.forms_429:
+            self.forms_throttled += 1
+            return web.Response(status=429, text="Too Many Requests")
+
+        self.forms += 1
+        extra = json.loads(data.get("entry.772961359") or "{}")
+        event_id = extra.get("event_id")
+        if event_id is not None:
+            if event_id in self.form_event_ids:
+                self.form_duplicates += 1
+            if event_id < self._max_event_id:
+                self.form_out_of_order += 1
+            self._max_event_id = max(self._max_event_id, event_id)
+            self.form_event_ids.add(event_id)
+        return web.Response(text="ok")
+
+    async def handle_openai(self, request: web.Request) -> web.Response:
+        await request.read()
+        if self.openai_latency:
+            await asyncio.sleep(self.openai_latency)
+        self.openai_calls += 1
+        text = f"✅ Aprovado! Depósito de R$50,00 em {datetime.now():%d/%m/%Y}."
+        return web.json_response({
+            "id": f"resp_{self.openai_calls}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": "gpt-4o",
+            "status": "completed",
+            "output": [{
+                "type": "message",
+                "id": f"msg_{self.openai_calls}",
+                "status": "completed",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }],
+            "parallel_tool_calls": False,
+            "tool_choice": "auto",
+            "tools": [],
+        })
+
+    def stats(self) -> dict:
+        sends = sum(v for k, v in self.calls.items() if k.startswith("send"))
+        elapsed = (self.last_call_at - self.started_at) if self.started_at else 0
+        return {
+            "calls": dict(self.calls),
+            "sends": sends,
+            "forms": self.forms,
+            "openai": self.openai_calls,
+            "forms_throttled": self.forms_throttled,
+            "forms_duplicates": self.form_duplicates,
+            "forms_out_of_order": self.form_out_of_order,
+            "pending_updates": len(self.updates),
+            "elapsed_s": round(elapsed, 2),
+            "sends_per_s": round(sends / elapsed, 1) if elapsed else 0,
+        }
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.*}", self.handle_file)
+        app.router.add_post("/formResponse", self.handle_form)
+        app.router.add_post("/v1/responses", self.handle_openai)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+
+async def _report(fake: FakeTelegram, every: float):
+    last = None
+    while True:
+        await asyncio.sleep(every)
+        s = fake.stats()
+        if s != last:
+            log.info(json.dumps(s))
+            last = s
+
+
+async def _main(args):
+    fake = FakeTelegram(
+        latency_ms=args.latency_ms,
+        forms_429=args.forms_429,
+        blocked_every=args.blocked_every,
+        fail_rate=args.fail_rate,
+        openai_latency_ms=args.openai_latency_ms,
+    )
+    fake.load(args.users, args.joins)
+    runner = web.AppRunner(fake.make_app())
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    log.info("Fake Telegram em http://%s:%s (%s updates na fila)", args.host, args.port, len(fake.updates))
+    try:
+        await _report(fake, args.report_every)
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    logging.basicConfig(format="%(asctime)s [%(levelname)s] %(name)s: %(message)s", level=logging.INFO)
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--users", type=int, default=200, help="usuários que mandam /start + clique no SIM")
+    ap.add_argument("--joins", type=int, default=200, help="join requests no grupo")
+    ap.add_argument("--latency-ms", type=float, default=20, help="latência simulada por chamada")
+    ap.add_argument("--forms-429", type=float, default=0, help="fração dos POSTs no form que recebem 429")
+    ap.add_argument("--blocked-every", type=int, default=0, help="chat_id múltiplo de N responde 403 (bloqueou o bot)")
+    ap.add_argument("--fail-rate", type=float, default=0, help="fração dos send* que recebem 502 (falha transitória)")
+    ap.add_argument("--openai-latency-ms", type=float, default=2000, help="latência simulada da validação do print")
+    ap.add_argument("--report-every", type=float, default=5)
+    asyncio.run(_main(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
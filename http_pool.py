@@ -0,0 +1,175 @@
+"""
+Camada HTTP de saída única para Telegram, OpenAI e Google Forms.
+
+Um httpx.AsyncClient por destino, configurado uma vez: tamanho de pool
+próprio (teto de concorrência previsível), keep-alive, HTTP/2 quando o pacote
+`h2` está instalado, timeouts consistentes e nova tentativa de conexão no
+transporte. Os clientes são injetados no Bot do PTB (SharedHTTPXRequest), no
+AsyncOpenAI e no exporter.py.
+
+O trace do httpcore conta conexões TCP/TLS novas por destino; com o número de
+requisições isso dá a taxa de reaproveitamento de conexão (stats()).
+"""
+import math
+import logging
+import importlib.util
+from dataclasses import dataclass
+
+import httpx
+from telegram.request import HTTPXRequest
+
+import tracing
+
+log = logging.getLogger("presente-vip-unificado.http")
+
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+# dimensionamento do pool de envios (lei de Little: conexões ≈ envios/s × latência)
+FUNNEL_SEND_RATE = 30.0  # funis: o Telegram não passa de ~30 msg/s por bot
+TELEGRAM_LATENCY_P99 = 0.5  # segundos por chamada na Bot API (ver bench_pool.py)
+HEADROOM = 1.5
+
+
+@dataclass(frozen=True)
+class HostPool:
+    max_connections: int
+    connect_timeout: float = 10.0
+    read_timeout: float = 20.0
+    write_timeout: float = 20.0
+    pool_timeout: float = 10.0
+    keepalive_expiry: float = 30.0
+    retries: int = 2  # só falhas de conexão; o resto fica com quem chama
+
+
+class HttpPool:
+    def __init__(self, hosts: dict[str, HostPool]):
+        self.hosts = hosts
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._stats = {name: {"requests": 0, "connections": 0, "tls": 0, "errors": 0} for name in hosts}
+
+    def client(self, name: str) -> httpx.AsyncClient:
+        c = self._clients.get(name)
+        if c is None or c.is_closed:
+            c = self._clients[name] = self._build(name)
+        return c
+
+    def _build(self, name: str) -> httpx.AsyncClient:
+        cfg = self.hosts[name]
+        stats = self._stats[name]
+
+        async def trace(event: str, info: dict) -> None:
+            if event == "connection.connect_tcp.complete":
+                stats["connections"] += 1
+            elif event == "connection.start_tls.complete":
+                stats["tls"] += 1
+
+        async def on_request(request: httpx.Request) -> None:
+            request.extensions["trace"] = trace
+
+        async def on_response(response: httpx.Response) -> None:
+            stats["requests"] += 1
+            if response.status_code >= 500:
+                stats["errors"] += 1
+
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                connect=cfg.connect_timeout,
+                read=cfg.read_timeout,
+                write=cfg.write_timeout,
+                pool=cfg.pool_timeout,
+            ),
+            # limites e HTTP/2 ficam no transporte (o cliente ignora os seus quando recebe um)
+            transport=httpx.AsyncHTTPTransport(
+                http1=True,
+                http2=HTTP2,
+                retries=cfg.retries,
+                limits=httpx.Limits(
+                    max_connections=cfg.max_connections,
+                    max_keepalive_connections=cfg.max_connections,
+                    keepalive_expiry=cfg.keepalive_expiry,
+                ),
+            ),
+            event_hooks={"request": [on_request], "response": [on_response]},
+        )
+
+    async def aclose(self) -> None:
+        for c in self._clients.values():
+            await c.aclose()
+        self._clients.clear()
+
+    # ====== Métricas ======
+    def stats(self) -> dict[str, dict]:
+        out = {}
+        for name, s in self._stats.items():
+            reuse = 1 - s["connections"] / s["requests"] if s["requests"] else 0.0
+            out[name] = {**s, "reuse": max(0.0, reuse)}
+        return out
+
+    def log_stats(self) -> None:
+        for name, s in self.stats().items():
+            if s["requests"]:
+                log.info(
+                    "[HTTP] %s: req=%s conexões=%s tls=%s erros5xx=%s reaproveitamento=%.1f%%",
+                    name, s["requests"], s["connections"], s["tls"], s["errors"], 100 * s["reuse"],
+                )
+
+
+class SharedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest do PTB usando um cliente do HttpPool (que cuida de fechar)."""
+
+    def __init__(self, pool: HttpPool, name: str, media_write_timeout: float = 20.0):
+        cfg = pool.hosts[name]
+        self._pool = pool
+        self._pool_name = name
+        super().__init__(
+            connection_pool_size=cfg.max_connections,
+            connect_timeout=cfg.connect_timeout,
+            read_timeout=cfg.read_timeout,
+            write_timeout=cfg.write_timeout,
+            pool_timeout=cfg.pool_timeout,
+            media_write_timeout=media_write_timeout,
+        )
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return self._pool.client(self._pool_name)
+
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs) -> tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        if api_method == "getUpdates":  # long-poll, fora de qualquer update
+            return await super().do_request(url, method, request_data, **kwargs)
+        with tracing.span(f"telegram.{api_method}") as attrs:
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+            attrs["status"] = code
+            if code >= 400:
+                attrs["error"] = f"http_{code}"
+            return code, payload
+
+    async def shutdown(self) -> None:
+        """O HttpPool fecha os clientes no post_shutdown."""
+
+
+def telegram_pool_size(settings) -> int:
+    """TELEGRAM_POOL_SIZE, ou o tamanho que a concorrência esperada de envios pede."""
+    if settings.telegram_pool_size:
+        return settings.telegram_pool_size
+    rate = settings.join_approve_rate + settings.join_dm_rate + settings.broadcast_rate + FUNNEL_SEND_RATE
+    return max(8, math.ceil(rate * TELEGRAM_LATENCY_P99 * HEADROOM))
+
+
+_pool: HttpPool | None = None
+
+
+def get_http_pool() -> HttpPool:
+    global _pool
+    if _pool is None:
+        from config import get_settings
+
+        s = get_settings()
+        _pool = HttpPool({
+            "telegram": HostPool(max_connections=telegram_pool_size(s)),
+            # getUpdates é sequencial: 1 conexão em long-poll + 1 de folga para o restart do polling
+            "telegram_poll": HostPool(max_connections=2, pool_timeout=5.0),
+            "openai": HostPool(max_connections=s.openai_pool_size, read_timeout=60.0),
+            "forms": HostPool(max_connections=s.export_parallelism, read_timeout=10.0, write_timeout=10.0),
+        })
+    return _pool
@@ -0,0 +1,155 @@
+"""
+Processamento de imagem (Pillow) fora do event loop.
+
+Um ProcessPoolExecutor persistente com workers já aquecidos (Pillow importado
+no initializer). Os bytes vão e voltam por shared memory em vez de pickle;
+o processo principal só trafega o nome do bloco e o tamanho.
+"""
+import io
+import os
+import sys
+import base64
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+log = logging.getLogger("presente-vip-unificado.image")
+
+MAX_SIDE = 2048  # a OpenAI reduz para 2048px de qualquer jeito
+
+
+class ImagePoolBusy(RuntimeError):
+    """Fila cheia: o chamador deve pedir para o usuário reenviar em instantes."""
+
+
+# ====== lado do worker ======
+def _warm():
+    from PIL import Image, JpegImagePlugin, PngImagePlugin  # noqa: F401
+
+
+def _noop():
+    return os.getpid()
+
+
+def encode_data_url(raw: bytes) -> str:
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(raw))
+    if img.mode in ("P", "RGBA"):
+        img = img.convert("RGB")
+    if max(img.size) > MAX_SIDE:
+        img.thumbnail((MAX_SIDE, MAX_SIDE))
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
+    return f"data:image/png;base64,{b64}"
+
+
+def _process(in_name: str, size: int) -> tuple[str, int, str]:
+    src = shared_memory.SharedMemory(name=in_name)
+    try:
+        raw = bytes(src.buf[:size])
+    finally:
+        src.close()
+
+    out = encode_data_url(raw).encode("ascii")
+    dst = shared_memory.SharedMemory(create=True, size=max(1, len(out)))
+    dst.buf[: len(out)] = out
+    dst.close()
+    # quem libera (unlink) é o processo principal
+    return dst.name, len(out), hashlib.sha256(raw).hexdigest()
+
+
+def _read_and_unlink(name: str, size: int) -> bytes:
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _discard_result(fut):
+    """Resultado de task que estourou o timeout: libera o bloco de saída."""
+    if fut.cancelled() or fut.exception():
+        return
+    name, size, _ = fut.result()
+    try:
+        _read_and_unlink(name, size)
+    except FileNotFoundError:
+        pass
+
+
+# ====== lado do processo principal ======
+class ImagePool:
+    def __init__(self, workers: int = 2, max_pending: int = 32, timeout: float = 20.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pending = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    def start(self) -> None:
+        # forkserver: filhos limpos, sem herdar threads/sockets do bot
+        method = "forkserver" if sys.platform.startswith("linux") else "spawn"
+        ctx = multiprocessing.get_context(method)
+        if method == "forkserver":
+            ctx.set_forkserver_preload([__name__])
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=ctx, initializer=_warm
+        )
+        # sobe todos os workers agora, sem bloquear o startup
+        for _ in range(self.workers):
+            self._executor.submit(_noop)
+
+    def shutdown(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _restart(self) -> None:
+        log.warning("Reiniciando pool de imagem (task travada)")
+        old = self._executor
+        self.start()
+        if old:
+            for proc in list((old._processes or {}).values()):
+                proc.terminate()
+            old.shutdown(wait=False, cancel_futures=True)
+
+    async def to_data_url(self, raw: bytes) -> tuple[str, str]:
+        """Retorna (data_url PNG, sha256 dos bytes originais)."""
+        if self._executor is None:
+            self.start()
+        if self._pending >= self.max_pending:
+            raise ImagePoolBusy(f"{self._pending} imagens na fila")
+
+        self._pending += 1
+        executor = self._executor
+        src = shared_memory.SharedMemory(create=True, size=max(1, len(raw)))
+        try:
+            src.buf[: len(raw)] = raw
+            fut = executor.submit(_process, src.name, len(raw))
+            try:
+                name, size, digest = await asyncio.wait_for(
+                    asyncio.wrap_future(fut), self.timeout
+                )
+            except asyncio.TimeoutError:
+                fut.add_done_callback(_discard_result)
+                self._restart()
+                raise
+            return _read_and_unlink(name, size).decode("ascii"), digest
+        except BrokenProcessPool:
+            # o _restart de outra task matou este pool (quem chama pede para reenviar);
+            # se o pool quebrou sozinho (ex.: worker morto por falta de memória), sobe outro
+            if self._executor is executor:
+                self._restart()
+            raise
+        finally:
+            self._pending -= 1
+            src.close()
+            src.unlink()
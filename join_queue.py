@@ -0,0 +1,219 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut
+
+import db
+import tracing
+from utils import RateLimiter, percentiles
+
+log = logging.getLogger("presente-vip-unificado.join")
+
+
+@dataclass
+class JoinRequest:
+    group_id: int
+    user_id: int
+    user_chat_id: int
+    first_name: str
+    requested_at: float
+    approved_at: float | None = None  # já aprovado: na pista de DM, só falta a mensagem
+    known: bool = False  # já iniciou o bot: a DM chega mesmo depois da aprovação
+    handed_off: bool = field(default=False, compare=False, repr=False)  # já entrou na pista de aprovação
+    # trace do update que criou o pedido (backlog retomado no startup não tem)
+    trace: tracing.Trace | None = field(default=None, compare=False, repr=False)
+
+
+class JoinPipeline:
+    """
+    Fila de join requests em duas pistas, cada uma com seu ritmo:
+      - aprovação (`approve_rate`/s);
+      - DM de boas-vindas (`dm_rate`/s).
+    O `user_chat_id` só serve para falar com quem nunca iniciou o bot enquanto
+    o pedido não foi processado; depois da aprovação a DM volta 403. Então:
+      - quem já está em `users` vai para as duas pistas de uma vez;
+      - os outros entram na pista de DM e passam para a aprovação quando a DM
+        sai (ou falha de vez) ou depois de `dm_grace` segundos, o que vier
+        antes: numa rajada a aprovação não fica presa ao ritmo das DMs.
+    Tudo é persistido em `join_requests`, então um restart retoma o backlog.
+    """
+
+    def __init__(
+        self,
+        bot,
+        send_dm,
+        approve_rate: float = 20,
+        dm_rate: float = 15,
+        approve_workers: int = 4,
+        dm_workers: int = 4,
+        dm_grace: float = 3.0,
+        partition: int = 0,
+        partitions: int = 1,
+    ):
+        self.bot = bot
+        self.send_dm = send_dm  # async (bot, JoinRequest) -> None
+        self._approve_limiter = RateLimiter(approve_rate)
+        self._dm_limiter = RateLimiter(dm_rate)
+        self._approve_q: asyncio.Queue[JoinRequest] = asyncio.Queue()
+        self._dm_q: asyncio.Queue[JoinRequest] = asyncio.Queue()
+        self._n_approve = approve_workers
+        self._n_dm = dm_workers
+        self.dm_grace = dm_grace
+        self._inflight: set[tuple[int, int]] = set()
+        self._tasks: list[asyncio.Task] = []
+        self._latencies: deque[float] = deque(maxlen=5000)  # pedido -> aprovação
+        self._dm_latencies: deque[float] = deque(maxlen=5000)  # pedido -> DM enviada
+        self.approved = 0
+        # no modo cluster cada worker só retoma o backlog da sua partição
+        self._partition = (partition, partitions)
+
+    async def start(self) -> None:
+        partition, partitions = self._partition
+        rows = await asyncio.to_thread(db.pending_join_requests, partition, partitions)
+        for row in rows:
+            req = JoinRequest(
+                row["group_id"], row["user_id"], row["user_chat_id"],
+                row["first_name"], row["requested_at"], row["approved_at"], bool(row["known"]),
+            )
+            self._inflight.add((req.group_id, req.user_id))
+            if row["dm_sent_at"] is not None:
+                self._hand_off(req)  # pendente com DM já enviada
+            else:
+                self._route(req)
+        if rows:
+            log.info("Backlog de join requests retomado: %s pedidos", len(rows))
+
+        self._tasks = [
+            asyncio.create_task(self._approve_worker()) for _ in range(self._n_approve)
+        ] + [asyncio.create_task(self._dm_worker()) for _ in range(self._n_dm)]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.log_stats()
+
+    async def submit(self, req: JoinRequest) -> bool:
+        """Enfileira o pedido. Pedidos repetidos do mesmo usuário são ignorados."""
+        key = (req.group_id, req.user_id)
+        if key in self._inflight:
+            return False
+        is_new = await asyncio.to_thread(
+            db.enqueue_join_request,
+            req.group_id, req.user_id, req.user_chat_id, req.first_name, req.requested_at,
+        )
+        if not is_new:
+            return False
+        self._inflight.add(key)
+        req.trace = req.trace or tracing.current()
+        req.known = await asyncio.to_thread(db.is_known_user, req.user_id)
+        self._route(req)
+        return True
+
+    def _route(self, req: JoinRequest) -> None:
+        self._dm_q.put_nowait(req)
+        if req.approved_at is not None:
+            return  # já aprovado: só falta a DM
+        if req.known:
+            self._hand_off(req)
+        else:
+            asyncio.get_running_loop().call_later(self.dm_grace, self._hand_off, req)
+
+    def _hand_off(self, req: JoinRequest) -> None:
+        if not req.handed_off:
+            req.handed_off = True
+            self._approve_q.put_nowait(req)
+
+    # ====== Pista de DM ======
+    async def _dm_worker(self) -> None:
+        while True:
+            req = await self._dm_q.get()
+            tracing.attach(req.trace)
+            await self._dm_limiter.acquire()
+            sent = False
+            try:
+                await self.send_dm(self.bot, req)
+                sent = True
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                self._dm_q.put_nowait(req)
+                continue
+            except TimedOut:
+                await asyncio.sleep(1)
+                self._dm_q.put_nowait(req)
+                continue
+            except (Forbidden, BadRequest) as e:
+                # falha definitiva: aprova mesmo assim, sem DM
+                log.warning("DM de boas-vindas para %s falhou: %s", req.user_chat_id, e)
+            except Exception as e:
+                log.warning("Erro inesperado na DM de boas-vindas para %s: %s", req.user_chat_id, e)
+
+            now = time.time()
+            if sent:
+                self._dm_latencies.append(now - req.requested_at)
+            await asyncio.to_thread(db.set_join_dm_sent, req.group_id, req.user_id, now)
+            if req.approved_at is None:
+                self._hand_off(req)  # antes do dm_grace: aprova já
+            else:
+                self._inflight.discard((req.group_id, req.user_id))
+
+    # ====== Pista de aprovação ======
+    async def _approve_worker(self) -> None:
+        while True:
+            req = await self._approve_q.get()
+            tracing.attach(req.trace)
+            await self._approve_limiter.acquire()
+            try:
+                await self.bot.approve_chat_join_request(
+                    chat_id=req.group_id, user_id=req.user_id
+                )
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                self._approve_q.put_nowait(req)
+                continue
+            except TimedOut:
+                await asyncio.sleep(1)
+                self._approve_q.put_nowait(req)
+                continue
+            except Exception as e:
+                # ex.: HIDE_REQUESTER_MISSING (já aprovado/recusado por um admin)
+                log.warning("Erro ao aprovar join request de %s: %s", req.user_id, e)
+                self._inflight.discard((req.group_id, req.user_id))
+                await asyncio.to_thread(db.set_join_status, req.group_id, req.user_id, "failed")
+                continue
+
+            now = time.time()
+            req.approved_at = now
+            self._inflight.discard((req.group_id, req.user_id))
+            self._latencies.append(now - req.requested_at)
+            self.approved += 1
+            await asyncio.to_thread(
+                db.set_join_status, req.group_id, req.user_id, "approved", now
+            )
+
+            if self.approved % 100 == 0:
+                self.log_stats()
+
+    # ====== Métricas ======
+    def stats(self) -> dict:
+        return {
+            "approved": self.approved,
+            "approve_backlog": self._approve_q.qsize(),
+            "dm_backlog": self._dm_q.qsize(),
+            "approve": percentiles(self._latencies),
+            "dm": percentiles(self._dm_latencies),
+        }
+
+    def log_stats(self) -> None:
+        s = self.stats()
+        log.info(
+            "[JOIN] aprovados=%s fila_aprovacao=%s fila_dm=%s "
+            "aprovação p50=%.2fs p90=%.2fs p99=%.2fs | DM p50=%.2fs p90=%.2fs p99=%.2fs",
+            s["approved"], s["approve_backlog"], s["dm_backlog"],
+            s["approve"]["p50"], s["approve"]["p90"], s["approve"]["p99"],
+            s["dm"]["p50"], s["dm"]["p90"], s["dm"]["p99"],
+        )
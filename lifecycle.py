@@ -0,0 +1,123 @@
+"""
+Desligamento gracioso (SIGTERM do Railway durante deploy).
+
+Ao receber o sinal: para de buscar updates, dá aos funis em andamento o
+prazo menos a reserva de flush, cancela o que sobrou (o checkpoint de cada
+funil fica no banco e ele é retomado no próximo startup) e roda os flushes
+registrados (jobs agendados, buffers), na ordem de registro e cada um
+limitado ao que resta do prazo, antes de deixar a Application parar. O que
+importa para retomar vem primeiro; o que pode esperar o próximo processo
+(ex.: exportação) vem por último.
+"""
+import signal
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+log = logging.getLogger("presente-vip-unificado.lifecycle")
+
+
+class Lifecycle:
+    def __init__(self, deadline: float = 20.0, flush_reserve: float | None = None):
+        self.deadline = deadline
+        # parte do prazo guardada para os flushes (padrão: um quarto)
+        self.flush_reserve = deadline / 4 if flush_reserve is None else min(flush_reserve, deadline)
+        self.draining = False
+        self._stopping = False
+        self._tasks: set[asyncio.Task] = set()
+        self._by_name: dict[str, asyncio.Task] = {}
+        self._flushers: list[tuple[str, Callable[[], Awaitable[None]]]] = []
+        self._rejects: set[asyncio.Task] = set()
+
+    def spawn(self, coro, name: str | None = None, on_reject=None) -> asyncio.Task | None:
+        """
+        Roda um funil em background, acompanhado até o fim pelo drain().
+        Se o desligamento já começou, o funil não roda: `on_reject` (síncrono,
+        roda numa thread) grava o checkpoint inicial para ele ser retomado no
+        próximo startup.
+        """
+        if self.draining:
+            coro.close()
+            if on_reject:
+                task = asyncio.create_task(asyncio.to_thread(on_reject))
+                self._rejects.add(task)
+                task.add_done_callback(self._rejects.discard)
+            return None
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        if name:
+            self._by_name[name] = task
+        task.add_done_callback(self._done)
+        return task
+
+    def is_running(self, name: str) -> bool:
+        task = self._by_name.get(name)
+        return task is not None and not task.done()
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if self._by_name.get(task.get_name()) is task:
+            del self._by_name[task.get_name()]
+        if not task.cancelled() and task.exception():
+            log.error("Funil %s falhou", task.get_name(), exc_info=task.exception())
+
+    def on_drain(self, fn: Callable[[], Awaitable[None]], name: str | None = None) -> None:
+        """Registra um flush do desligamento; rodam na ordem de registro."""
+        self._flushers.append((name or getattr(fn, "__qualname__", "flush"), fn))
+
+    def install(self, app) -> None:
+        """Assume SIGTERM/SIGINT no lugar do run_polling (use stop_signals=None)."""
+        loop = asyncio.get_running_loop()
+
+        async def shutdown():
+            await self.drain(app)
+            app.stop_running()
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, lambda: asyncio.ensure_future(shutdown()))
+
+    async def drain(self, app) -> None:
+        if self.draining or self._stopping:
+            return
+        self._stopping = True
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + self.deadline
+        funnels_until = deadline_at - self.flush_reserve
+        log.info("🛑 Desligando: prazo %.0fs (%.0fs reservados para flush)", self.deadline, self.flush_reserve)
+
+        if app.updater and app.updater.running:
+            await app.updater.stop()
+            # updates já buscados no Telegram ainda são processados (e podem abrir funis)
+            try:
+                await asyncio.wait_for(app.update_queue.join(), max(0.0, funnels_until - loop.time()))
+            except asyncio.TimeoutError:
+                log.warning("Fila de updates não esvaziou no prazo")
+        self.draining = True
+
+        if self._tasks:
+            log.info("Aguardando %s funis em andamento", len(self._tasks))
+            _, pending = await asyncio.wait(
+                set(self._tasks), timeout=max(0.0, funnels_until - loop.time())
+            )
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if pending:
+                log.warning("%s funis interrompidos; serão retomados no próximo startup", len(pending))
+
+        if self._rejects:
+            await asyncio.wait(set(self._rejects), timeout=max(0.0, deadline_at - loop.time()))
+
+        for i, (name, fn) in enumerate(self._flushers):
+            left = deadline_at - loop.time()
+            if left <= 0:
+                skipped = [n for n, _ in self._flushers[i:]]
+                log.warning("Prazo esgotado; flushes não executados: %s", ", ".join(skipped))
+                break
+            try:
+                await asyncio.wait_for(fn(), left)
+            except asyncio.TimeoutError:
+                log.warning("Flush %s interrompido no fim do prazo", name)
+            except Exception as e:
+                log.warning("Flush %s no desligamento falhou: %s", name, e)
+        log.info("Drain concluído")
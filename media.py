@@ -0,0 +1,112 @@
+"""
+Registro de mídias do funil: file_id por slot (audio, video1, img1, ...), com versão.
+
+Os envios só consultam a memória. Toda mudança — /setmedia de um admin,
+file_id aprendido num upload, file_id inválido descartado — vale na hora em
+memória e entra numa fila que o flush() grava no SQLite (media_versions) em
+um único lote, pelo job a cada MEDIA_SYNC_INTERVAL e no desligamento. Cada
+gravação vira uma versão nova do slot, então dá para voltar à anterior.
+Os outros processos do cluster.py veem a mudança pelo sync(), que compara o
+último `seq` gravado antes de recarregar.
+"""
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+
+import db
+
+log = logging.getLogger("presente-vip-unificado.media")
+
+MEDIA_SYNC_INTERVAL = 1.0  # segundos entre flush + sync
+
+# slots que os admins atribuem com /setmedia -> tipo de mídia aceito
+ADMIN_SLOTS = {
+    "audio": "audio",
+    "audio_vip": "audio",
+    "video1": "video",
+    "video2": "video",
+    "video3": "video",
+}
+
+
+@dataclass(frozen=True)
+class MediaEntry:
+    file_id: str | None
+    version: int
+
+
+class MediaRegistry:
+    def __init__(self):
+        self._slots: dict[str, MediaEntry] = {}
+        self._pending: list[tuple[str, str | None, int | None, float]] = []
+        self._flushing: list[tuple[str, str | None, int | None, float]] = []
+        self._seq = 0
+        self._lock = asyncio.Lock()  # um flush por vez: a ordem das versões é a ordem das mudanças
+
+    # ====== Leitura (só memória) ======
+    def get(self, slot: str) -> str | None:
+        entry = self._slots.get(slot)
+        return entry.file_id if entry else None
+
+    def version(self, slot: str) -> int:
+        entry = self._slots.get(slot)
+        return entry.version if entry else 0
+
+    # ====== Escrita (memória agora, banco no próximo flush) ======
+    def set(self, slot: str, file_id: str | None, by: int | None = None) -> int:
+        if slot in self._slots and self._slots[slot].file_id == file_id:
+            return self._slots[slot].version  # nada mudou: sem versão nova
+        version = self.version(slot) + 1
+        self._slots[slot] = MediaEntry(file_id, version)
+        self._pending.append((slot, file_id, by, time.time()))
+        return version
+
+    def discard(self, slot: str) -> None:
+        """file_id recusado pelo Telegram: limpa o slot para o próximo envio não insistir."""
+        if self.get(slot):
+            self.set(slot, None)
+
+    async def job(self, context) -> None:
+        """Callback para job_queue.run_repeating."""
+        await self.flush()
+        await self.sync()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            self._flushing = batch
+            try:
+                await asyncio.to_thread(db.save_media_versions, batch)
+            except Exception:
+                self._pending[:0] = batch  # tenta de novo no próximo ciclo, na mesma ordem
+                log.exception("Falha ao gravar %s mudanças de mídia", len(batch))
+            finally:
+                self._flushing = []
+
+    # ====== Banco -> memória ======
+    def load(self) -> None:
+        """Carga inicial (startup, síncrona)."""
+        self._apply(db.current_media(), db.media_seq())
+
+    async def sync(self) -> None:
+        seq = await asyncio.to_thread(db.media_seq)
+        if seq <= self._seq:
+            return
+        rows = await asyncio.to_thread(db.current_media)
+        self._apply(rows, seq)
+
+    def _apply(self, rows, seq: int) -> None:
+        # mudanças locais ainda não gravadas ganham do que está no banco
+        local = {slot for slot, *_ in (*self._pending, *self._flushing)}
+        for row in rows:
+            if row["slot"] not in local:
+                self._slots[row["slot"]] = MediaEntry(row["file_id"], row["version"])
+        self._seq = seq
+
+    async def history(self, slot: str, limit: int = 10):
+        await self.flush()
+        return await asyncio.to_thread(db.media_history, slot, limit)
+
@@ -0,0 +1,286 @@
+"""
+Replay do tráfego gravado com RECORD_UPDATES (traffic.py), para comparar
+mudanças de desempenho contra cargas reais (rajada de join requests na
+abertura do grupo, enxurrada de prints depois de uma live).
+
+Sobe o fake_telegram.py no mesmo processo (Bot API, OpenAI e Google Forms
+falsos), aponta o bot para ele e entrega os updates aos mesmos handlers do
+app.py (register_handlers) com o espaçamento original (--speed 1),
+acelerado (--speed 10) ou sem espera (--speed max). Por tipo de update mede:
+
+  handler   da chegada até o fim do process_update (inclui espera na fila)
+  resposta  da chegada até a primeira chamada da Bot API para aquele chat
+            (answerCallbackQuery nos cliques, approve/DM nos join requests)
+
+e a vazão de updates e de envios. --out salva o relatório em JSON e
+--baseline compara com um relatório salvo antes.
+
+    python replay.py trafego.ndjson.gz --speed 10
+    python replay.py trafego.ndjson.gz --speed max --out depois.json --baseline antes.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import logging
+from collections import defaultdict, deque
+
+from aiohttp import web
+from telegram import Update
+
+from fake_telegram import FakeTelegram
+from traffic import read_records
+from utils import percentiles
+
+log = logging.getLogger("presente-vip-unificado.replay")
+
+POINTS = (50, 95, 99)
+
+
+def update_kind(data: dict) -> str:
+    if "callback_query" in data:
+        return "callback_query"
+    if "chat_join_request" in data:
+        return "chat_join_request"
+    msg = data.get("message")
+    if msg:
+        if "photo" in msg or "document" in msg:
+            return "print"
+        if (msg.get("text") or "").startswith("/"):
+            return "command"
+        return "message"
+    return next((k for k in data if k != "update_id"), "other")
+
+
+def reply_key(data: dict):
+    """Chave da primeira chamada da Bot API que responde a este update."""
+    if "callback_query" in data:
+        return ("cb", str(data["callback_query"]["id"]))
+    if "chat_join_request" in data:
+        req = data["chat_join_request"]
+        return ("chat", req.get("user_chat_id") or req["from"]["id"])
+    msg = data.get("message")
+    if msg:
+        return ("chat", msg["chat"]["id"])
+    return None
+
+
+def call_key(method: str, params: dict):
+    if method == "answerCallbackQuery":
+        return ("cb", str(params.get("callback_query_id")))
+    if method == "approveChatJoinRequest":
+        return ("chat", int(params["user_id"]))
+    if (method.startswith("send") or method == "copyMessage") and params.get("chat_id") is not None:
+        return ("chat", int(params["chat_id"]))
+    return None
+
+
+def summarize(values: list[float]) -> dict:
+    out = {k: v * 1000 for k, v in percentiles(values, POINTS).items()}
+    out["max"] = max(values, default=0) * 1000
+    out["n"] = len(values)
+    return out
+
+
+class Replayer:
+    def __init__(self, app, speed: float | None):
+        self.app = app
+        self.speed = speed  # None = sem espera
+        self.counts: dict[str, int] = defaultdict(int)
+        self.handler: dict[str, list[float]] = defaultdict(list)
+        self.reply: dict[str, list[float]] = defaultdict(list)
+        self._pending: dict[tuple, deque] = defaultdict(deque)
+        self._tasks: set[asyncio.Task] = set()
+        self.fed_in = 0.0
+        self.processed_in = 0.0
+
+    def on_call(self, method: str, params: dict) -> None:
+        key = call_key(method, params)
+        queue = self._pending.get(key) if key else None
+        if not queue:
+            return
+        now = time.monotonic()
+        while queue:
+            arrived, kind = queue.popleft()
+            self.reply[kind].append(now - arrived)
+
+    async def _process(self, update: Update, kind: str, arrived: float) -> None:
+        # mesmo caminho do polling: respeita o concurrent_updates da Application
+        await self.app.update_processor.process_update(update, self.app.process_update(update))
+        self.handler[kind].append(time.monotonic() - arrived)
+
+    async def feed(self, records) -> None:
+        t0 = time.monotonic()
+        first = None
+        for t, data in records:
+            if self.speed:
+                first = t if first is None else first
+                delay = t0 + (t - first) / self.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif len(self._tasks) % 100 == 0:
+                await asyncio.sleep(0)  # deixa o loop respirar no --speed max
+
+            kind = update_kind(data)
+            arrived = time.monotonic()
+            key = reply_key(data)
+            if key:
+                self._pending[key].append((arrived, kind))
+            self.counts[kind] += 1
+            task = asyncio.create_task(self._process(Update.de_json(data, self.app.bot), kind, arrived))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        self.fed_in = time.monotonic() - t0
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.processed_in = time.monotonic() - t0
+
+    def report(self, fake: FakeTelegram) -> dict:
+        total = sum(self.counts.values())
+        return {
+            "speed": self.speed or "max",
+            "updates": total,
+            "fed_s": round(self.fed_in, 3),
+            "processed_s": round(self.processed_in, 3),
+            "updates_per_s": round(total / self.processed_in, 1) if self.processed_in else 0,
+            "kinds": {
+                kind: {
+                    "count": n,
+                    "handler_ms": summarize(self.handler[kind]),
+                    "reply_ms": summarize(self.reply[kind]),
+                }
+                for kind, n in sorted(self.counts.items())
+            },
+            "fake": fake.stats(),
+        }
+
+
+def print_report(report: dict, baseline: dict | None = None) -> None:
+    fake = report["fake"]
+    print(
+        f"{report['updates']} updates em {report['processed_s']:.1f}s (speed {report['speed']}): "
+        f"{report['updates_per_s']} updates/s, {fake['sends']} envios ({fake['sends_per_s']}/s), "
+        f"{fake['forms']} linhas no Forms, {fake['openai']} chamadas OpenAI"
+    )
+    print(
+        f"{'tipo':<18} {'n':>6} {'handler p50':>12} {'p99':>8} {'resposta p50':>13} {'p95':>8} "
+        f"{'p99':>8} {'max':>8} {'sem resp.':>9}"
+    )
+    for kind, k in report["kinds"].items():
+        h, r = k["handler_ms"], k["reply_ms"]
+        print(
+            f"{kind:<18} {k['count']:>6} {h['p50']:>12.0f} {h['p99']:>8.0f} {r['p50']:>13.0f} {r['p95']:>8.0f} "
+            f"{r['p99']:>8.0f} {r['max']:>8.0f} {k['count'] - r['n']:>9}"
+        )
+
+    if not baseline:
+        return
+    print(f"\nvs baseline ({baseline['updates_per_s']} updates/s):")
+    for kind, k in report["kinds"].items():
+        old = baseline["kinds"].get(kind)
+        if not old:
+            continue
+        deltas = []
+        for p in ("p50", "p99"):
+            before, after = old["reply_ms"][p], k["reply_ms"][p]
+            change = f"{100 * (after - before) / before:+.0f}%" if before else "-"
+            deltas.append(f"resposta {p} {before:.0f} -> {after:.0f} ms ({change})")
+        print(f"  {kind:<18} " + "; ".join(deltas))
+
+
+async def _wait_idle(fake: FakeTelegram, idle: float, deadline: float) -> None:
+    """Espera os funis abertos pelo replay pararem de chamar a Bot API."""
+    end = time.monotonic() + deadline
+    while time.monotonic() < end:
+        last = fake.last_call_at or 0
+        if time.monotonic() - last >= idle:
+            return
+        await asyncio.sleep(0.2)
+
+
+async def _main(args) -> dict:
+    fake = FakeTelegram(latency_ms=args.latency_ms, openai_latency_ms=args.openai_latency_ms)
+    runner = web.AppRunner(fake.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    port = runner.addresses[0][1]
+    url = f"http://127.0.0.1:{port}"
+
+    # tudo aponta para o fake: nada do replay sai para Telegram, OpenAI ou Forms de verdade
+    os.environ.update(
+        TELEGRAM_API_URL=url,
+        GOOGLE_FORM_URL=f"{url}/formResponse",
+        OPENAI_BASE_URL=f"{url}/v1",
+        OPENAI_API_KEY="replay",
+        RECORD_UPDATES="",
+    )
+    os.environ.setdefault("TELEGRAM_TOKEN", "1:replay")
+    os.environ.setdefault("BOT_USERNAME", "replay_bot")
+
+    import db
+    from app import build_application, register_handlers, setup
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    db.DB_PATH = args.db
+    settings = setup()
+    app = build_application(settings, with_updater=False)
+    register_handlers(app)
+
+    replayer = Replayer(app, None if args.speed == "max" else float(args.speed))
+    fake.on_call = replayer.on_call
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        await replayer.feed(read_records(args.file))
+        await _wait_idle(fake, args.idle, args.drain)
+    finally:
+        await app.bot_data["lifecycle"].drain(app)
+        await app.stop()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+        await app.shutdown()
+        report = replayer.report(fake)
+        await runner.cleanup()
+    return report
+
+
+def main():
+    # avisos do bot (ex.: file_id de vídeo ausente) se repetem a cada update; só erros aparecem
+    logging.basicConfig(format="%(asctime)s [%(levelname)s] %(name)s: %(message)s", level=logging.ERROR)
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("file", help=".ndjson.gz gravado com RECORD_UPDATES")
+    ap.add_argument("--speed", default="1", help="1, 10, ... ou max")
+    ap.add_argument("--latency-ms", type=float, default=20, help="latência simulada da Bot API")
+    ap.add_argument("--openai-latency-ms", type=float, default=2000, help="latência simulada da validação do print")
+    ap.add_argument("--idle", type=float, default=2.0, help="fim do replay: segundos sem chamadas na Bot API")
+    ap.add_argument("--drain", type=float, default=30.0, help="espera máxima pelos funis depois do último update")
+    ap.add_argument("--port", type=int, default=0, help="porta do fake (0 = livre)")
+    ap.add_argument("--db", default="replay.sqlite", help="banco descartável do replay (apagado no início)")
+    ap.add_argument("--out", help="salva o relatório em JSON")
+    ap.add_argument("--baseline", help="relatório JSON anterior para comparar")
+    args = ap.parse_args()
+
+    if args.speed != "max" and float(args.speed) <= 0:
+        sys.exit("--speed precisa ser > 0 ou max")
+
+    report = asyncio.run(_main(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Configuração recarregável sem restart: links, file_ids de mídia e valor mínimo
+do depósito.
+
+Os valores vêm das variáveis de ambiente (padrão) com o CONFIG_FILE (JSON) por
+cima. O arquivo é vigiado por mtime; quando muda, um snapshot novo e imutável
+é montado — teclados e textos que dependem da config já prontos — e trocado
+numa única atribuição. Quem está no meio de um envio continua com o snapshot
+que pegou em current(); um arquivo inválido é ignorado e o snapshot atual fica.
+
+Exemplo de CONFIG_FILE:
+    {
+      "link_cadastro": "https://...",
+      "whatsapp_vip_link": "https://chat.whatsapp.com/...",
+      "min_deposit_value": 50,
+      "media": {"video2": "BAACAgEAAxkBAAI..."}
+    }
+"""
+import os
+import json
+import time
+import logging
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+log = logging.getLogger("presente-vip-unificado.config")
+
+# callbacks dos botões (os handlers em app.py usam os mesmos valores)
+CB_CONFIRM_SIM = "confirm_sim"
+CB_ACESSAR_VIP = "vip_go"
+CB_VIP_GARANTIR = "vip_garantir"
+CB_VIP_EXPLICAR = "vip_explicar"
+CB_VIP_PRINT = "vip_print"
+CB_VIP_DEPOSITAR = "vip_depositar"
+
+DEFAULT_CRIAR_CONTA = "🟢 Criar conta agora"
+
+LINKS = {
+    "link_cadastro": "https://click.betboom.com/BdnxJncs?landing=2833&sub_id1=Telegram",
+    "link_comunidade_final": "https://wa.me/5511959589591?text=Oi%2C%20tudo%20bem%3F%20Quero%20meu%20presente%20do%20Jota",
+    "whatsapp_vip_link": "https://chat.whatsapp.com/ENHzDrexZW57aF3xJ6jyv",
+    "img1_url": "https://i.postimg.cc/wxkkz20M/presente-do-jota.jpg",
+    "img2_url": "https://i.postimg.cc/8kbbG4tT/presente-do-jota-2.png",
+}
+
+# chave de mídia -> variáveis de ambiente aceitas (a primeira preenchida vale)
+MEDIA_ENV = {
+    "audio": ("FILE_ID_AUDIO",),
+    "audio_vip": ("FILE_ID_AUDIO_VIP",),
+    "video1": ("FILE_ID_VIDEO1", "FILE_ID_VIDEO01"),
+    "video2": ("FILE_ID_VIDEO2", "FILE_ID_VIDEO02"),
+    "video3": ("FILE_ID_VIDEO3", "FILE_ID_VIDEO03"),
+}
+
+
+@dataclass(frozen=True)
+class RuntimeConfig:
+    version: int
+    link_cadastro: str
+    link_comunidade_final: str
+    whatsapp_vip_link: str
+    img1_url: str
+    img2_url: str
+    min_deposit_value: float
+    media: Mapping[str, str]
+    # montados no swap, não a cada envio
+    ask_print_text: str = ""
+    kb_comunidade_e_vip: InlineKeyboardMarkup | None = None
+    kb_vip_primeira_escolha: InlineKeyboardMarkup | None = None
+    kb_vip_print_deposito: InlineKeyboardMarkup | None = None
+    kb_whatsapp_vip: InlineKeyboardMarkup | None = None
+    kb_liberar_presente: InlineKeyboardMarkup | None = None
+    _kb_criar_conta: Mapping[str, InlineKeyboardMarkup] = field(default_factory=dict, repr=False)
+
+    def kb_criar_conta(self, text: str = DEFAULT_CRIAR_CONTA) -> InlineKeyboardMarkup:
+        kb = self._kb_criar_conta.get(text)
+        if kb is None:  # texto fora dos pré-montados (ex.: variante nova)
+            kb = InlineKeyboardMarkup([[InlineKeyboardButton(text, url=self.link_cadastro)]])
+        return kb
+
+
+def build(values: dict, version: int, bot_username: str, button_texts=()) -> RuntimeConfig:
+    min_value = float(values["min_deposit_value"])
+    criar_conta = {
+        text: InlineKeyboardMarkup([[InlineKeyboardButton(text, url=values["link_cadastro"])]])
+        for text in {DEFAULT_CRIAR_CONTA, *button_texts}
+    }
+
+    return RuntimeConfig(
+        version=version,
+        link_cadastro=values["link_cadastro"],
+        link_comunidade_final=values["link_comunidade_final"],
+        whatsapp_vip_link=values["whatsapp_vip_link"],
+        img1_url=values["img1_url"],
+        img2_url=values["img2_url"],
+        min_deposit_value=min_value,
+        media=MappingProxyType({k: v for k, v in values["media"].items() if v}),
+        ask_print_text=(
+            "Todas essas pessoas fizeram parte e ganharam um prêmio muito bom, "
+            "escolheram jogar comigo em um grupo com mais acesso!\n\n"
+            "Vou estar aguardando um print da sua conta Betboom (Mostrando detalhes do Depósito) "
+            f"com pelo menos R${min_value:.0f} depositados hoje e já libero seu acesso à roleta, ok?"
+        ),
+        kb_comunidade_e_vip=InlineKeyboardMarkup(
+            [
+                [InlineKeyboardButton("🚀 Receber Benefícios", url=values["link_comunidade_final"])],
+                [InlineKeyboardButton("🟣 Acessar VIP", callback_data=CB_ACESSAR_VIP)],
+            ]
+        ),
+        kb_vip_primeira_escolha=InlineKeyboardMarkup(
+            [
+                [InlineKeyboardButton("✅ Quero Garantir", callback_data=CB_VIP_GARANTIR)],
+                [InlineKeyboardButton("ℹ️ Me explica antes", callback_data=CB_VIP_EXPLICAR)],
+            ]
+        ),
+        kb_vip_print_deposito=InlineKeyboardMarkup(
+            [
+                [InlineKeyboardButton("🖼️ PRINT = LIBERAR VIP", callback_data=CB_VIP_PRINT)],
+                [InlineKeyboardButton("💳 FAZER DEPÓSITO", callback_data=CB_VIP_DEPOSITAR)],
+            ]
+        ),
+        kb_whatsapp_vip=InlineKeyboardMarkup(
+            [[InlineKeyboardButton("🎉 Entrar na Comunidade VIP", url=values["whatsapp_vip_link"])]]
+        ),
+        # botão que dispara o /start via deep-link (o Telegram envia "/start presente")
+        kb_liberar_presente=InlineKeyboardMarkup(
+            [[InlineKeyboardButton("🎁 Liberar presente", url=f"https://t.me/{bot_username}?start=presente")]]
+        ),
+        _kb_criar_conta=MappingProxyType(criar_conta),
+    )
+
+
+def env_values(min_deposit_value: float) -> dict:
+    values = {key: os.getenv(key.upper(), default) for key, default in LINKS.items()}
+    values["min_deposit_value"] = min_deposit_value
+    values["media"] = {
+        key: next((os.getenv(name) for name in names if os.getenv(name)), "")
+        for key, names in MEDIA_ENV.items()
+    }
+    return values
+
+
+class ConfigWatcher:
+    def __init__(self, path: str, base: dict, bot_username: str, button_texts=()):
+        self.path = path
+        self.base = base  # valores do ambiente
+        self.bot_username = bot_username
+        self.button_texts = tuple(button_texts)
+        self._mtime: float | None = None
+
+    def load(self) -> RuntimeConfig:
+        """Monta e publica o snapshot inicial (arquivo inválido no startup é erro)."""
+        values = self._read() if self.path and os.path.exists(self.path) else self.base
+        return _swap(build(values, 1, self.bot_username, self.button_texts))
+
+    def _read(self) -> dict:
+        self._mtime = os.stat(self.path).st_mtime
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        unknown = set(data) - set(self.base)
+        if unknown:
+            raise ValueError(f"chaves desconhecidas em {self.path}: {sorted(unknown)}")
+        unknown_media = set(data.get("media") or {}) - set(MEDIA_ENV)
+        if unknown_media:
+            raise ValueError(f"mídias desconhecidas em {self.path}: {sorted(unknown_media)}")
+        return {**self.base, **data, "media": {**self.base["media"], **(data.get("media") or {})}}
+
+    def check(self) -> bool:
+        """Recarrega se o arquivo mudou. Devolve True quando trocou o snapshot."""
+        if not self.path:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+
+        t = time.perf_counter()
+        try:
+            values = self._read()
+            new = build(values, current().version + 1, self.bot_username, self.button_texts)
+        except Exception as e:
+            log.error("❌ %s inválido, mantendo a config v%s: %s", self.path, current().version, e)
+            return False
+        _swap(new)
+        log.info("🔄 Config v%s carregada de %s em %.1f ms", new.version, self.path, (time.perf_counter() - t) * 1000)
+        return True
+
+
+_current: RuntimeConfig | None = None
+_watcher: ConfigWatcher | None = None
+
+
+def _swap(cfg: RuntimeConfig) -> RuntimeConfig:
+    global _current
+    _current = cfg  # troca atômica: uma atribuição de referência
+    return cfg
+
+
+def current() -> RuntimeConfig:
+    """Snapshot vigente. Pegue uma vez por envio e use o mesmo objeto até o fim."""
+    return _current
+
+
+def init(path: str, base: dict, bot_username: str, button_texts=()) -> RuntimeConfig:
+    global _watcher
+    _watcher = ConfigWatcher(path, base, bot_username, button_texts)
+    return _watcher.load()
+
+
+async def watch_job(context) -> None:
+    """Callback para job_queue.run_repeating: recarrega se o CONFIG_FILE mudou."""
+    if _watcher:
+        _watcher.check()
@@ -0,0 +1,58 @@
+"""
+Conjunto de chat_ids persistido no SQLite (ex.: VIP_PENDING_PRINT).
+
+As consultas (`in`, add, discard) só mexem na memória, sem tocar no banco
+dentro do event loop. A memória guarda as chaves da partição deste processo:
+no cluster.py cada chat é processado sempre pelo mesmo worker, então o que
+está em memória é a verdade para os chats dele. As mudanças vão numa fila
+que o flush() grava em lote (numa thread), pelo job a cada
+SHARED_SET_FLUSH_INTERVAL e no desligamento; um restart recarrega do banco.
+"""
+import asyncio
+import logging
+
+import db
+
+log = logging.getLogger("presente-vip-unificado.shared")
+
+SHARED_SET_FLUSH_INTERVAL = 1.0  # segundos entre gravações
+
+
+class SharedSet:
+    def __init__(self, table: str):
+        self.table = table
+        self._keys: set[int] = set()
+        self._pending: dict[int, bool] = {}  # chave -> presente? (a última mudança vence)
+        self._lock = asyncio.Lock()
+
+    def load(self, partition: int = 0, partitions: int = 1) -> None:
+        """Carga inicial (startup, síncrona)."""
+        self._keys = set(db.shared_keys(self.table, partition, partitions))
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._keys
+
+    def add(self, key: int) -> None:
+        self._keys.add(key)
+        self._pending[key] = True
+
+    def discard(self, key: int) -> None:
+        self._keys.discard(key)
+        self._pending[key] = False
+
+    async def job(self, context) -> None:
+        """Callback para job_queue.run_repeating."""
+        await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(db.save_shared_keys, self.table, list(batch.items()))
+            except Exception:
+                # tenta de novo no próximo ciclo; mudança mais nova da mesma chave ganha
+                for key, present in batch.items():
+                    self._pending.setdefault(key, present)
+                log.exception("Falha ao gravar %s mudanças em %s", len(batch), self.table)
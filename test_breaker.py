@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import breaker
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(breaker.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_opens_after_consecutive_failures(clock):
+    cb = CircuitBreaker("dep", failures=3, reset_after=10)
+    cb.failure()
+    cb.failure()
+    cb.success()  # sucesso zera a contagem
+    cb.failure()
+    cb.failure()
+    assert cb.state == CLOSED
+    cb.failure()
+    assert cb.state == OPEN
+    assert not cb.allow()
+    assert not cb.ready()
+
+
+def test_half_open_lets_a_single_probe_through(clock):
+    cb = CircuitBreaker("dep", failures=1, reset_after=10)
+    cb.failure()
+    clock[0] += 10
+
+    assert cb.ready()
+    assert cb.state == OPEN  # ready() não consome a chamada de teste
+    assert cb.allow()
+    assert cb.state == HALF_OPEN
+    assert not cb.allow()
+    assert not cb.ready()
+
+    cb.success()
+    assert cb.state == CLOSED
+    assert cb.allow()
+
+
+def test_failed_probe_reopens(clock):
+    cb = CircuitBreaker("dep", failures=5, reset_after=10)
+    for _ in range(5):
+        cb.failure()
+    clock[0] += 10
+    assert cb.allow()
+
+    cb.failure()
+    assert cb.state == OPEN
+    clock[0] += 9
+    assert not cb.allow()
+
+
+def test_call_only_counts_dependency_failures(clock):
+    cb = CircuitBreaker("dep", failures=1, is_failure=lambda e: not isinstance(e, ValueError))
+
+    async def fail(exc):
+        raise exc
+
+    async def run():
+        with pytest.raises(ValueError):
+            await cb.call(lambda: fail(ValueError("pedido ruim")))
+        assert cb.state == CLOSED
+
+        with pytest.raises(ConnectionError):
+            await cb.call(lambda: fail(ConnectionError()))
+        assert cb.state == OPEN
+
+        with pytest.raises(CircuitOpen):
+            await cb.call(lambda: fail(AssertionError("não deveria ser chamado")))
+
+    asyncio.run(run())
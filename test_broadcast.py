@@ -0,0 +1,84 @@
+import time
+import asyncio
+from collections import Counter
+
+from telegram.error import Forbidden
+
+import db
+import broadcast
+from broadcast import Broadcaster
+
+
+class FakeBot:
+    """Entrega fora de ordem (ids pares demoram mais) e registra quem recebeu."""
+
+    def __init__(self, blocked=()):
+        self.delivered: Counter[int] = Counter()
+        self.blocked = set(blocked)
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(0.004 if chat_id % 2 == 0 else 0.001)
+        if chat_id in self.blocked:
+            raise Forbidden("bot was blocked by the user")
+        self.delivered[chat_id] += 1
+
+
+def setup_users(tmp_path, monkeypatch, n):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "bot.sqlite"))
+    monkeypatch.setattr(broadcast, "SAVE_EVERY", 0.0)  # checkpoint a cada envio
+    db.init_db()
+    for i in range(1, n + 1):
+        db.upsert_user(1000 + i, f"u{i}", f"User {i}")
+    return db.create_broadcast("oi", None, None, created_by=1, created_at=time.time())
+
+
+def test_checkpoint_never_passes_an_undelivered_user(tmp_path, monkeypatch):
+    bid = setup_users(tmp_path, monkeypatch, 60)
+    bot = FakeBot(blocked={1007})
+    checkpoints = []
+    save = db.save_broadcast_progress
+
+    def checking_save(broadcast_id, last_user_id, sent, failed, pruned, *args):
+        # tudo até last_user_id já foi tratado, e os contadores batem com esse prefixo
+        handled = [1000 + i for i in range(1, last_user_id + 1)]
+        assert all(bot.delivered[t] or t in bot.blocked for t in handled)
+        assert sent + failed + pruned == last_user_id
+        checkpoints.append(last_user_id)
+        save(broadcast_id, last_user_id, sent, failed, pruned, *args)
+
+    monkeypatch.setattr(db, "save_broadcast_progress", checking_save)
+
+    async def run():
+        b = Broadcaster(bot, rate=1000, page_size=25, workers=8)
+        await b._run(db.get_broadcast(bid))
+
+    asyncio.run(run())
+
+    row = db.get_broadcast(bid)
+    assert row["status"] == "done"
+    assert (row["last_user_id"], row["sent"], row["pruned"]) == (60, 59, 1)
+    assert checkpoints == sorted(checkpoints)
+    assert db.broadcast_recipients(0, 100)[6]["telegram_id"] == 1008  # o bloqueado saiu da base
+
+
+def test_resume_after_interruption_reaches_everyone(tmp_path, monkeypatch):
+    bid = setup_users(tmp_path, monkeypatch, 80)
+    bot = FakeBot()
+    workers = 4
+
+    async def run():
+        b = Broadcaster(bot, rate=1000, page_size=30, workers=workers)
+        task = asyncio.create_task(b._run(db.get_broadcast(bid)))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert 0 < db.get_broadcast(bid)["last_user_id"] < 80
+
+        await Broadcaster(bot, rate=1000, page_size=30, workers=workers)._run(db.get_broadcast(bid))
+
+    asyncio.run(run())
+
+    assert set(bot.delivered) == {1000 + i for i in range(1, 81)}
+    # reenvio só do que estava em voo no corte
+    assert sum(n - 1 for n in bot.delivered.values()) <= workers
+    assert db.get_broadcast(bid)["status"] == "done"
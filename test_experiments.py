@@ -0,0 +1,29 @@
+from collections import Counter
+
+import pytest
+
+from experiments import Experiment, Variant
+
+
+def test_assign_follows_the_weights():
+    exp = Experiment("espera", (Variant("controle", 3), Variant("rapido", 1)))
+    counts = Counter(exp.assign(chat_id).name for chat_id in range(20_000))
+
+    assert abs(counts["controle"] / 20_000 - 0.75) < 0.02
+    assert abs(counts["rapido"] / 20_000 - 0.25) < 0.02
+
+
+def test_assign_is_stable_per_chat_and_experiment():
+    a = Experiment("espera", (Variant("controle"), Variant("rapido")))
+    same = Experiment("espera", (Variant("controle"), Variant("rapido")))
+    other = Experiment("copy", (Variant("controle"), Variant("rapido")))
+
+    assert all(a.assign(c) == same.assign(c) for c in range(1000))
+    # o nome do experimento entra no hash: outro teste sorteia de novo
+    assert any(a.assign(c).name != other.assign(c).name for c in range(1000))
+
+
+@pytest.mark.parametrize("weights", [(0, 0), (1, 0), (2, -1)])
+def test_non_positive_weights_are_rejected(weights):
+    with pytest.raises(ValueError):
+        Experiment("x", tuple(Variant(f"v{i}", w) for i, w in enumerate(weights)))
@@ -0,0 +1,69 @@
+import json
+import asyncio
+from urllib.parse import parse_qs
+
+import httpx
+
+import db
+from exporter import FIELD_EXTRA, EventExporter
+
+
+def test_forms_4xx_does_not_stall_high_water_mark(tmp_path, monkeypatch):
+    # um evento recusado com 400 não pode prender o high-water mark (e os eventos depois dele)
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "events.sqlite"))
+    db.init_db()
+    for i in range(30):
+        db.log_event(i, "start")
+
+    posted = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        extra = json.loads(parse_qs(request.content.decode())[FIELD_EXTRA][0])
+        if extra["event_id"] == 3:
+            return httpx.Response(400, text="bad request")
+        posted.append(extra["event_id"])
+        return httpx.Response(200, text="ok")
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            exporter = EventExporter(form_url="http://forms.test/formResponse", batch_size=10, client=client, rate=1000)
+            for _ in range(5):
+                await exporter.run_once()
+
+    asyncio.run(run())
+
+    assert db.get_export_state("forms") == (30, set())
+    assert sorted(posted) == [i for i in range(1, 31) if i != 3]
+
+
+def test_interrupted_batch_is_not_resent(tmp_path, monkeypatch):
+    # lote cortado no meio (drain): o que já foi entregue fica gravado e não sai de novo
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "events.sqlite"))
+    db.init_db()
+    for i in range(30):
+        db.log_event(i, "start")
+
+    posted = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.01)
+        extra = json.loads(parse_qs(request.content.decode())[FIELD_EXTRA][0])
+        posted.append(extra["event_id"])
+        return httpx.Response(200, text="ok")
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            exporter = EventExporter(
+                form_url="http://forms.test/formResponse", batch_size=30, parallelism=1, client=client, rate=1000
+            )
+            try:
+                await asyncio.wait_for(exporter.run_once(), 0.1)
+            except asyncio.TimeoutError:
+                pass
+            assert 0 < db.get_export_state("forms")[0] < 30
+            await exporter.run_once()
+
+    asyncio.run(run())
+
+    assert db.get_export_state("forms") == (30, set())
+    assert sorted(posted) == list(range(1, 31))
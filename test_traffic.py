@@ -0,0 +1,42 @@
+from traffic import Anonymizer
+
+
+def update(user_id: int, text: str) -> dict:
+    return {
+        "update_id": 1,
+        "message": {
+            "message_id": 10,
+            "from": {"id": user_id, "first_name": "Maria", "username": "maria"},
+            "chat": {"id": user_id, "type": "private", "first_name": "Maria"},
+            "text": text,
+            "contact": {"phone_number": "+5511999999999"},
+        },
+    }
+
+
+def test_same_salt_maps_the_same_user_to_the_same_id():
+    a, b = Anonymizer(b"sal"), Anonymizer(b"sal")
+
+    first = a.scrub(update(123456789, "oi"))
+    again = b.scrub(update(123456789, "outro texto"))
+
+    user = first["message"]["from"]["id"]
+    assert user != 123456789
+    assert again["message"]["from"]["id"] == user
+    assert first["message"]["chat"]["id"] == user  # chat privado continua batendo com o usuário
+    assert first["message"]["from"]["first_name"] == again["message"]["from"]["first_name"] != "Maria"
+
+
+def test_other_salt_gives_other_ids():
+    assert Anonymizer(b"sal").int_id(123456789) != Anonymizer(b"outro").int_id(123456789)
+
+
+def test_scrub_keeps_sign_and_commands_and_drops_contact():
+    anon = Anonymizer(b"sal")
+    assert anon.int_id(-1001234567890) < 0
+    assert anon.int_id(123) > 0
+
+    out = anon.scrub(update(123, "/start presente"))["message"]
+    assert out["text"] == "/start presente"
+    assert "contact" not in out
+    assert out["message_id"] == 10
@@ -0,0 +1,33 @@
+import time
+import asyncio
+
+from utils import RateLimiter
+
+
+def test_rate_limiter_keeps_the_rate_after_the_burst():
+    async def run():
+        limiter = RateLimiter(rate=50, burst=5)
+        start = time.monotonic()
+        for _ in range(30):
+            await limiter.acquire()
+        return time.monotonic() - start
+
+    # 5 saem de rajada, os outros 25 a 50/s: ~0.5s
+    elapsed = asyncio.run(run())
+    assert 0.4 <= elapsed < 1.0
+
+
+def test_rate_limiter_pause_holds_every_caller():
+    async def run():
+        limiter = RateLimiter(rate=1000)
+        start = time.monotonic()
+        limiter.pause(0.3)
+        done = await asyncio.gather(*(acquire_at(limiter, start) for _ in range(5)))
+        return min(done)
+
+    async def acquire_at(limiter, start):
+        await limiter.acquire()
+        return time.monotonic() - start
+
+    # com token sobrando, ninguém passa antes do fim da pausa
+    assert asyncio.run(run()) >= 0.3
@@ -0,0 +1,39 @@
+from datetime import date, datetime, timedelta, timezone
+
+import validation
+from validation import build_context, current_context
+
+BRT = timezone(timedelta(hours=-3))
+
+
+def test_context_uses_the_local_date():
+    # 01:30 UTC do dia 20 ainda é dia 19 em São Paulo
+    now = datetime(2026, 10, 20, 1, 30, tzinfo=timezone.utc).timestamp()
+    ctx = build_context(-3, 35.0, now=now)
+
+    assert ctx.day == date(2026, 10, 19)
+    assert ctx.valid_until == datetime(2026, 10, 20, 0, 0, tzinfo=BRT).timestamp()
+    assert "19/10/2026" in ctx.prompt
+    assert ctx.date_is_today("Data/hora: 19/10/2026 22:10") is True
+    assert ctx.date_is_today("Data/hora: 19.10.26") is True
+    assert ctx.date_is_today("Data/hora: 20/10/2026 00:10") is False
+    assert ctx.date_is_today("sem data") is None
+
+
+def test_current_context_rolls_over_at_local_midnight(monkeypatch):
+    midnight = datetime(2026, 10, 20, 0, 0, tzinfo=BRT).timestamp()
+    clock = [midnight - 1]
+    monkeypatch.setattr(validation.time, "time", lambda: clock[0])
+    monkeypatch.setattr(validation, "_current", None)
+
+    before = current_context(-3, 35.0)
+    before.remember("abc", "Aprovado")
+    assert current_context(-3, 35.0) is before
+
+    clock[0] = midnight
+    after = current_context(-3, 35.0)
+    assert after.day == date(2026, 10, 20)
+    assert after.results == {}  # cache da véspera fica com o contexto antigo
+
+    # mudança de valor mínimo também troca o contexto, sem esperar a meia-noite
+    assert current_context(-3, 50.0).min_value == 50.0
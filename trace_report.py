@@ -0,0 +1,131 @@
+"""
+Relatório dos spans gravados pelo tracing.py (TRACE_FILE).
+
+Lê o arquivo atual, os rotacionados (.1, .2, ...) e os dos workers do
+cluster (.w0, .w1, ...), mostra os traces mais lentos com a linha do tempo de
+cada span e, no fim, o tempo por tipo de span (p50/p95/p99).
+
+    python trace_report.py
+    python trace_report.py --top 5 --chat 123456789     # "nunca recebi a imagem"
+    python trace_report.py --since 60 --span telegram.
+"""
+import os
+import glob
+import json
+import time
+import argparse
+from collections import defaultdict
+
+from utils import percentiles
+
+ROOT_SPANS = ("update", "reconcile", "export")  # além de job.*
+
+
+def trace_files(path: str) -> list[str]:
+    root, ext = os.path.splitext(path)
+    patterns = (path, f"{path}.*", f"{root}.w*{ext}", f"{root}.w*{ext}.*")
+    return sorted({f for p in patterns for f in glob.glob(p)})
+
+
+def load_traces(files: list[str], since: float | None = None) -> dict[str, list[dict]]:
+    traces: dict[str, list[dict]] = defaultdict(list)
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue  # linha cortada no meio de uma rotação
+                if since and span["start"] < since:
+                    continue
+                traces[span["trace"]].append(span)
+    return traces
+
+
+def is_root(span: dict) -> bool:
+    return span["span"] in ROOT_SPANS or span["span"].startswith("job.")
+
+
+def summarize(spans: list[dict]) -> dict:
+    start = min(s["start"] for s in spans)
+    end = max(s["start"] + s["ms"] / 1000 for s in spans)
+    root = next((s for s in spans if is_root(s)), spans[0])
+    return {
+        "start": start,
+        "ms": (end - start) * 1000,
+        "chat": root.get("chat"),
+        "label": root.get("update") or root["span"],
+        "errors": sum(1 for s in spans if s.get("error")),
+    }
+
+
+def print_trace(trace_id: str, spans: list[dict]) -> None:
+    info = summarize(spans)
+    when = time.strftime("%d/%m %H:%M:%S", time.localtime(info["start"]))
+    print(
+        f"\n▶ {trace_id}  {info['ms']:.0f} ms  {when}  chat={info['chat']}  {info['label']}"
+        f"  ({len(spans)} spans, {info['errors']} erros)"
+    )
+    for s in sorted(spans, key=lambda s: s["start"]):
+        offset = (s["start"] - info["start"]) * 1000
+        extra = " ".join(
+            f"{k}={v}" for k, v in s.items() if k not in ("trace", "span", "start", "ms", "chat", "update", "error")
+        )
+        error = f"  ❌ {s['error']}" if s.get("error") else ""
+        print(f"  +{offset:>8.0f} ms {s['ms']:>8.1f} ms  {s['span']:<32} {extra}{error}")
+
+
+def print_breakdown(traces: dict[str, list[dict]], prefix: str = "") -> None:
+    by_name: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    for spans in traces.values():
+        for s in spans:
+            if s["span"].startswith(prefix):
+                by_name[s["span"]].append(s["ms"])
+                errors[s["span"]] += 1 if s.get("error") else 0
+
+    print(f"\n{'span':<34} {'n':>7} {'erros':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'total s':>8}")
+    for name, values in sorted(by_name.items(), key=lambda kv: -sum(kv[1])):
+        p = percentiles(values, (50, 95, 99))
+        print(
+            f"{name:<34} {len(values):>7} {errors[name]:>6} {p['p50']:>8.1f} {p['p95']:>8.1f} "
+            f"{p['p99']:>8.1f} {max(values):>8.1f} {sum(values) / 1000:>8.1f}"
+        )
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--file", default=os.getenv("TRACE_FILE") or "traces.ndjson", help="TRACE_FILE usado pelo bot")
+    ap.add_argument("--top", type=int, default=10, help="quantos traces lentos mostrar")
+    ap.add_argument("--chat", type=int, help="só traces deste chat (mais recentes primeiro)")
+    ap.add_argument("--since", type=float, help="só os últimos N minutos")
+    ap.add_argument("--span", default="", help="prefixo dos spans no resumo (ex.: telegram.)")
+    args = ap.parse_args()
+
+    files = trace_files(args.file)
+    if not files:
+        print(f"Nenhum arquivo de trace em {args.file} (o bot grava com TRACE_FILE).")
+        return
+    since = time.time() - args.since * 60 if args.since else None
+    traces = load_traces(files, since)
+    if args.chat is not None:
+        traces = {t: spans for t, spans in traces.items() if any(s.get("chat") == args.chat for s in spans)}
+    if not traces:
+        print("Nenhum trace encontrado.")
+        return
+
+    summaries = {t: summarize(spans) for t, spans in traces.items()}
+    if args.chat is not None:
+        order = sorted(traces, key=lambda t: -summaries[t]["start"])
+        title = f"{len(traces)} traces do chat {args.chat} (mais recentes primeiro)"
+    else:
+        order = sorted(traces, key=lambda t: -summaries[t]["ms"])
+        title = f"{min(args.top, len(traces))} traces mais lentos de {len(traces)}"
+    print(f"{title} — {', '.join(files)}")
+    for trace_id in order[: args.top]:
+        print_trace(trace_id, traces[trace_id])
+    print_breakdown(traces, args.span)
+
+
+if __name__ == "__main__":
+    main()
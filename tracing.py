@@ -0,0 +1,160 @@
+"""
+Tracing leve do funil: um trace por update (ou job) e um span por chamada
+externa (método da Bot API, OpenAI, Google Forms, Pillow) e por etapa do funil.
+
+O trace atual fica num contextvar, então herda para os funis disparados com
+lifecycle.spawn (create_task copia o contexto). Os spans vão como NDJSON para
+TRACE_FILE, com rotação; a escrita em disco é feita por uma thread
+(QueueHandler + QueueListener), o event loop só monta a linha e enfileira.
+A amostragem é por trace
+(TRACE_SAMPLE); spans com erro são gravados sempre, mesmo fora da amostra.
+
+Relatório: python trace_report.py
+"""
+import os
+import json
+import time
+import queue
+import random
+import logging
+import functools
+import logging.handlers
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+log = logging.getLogger("presente-vip-unificado.trace")
+
+BACKUP_COUNT = 5
+
+
+@dataclass
+class Trace:
+    id: str
+    sampled: bool
+    attrs: dict = field(default_factory=dict)
+    started_at: float = field(default_factory=time.perf_counter)
+    started_wall: float = field(default_factory=time.time)
+
+
+_current: ContextVar[Trace | None] = ContextVar("trace", default=None)
+_sample = 0.0
+_logger: logging.Logger | None = None
+_listener: logging.handlers.QueueListener | None = None
+
+
+def configure(path: str, sample: float, max_bytes: int) -> None:
+    """Liga o tracing gravando em `path` (vazio = desligado)."""
+    global _sample, _logger, _listener
+    if not path or _listener:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=BACKUP_COUNT, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(q, handler)
+    _listener.start()
+
+    _logger = logging.getLogger("presente-vip-unificado.trace.spans")
+    _logger.propagate = False
+    _logger.setLevel(logging.INFO)
+    _logger.handlers = [logging.handlers.QueueHandler(q)]
+    _sample = sample
+    log.info("🔎 Tracing em %s (amostra %.0f%%)", path, 100 * sample)
+
+
+def shutdown() -> None:
+    global _listener, _logger
+    if _listener:
+        _listener.stop()  # escreve o que ainda está na fila
+        _listener = None
+        _logger = None
+
+
+def current() -> Trace | None:
+    return _current.get()
+
+
+def _new(attrs: dict) -> Trace | None:
+    if _logger is None:
+        return None
+    return Trace(os.urandom(8).hex(), random.random() < _sample, attrs)
+
+
+def start_trace(**attrs) -> Trace | None:
+    """Abre um trace novo no contexto atual (substitui o anterior)."""
+    trace = _new(attrs)
+    _current.set(trace)
+    return trace
+
+
+def attach(trace: Trace | None) -> None:
+    """Usa `trace` no contexto atual (workers de fila que atendem pedidos de vários traces)."""
+    _current.set(trace)
+
+
+def end_trace(name: str, error: str | None = None) -> None:
+    """Fecha o span raiz do trace atual (da abertura até agora)."""
+    current_trace = _current.get()
+    if current_trace is not None:
+        _emit(
+            current_trace, name, current_trace.started_wall,
+            time.perf_counter() - current_trace.started_at, error, {},
+        )
+
+
+@contextmanager
+def trace(name: str, **attrs):
+    """Trace com span raiz em volta do bloco (para jobs)."""
+    token = _current.set(_new(attrs))
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        end_trace(name, error)
+        _current.reset(token)
+
+
+def traced_job(fn):
+    """Decorator para callbacks do job_queue: um trace por execução, com o chat_id do job."""
+
+    @functools.wraps(fn)  # persist_jobs identifica o callback pelo __name__
+    async def wrapper(context):
+        data = context.job.data if isinstance(context.job.data, dict) else {}
+        with trace(f"job.{fn.__name__}", chat=data.get("chat_id")):
+            return await fn(context)
+
+    return wrapper
+
+
+@contextmanager
+def span(name: str, **attrs):
+    current_trace = _current.get()
+    if current_trace is None:
+        yield attrs
+        return
+    wall, t = time.time(), time.perf_counter()
+    error = None
+    try:
+        yield attrs  # quem chama pode completar os atributos (ex.: status HTTP)
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _emit(current_trace, name, wall, time.perf_counter() - t, error or attrs.pop("error", None), attrs)
+
+
+def _emit(trace: Trace, name: str, wall: float, duration: float, error: str | None, attrs: dict) -> None:
+    if _logger is None or not (trace.sampled or error):
+        return
+    record = {"trace": trace.id, "span": name, "start": round(wall, 6), "ms": round(duration * 1000, 3)}
+    record.update(trace.attrs)
+    record.update(attrs)
+    if error:
+        record["error"] = error
+    _logger.info(json.dumps(record, ensure_ascii=False, default=str))
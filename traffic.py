@@ -0,0 +1,140 @@
+"""
+Gravação do tráfego real de updates para reproduzir depois (replay.py).
+
+Com RECORD_UPDATES=caminho.ndjson.gz, cada Update que chega do Telegram é
+gravado numa linha JSON com o horário de chegada, já anonimizado: ids de
+usuário/chat viram um inteiro derivado de HMAC (o mesmo usuário continua
+sendo o mesmo no arquivo), nomes e textos livres viram hash, comandos e
+callback_data ficam como estão para o replay percorrer os mesmos handlers.
+
+A gravação acontece na fila de updates da Application (RecordingQueue), ou
+seja, no instante em que o Updater entrega o update, antes de qualquer
+handler — rajadas ficam com o espaçamento real mesmo se o bot atrasar.
+"""
+import os
+import gzip
+import hmac
+import json
+import time
+import atexit
+import asyncio
+import hashlib
+import logging
+
+from telegram import Update
+
+log = logging.getLogger("presente-vip-unificado.traffic")
+
+FLUSH_EVERY = 1.0  # segundos até o flush do gzip (um crash perde no máximo isso)
+
+ID_KEYS = {"id", "user_id", "user_chat_id", "chat_id", "sender_chat_id"}
+NAME_KEYS = {"first_name", "last_name", "username", "title", "bio", "invite_link", "name"}
+FILE_KEYS = {"file_id", "file_unique_id"}
+TEXT_KEYS = {"text", "caption"}
+DROP_KEYS = {"contact", "location", "venue", "phone_number", "email"}
+
+
+class Anonymizer:
+    def __init__(self, salt: bytes):
+        self.salt = salt
+
+    def _digest(self, value) -> bytes:
+        return hmac.new(self.salt, str(value).encode(), hashlib.sha256).digest()
+
+    def int_id(self, value: int) -> int:
+        # 48 bits: cabe nos ids do Telegram; o sinal fica (grupos/canais são negativos)
+        h = int.from_bytes(self._digest(value)[:6], "big") or 1
+        return -h if value < 0 else h
+
+    def token(self, value: str, prefix: str = "h") -> str:
+        return prefix + self._digest(value).hex()[:12]
+
+    def text(self, value: str) -> str:
+        # comandos e deep-links (/start presente) definem o handler: ficam
+        if value.startswith("/"):
+            return value
+        return self.token(value, "txt:")
+
+    def scrub(self, obj):
+        if isinstance(obj, list):
+            return [self.scrub(v) for v in obj]
+        if not isinstance(obj, dict):
+            return obj
+        out = {}
+        for key, value in obj.items():
+            if key in DROP_KEYS:
+                continue
+            if key in ID_KEYS and isinstance(value, int) and not isinstance(value, bool):
+                out[key] = self.int_id(value)
+            elif key in NAME_KEYS and isinstance(value, str):
+                out[key] = self.token(value)
+            elif key in FILE_KEYS and isinstance(value, str):
+                out[key] = self.token(value, "file:")
+            elif key in TEXT_KEYS and isinstance(value, str):
+                out[key] = self.text(value)
+            else:
+                out[key] = self.scrub(value)
+        return out
+
+
+class UpdateRecorder:
+    def __init__(self, path: str, salt: str = ""):
+        if not salt:
+            log.warning("RECORD_SALT vazio: usando sal aleatório (ids não batem entre gravações)")
+        self.path = path
+        self.anon = Anonymizer(salt.encode() if salt else os.urandom(16))
+        # modo "ab": gravações seguidas viram membros gzip concatenados, que o leitor junta
+        self._file = gzip.open(path, "ab", compresslevel=6)
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self.count = 0
+        atexit.register(self.close)
+        log.info("📼 Gravando updates em %s", path)
+
+    def record(self, update: Update) -> None:
+        line = {"t": time.time(), "update": self.anon.scrub(update.to_dict())}
+        # compressão em memória; o disco só é tocado quando o buffer do gzip enche ou no flush
+        self._file.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")).encode() + b"\n")
+        self.count += 1
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(FLUSH_EVERY, self.flush)
+
+    def flush(self) -> None:
+        self._flush_handle = None
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._flush_handle:
+            self._flush_handle.cancel()
+        if not self._file.closed:
+            self._file.close()
+            log.info("📼 %s updates gravados em %s", self.count, self.path)
+
+
+class RecordingQueue(asyncio.Queue):
+    """Fila de updates da Application que grava cada Update ao entrar."""
+
+    def __init__(self, recorder: UpdateRecorder):
+        super().__init__()
+        self.recorder = recorder
+
+    def put_nowait(self, item) -> None:
+        if isinstance(item, Update):
+            try:
+                self.recorder.record(item)
+            except Exception:
+                log.exception("Falha ao gravar update %s", item.update_id)
+        super().put_nowait(item)
+
+
+def read_records(path: str):
+    """(horário de chegada, dict do update) em ordem de gravação."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    yield rec["t"], rec["update"]
+        except EOFError:
+            # processo morto sem fechar o gzip: vale o que foi gravado até o último flush
+            log.warning("%s termina sem o fim do gzip; usando o que foi gravado", path)
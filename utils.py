@@ -1,4 +1,51 @@
+import asyncio
+import time
 from urllib.parse import quote
 
 def deep_link(bot_username: str, start_param: str) -> str:
     return f"https://t.me/{bot_username}?start={quote(start_param)}"
+
+
+class RateLimiter:
+    """
+    Token bucket simples: no máximo `rate` operações por segundo, com rajada de `burst`.
+    `pause(s)` segura todo mundo que divide o limiter (ex.: RetryAfter do Telegram).
+    """
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    # sem rajada na volta da pausa
+                    self._tokens = 0.0
+                    self._last = time.monotonic()
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def percentiles(values, points=(50, 90, 99)) -> dict[str, float]:
+    ordered = sorted(values)
+    if not ordered:
+        return {f"p{p}": 0.0 for p in points}
+    return {
+        f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+        for p in points
+    }
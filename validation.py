@@ -0,0 +1,91 @@
+"""
+Contexto da validação de print, calculado uma vez por dia.
+
+O prompt, as datas aceitas e o valor mínimo só mudam na virada do dia
+(meia-noite em TZ_OFFSET_HOURS) ou quando MIN_DEPOSIT_VALUE muda. No caminho
+quente, current_context() só compara um timestamp; a troca do contexto é uma
+atribuição de referência, e o cache de resultados (por hash da imagem) vai
+junto com o contexto antigo.
+"""
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+
+MAX_CACHED_RESULTS = 10_000
+
+# 19.10.26, 19/10/2026, 2026-10-19, 9/1/2026...
+DATE_RE = re.compile(r"\b(\d{1,4}[./-]\d{1,2}[./-]\d{2,4})\b")
+
+
+def accepted_date_strings(d: date) -> frozenset[str]:
+    days = {f"{d.day:02d}", str(d.day)}
+    months = {f"{d.month:02d}", str(d.month)}
+    years = {f"{d.year:04d}", f"{d.year % 100:02d}"}
+    out = {
+        f"{dd}{sep}{mm}{sep}{yy}"
+        for dd in days for mm in months for yy in years for sep in "./-"
+    }
+    out.add(d.isoformat())
+    return frozenset(out)
+
+
+@dataclass(frozen=True)
+class ValidationContext:
+    day: date
+    valid_until: float  # epoch da próxima meia-noite local
+    min_value: float
+    prompt: str
+    accepted_dates: frozenset[str]
+    results: dict[str, str] = field(default_factory=dict, compare=False)  # sha256 -> resposta
+
+    def date_is_today(self, text: str) -> bool | None:
+        """True/False se a resposta tem alguma data; None se não achou data nenhuma."""
+        found = DATE_RE.findall(text)
+        if not found:
+            return None
+        return any(token in self.accepted_dates for token in found)
+
+    def remember(self, digest: str, text: str) -> None:
+        if len(self.results) >= MAX_CACHED_RESULTS:
+            self.results.clear()
+        self.results[digest] = text
+
+
+def build_context(tz_offset_hours: int, min_value: float, now: float | None = None) -> ValidationContext:
+    tz = timezone(timedelta(hours=tz_offset_hours))
+    local_now = datetime.fromtimestamp(now if now is not None else time.time(), tz)
+    today = local_now.date()
+    midnight = datetime(today.year, today.month, today.day, tzinfo=tz) + timedelta(days=1)
+
+    rules = (
+        "Considere APROVADO se status='Concluído', valor >= "
+        f"{min_value:.2f} e a data do depósito é IGUAL a {today:%d/%m/%Y}."
+    )
+    prompt = (
+        "Analise APENAS o item de Depósito que está expandido (seta para cima). "
+        "Extraia valor (número), data/hora (texto) e status. "
+        + rules
+        + " Responda curto em PT-BR:\n- Valor\n- Data/hora (data no formato DD/MM/AAAA)\n"
+          "- Resultado: Aprovado/Reprovado (explique motivo se reprovar)."
+    )
+
+    return ValidationContext(
+        day=today,
+        valid_until=midnight.timestamp(),
+        min_value=min_value,
+        prompt=prompt,
+        accepted_dates=accepted_date_strings(today),
+    )
+
+
+_current: ValidationContext | None = None
+
+
+def current_context(tz_offset_hours: int, min_value: float) -> ValidationContext:
+    global _current
+    ctx = _current
+    if ctx is None or time.time() >= ctx.valid_until or ctx.min_value != min_value:
+        ctx = build_context(tz_offset_hours, min_value)
+        _current = ctx
+    return ctx